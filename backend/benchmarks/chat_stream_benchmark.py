@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+流式聊天并发测试
+功能：同时发起多个 /api/chat 流式请求，统计全部完成的耗时、首块延迟和失败数，
+配合 benchmarks/mock_llm_server.py 测试单个进程能同时承载多少路流式输出
+
+用法: python benchmarks/chat_stream_benchmark.py [--url URL] [--concurrency 200] [--session-id ID]
+"""
+
+import json
+import time
+import argparse
+import statistics
+import threading
+from collections import Counter
+import requests
+
+def stream_once(url, session_id, results, lock):
+    payload = {'messages': [{'role': 'user', 'content': '今天的市场怎么样？'}], 'stream': True}
+    if session_id:
+        payload['session_id'] = session_id
+    start = time.perf_counter()
+    first_chunk = None
+    ok = False
+    error = None
+    try:
+        with requests.post(f'{url}/api/chat', json=payload, stream=True, timeout=120) as response:
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                data = json.loads(line)
+                if 'error' in data:
+                    error = data['error']
+                    break
+                if 'chunk' in data:
+                    if first_chunk is None:
+                        first_chunk = time.perf_counter() - start
+                if data.get('finish'):
+                    ok = True
+    except Exception as e:
+        ok, error = False, type(e).__name__
+    with lock:
+        results.append((ok, first_chunk, time.perf_counter() - start, error))
+
+def main():
+    parser = argparse.ArgumentParser(description='并发流式聊天测试')
+    parser.add_argument('--url', default='http://localhost:8000')
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--session-id', help='写入指定会话（需要数据库），默认不使用会话')
+    args = parser.parse_args()
+
+    results, lock = [], threading.Lock()
+    threads = [
+        threading.Thread(target=stream_once, args=(args.url, args.session_id, results, lock))
+        for _ in range(args.concurrency)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    succeeded = [result for result in results if result[0]]
+    print(f'{args.concurrency} 路并发流式请求, 成功 {len(succeeded)}, 失败 {len(results) - len(succeeded)}, 总用时 {elapsed:.1f}s')
+    errors = Counter(result[3] or '未正常结束' for result in results if not result[0])
+    for error, count in errors.most_common():
+        print(f'  失败原因 {error}: {count}')
+    if succeeded:
+        first_chunks = sorted(result[1] for result in succeeded)
+        totals = sorted(result[2] for result in succeeded)
+        print(f'首块延迟: 中位数 {statistics.median(first_chunks) * 1000:.0f}ms, 最大 {first_chunks[-1] * 1000:.0f}ms')
+        print(f'单路总耗时: 中位数 {statistics.median(totals):.2f}s, 最大 {totals[-1]:.2f}s')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+大模型突发请求测试
+功能：同时发起一批 /api/generate 请求（相同或各不相同的提示词），统计成功数、失败原因和耗时，
+配合 benchmarks/mock_llm_server.py --max-concurrency 测试突发流量下的请求合并和并发限制
+
+用法: python benchmarks/llm_burst_benchmark.py [--url URL] [--concurrency 200] [--distinct]
+"""
+
+import time
+import uuid
+import argparse
+import statistics
+import threading
+from collections import Counter
+import requests
+
+def generate_once(url, prompt, results, lock):
+    # no-store 绕过响应缓存，只测试请求合并和并发限制
+    payload = {'prompt': prompt, 'cache_control': 'no-store'}
+    start = time.perf_counter()
+    try:
+        data = requests.post(f'{url}/api/generate', json=payload, timeout=120).json()
+        if not data.get('success'):
+            error = data['error']['code']
+        elif 'error' in data['data']:
+            error = data['data']['error'][:40]
+        else:
+            error = None
+    except Exception as e:
+        error = type(e).__name__
+    with lock:
+        results.append((error, time.perf_counter() - start))
+
+def main():
+    parser = argparse.ArgumentParser(description='大模型突发请求测试')
+    parser.add_argument('--url', default='http://localhost:8000')
+    parser.add_argument('--concurrency', type=int, default=200)
+    parser.add_argument('--distinct', action='store_true', help='每个请求使用不同的提示词，默认全部相同')
+    args = parser.parse_args()
+
+    run_id = uuid.uuid4().hex[:8]
+    results, lock = [], threading.Lock()
+    threads = [
+        threading.Thread(
+            target=generate_once,
+            args=(args.url, f'{run_id} 今天的市场怎么样？' + (f' #{i}' if args.distinct else ''), results, lock)
+        )
+        for i in range(args.concurrency)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    succeeded = [result for result in results if result[0] is None]
+    kind = '不同' if args.distinct else '相同'
+    print(f'{args.concurrency} 个{kind}的并发请求, 成功 {len(succeeded)}, 失败 {len(results) - len(succeeded)}, 总用时 {elapsed:.1f}s')
+    for error, count in Counter(result[0] for result in results if result[0]).most_common():
+        print(f'  失败原因 {error}: {count}')
+    if succeeded:
+        latencies = sorted(result[1] for result in succeeded)
+        print(f'成功请求耗时: 中位数 {statistics.median(latencies):.2f}s, 最大 {latencies[-1]:.2f}s')
+
+if __name__ == '__main__':
+    main()
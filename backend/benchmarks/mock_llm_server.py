@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地模拟大模型服务
+功能：实现 /chat/completions 接口，按固定间隔以 SSE 格式逐块返回内容，
+用于在不调用真实 DeepSeek API 的情况下压测 /api/chat 的流式输出；
+可以像真实服务一样限制并发，超出时返回 429，退出时打印收到的请求数和最大并发
+
+用法: python benchmarks/mock_llm_server.py [--port 9000] [--chunks 20] [--interval 0.05] [--max-concurrency 0]
+后端设置 AI_API_BASE=http://localhost:9000 和任意 AI_API_KEY 即可
+"""
+
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class MockLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    chunks = 20
+    interval = 0.05
+    # 同时处理的请求数上限，0 表示不限制
+    max_concurrency = 0
+    lock = threading.Lock()
+    stats = {'requests': 0, 'rejected': 0, 'active': 0, 'max_active': 0}
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        with self.lock:
+            self.stats['requests'] += 1
+            rejected = self.max_concurrency and self.stats['active'] >= self.max_concurrency
+            if rejected:
+                self.stats['rejected'] += 1
+            else:
+                self.stats['active'] += 1
+                self.stats['max_active'] = max(self.stats['max_active'], self.stats['active'])
+        if rejected:
+            body = b'{"error": {"message": "Too many concurrent requests"}}'
+            self.send_response(429)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        try:
+            self._respond(payload)
+        finally:
+            with self.lock:
+                self.stats['active'] -= 1
+
+    def _respond(self, payload):
+        if not payload.get('stream'):
+            time.sleep(self.chunks * self.interval)
+            body = json.dumps({
+                'choices': [{'message': {'role': 'assistant', 'content': '模拟回复' * self.chunks}}],
+                'usage': {'prompt_tokens': 10, 'completion_tokens': self.chunks, 'total_tokens': 10 + self.chunks}
+            }).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        for i in range(self.chunks):
+            time.sleep(self.interval)
+            self._write_event({'choices': [{'delta': {'content': f'块{i}'}}]})
+        self._write_event({'choices': [{'delta': {}}], 'usage': {'prompt_tokens': 10, 'completion_tokens': self.chunks, 'total_tokens': 10 + self.chunks}})
+        self._write_chunk(b'data: [DONE]\n\n')
+        self._write_chunk(b'')
+
+    def _write_event(self, data):
+        self._write_chunk(f'data: {json.dumps(data, ensure_ascii=False)}\n\n'.encode('utf-8'))
+
+    def _write_chunk(self, data):
+        self.wfile.write(f'{len(data):x}\r\n'.encode('ascii') + data + b'\r\n')
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+class MockLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # 监听队列需容纳压测时的瞬时并发连接
+    request_queue_size = 1024
+
+def main():
+    parser = argparse.ArgumentParser(description='模拟大模型的流式接口')
+    parser.add_argument('--port', type=int, default=9000)
+    parser.add_argument('--chunks', type=int, default=20, help='每次回复的块数')
+    parser.add_argument('--interval', type=float, default=0.05, help='块之间的间隔（秒）')
+    parser.add_argument('--max-concurrency', type=int, default=0, help='并发上限，超出时返回 429，0 表示不限制')
+    args = parser.parse_args()
+    MockLLMHandler.chunks = args.chunks
+    MockLLMHandler.interval = args.interval
+    MockLLMHandler.max_concurrency = args.max_concurrency
+    server = MockLLMServer(('0.0.0.0', args.port), MockLLMHandler)
+    print(f'模拟大模型服务运行在 http://localhost:{args.port}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(f'收到请求 {MockLLMHandler.stats["requests"]}, 返回 429 {MockLLMHandler.stats["rejected"]}, 最大并发 {MockLLMHandler.stats["max_active"]}')
+
+if __name__ == '__main__':
+    main()
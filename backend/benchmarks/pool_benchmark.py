@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+连接池压测
+功能：用多个并发客户端持续请求新闻接口，统计延迟和错误数，并对比压测前后的
+连接池指标（/api/db/pool/stats），确认高并发下没有出现连接池耗尽
+
+用法: python benchmarks/pool_benchmark.py [--url URL] [--path PATH] [--concurrency N] [--requests N]
+"""
+
+import time
+import argparse
+import statistics
+import threading
+import requests
+
+DEFAULT_PATHS = ['/api/news?page_size=20', '/api/news/hot', '/api/news/categories']
+
+def worker(base_url, paths, count, timings, errors, lock):
+    """顺序发送 count 个请求，记录每个请求的耗时（毫秒）"""
+    session = requests.Session()
+    for i in range(count):
+        path = paths[i % len(paths)]
+        start = time.perf_counter()
+        try:
+            response = session.get(base_url + path, timeout=30)
+            ok = response.status_code == 200 and response.json().get('success') is not False
+        except Exception:
+            ok = False
+        elapsed = (time.perf_counter() - start) * 1000
+        with lock:
+            timings.append(elapsed)
+            if not ok:
+                errors.append(path)
+
+def pool_stats(base_url):
+    return requests.get(base_url + '/api/db/pool/stats', timeout=10).json()['data']
+
+def main():
+    parser = argparse.ArgumentParser(description='并发请求新闻接口，检查数据库连接池')
+    parser.add_argument('--url', default='http://localhost:8000')
+    parser.add_argument('--path', action='append', dest='paths')
+    parser.add_argument('--concurrency', type=int, default=50)
+    parser.add_argument('--requests', type=int, default=40, help='每个客户端的请求数')
+    args = parser.parse_args()
+    paths = args.paths or DEFAULT_PATHS
+
+    before = pool_stats(args.url)
+    timings, errors, lock = [], [], threading.Lock()
+    threads = [
+        threading.Thread(target=worker, args=(args.url, paths, args.requests, timings, errors, lock))
+        for _ in range(args.concurrency)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    after = pool_stats(args.url)
+
+    timings.sort()
+    print(f'{len(timings)} 个请求, {args.concurrency} 并发, 用时 {elapsed:.1f}s, {len(timings) / elapsed:.0f} req/s')
+    print(f'延迟: 平均 {statistics.mean(timings):.1f}ms, 中位数 {statistics.median(timings):.1f}ms, '
+          f'p95 {timings[int(len(timings) * 0.95) - 1]:.1f}ms, p99 {timings[int(len(timings) * 0.99) - 1]:.1f}ms')
+    print(f'失败请求: {len(errors)}')
+    print(f'连接池: 取连接 {after["checkouts"] - before["checkouts"]} 次, '
+          f'超时 {after["timeouts"] - before["timeouts"]} 次, 新建连接 {after["connects"] - before["connects"]} 个, '
+          f'最大等待 {after["max_wait_ms"]}ms, 压测后借出 {after["checked_out"]} 个')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+搜索引擎基准测试
+功能：对同一组关键词分别用 LIKE 基线和 FULLTEXT 引擎执行 NewsService.search_news，
+对比每次查询的耗时和命中数
+
+用法: python benchmarks/search_benchmark.py [关键词 ...] [--rounds N]
+"""
+
+import os
+import sys
+import time
+import argparse
+import statistics
+
+# 添加上级目录到系统路径，以便导入服务模块
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from spiders.database_news import SessionLocal
+from services.news_service import NewsService
+from services.search_engine import SEARCH_ENGINES, get_search_engine
+
+DEFAULT_KEYWORDS = ['人工智能', '央行', '芯片', '新能源汽车', 'A股 港股']
+
+def run(engine_name, keywords, rounds):
+    """执行一组搜索，返回每次查询的耗时（毫秒）和总命中数"""
+    db = SessionLocal()
+    try:
+        service = NewsService(db, search_engine=get_search_engine(engine_name))
+        timings = []
+        hits = {}
+        for _ in range(rounds):
+            for keyword in keywords:
+                start = time.perf_counter()
+                result = service.search_news(keyword=keyword, page_size=20)
+                timings.append((time.perf_counter() - start) * 1000)
+                hits[keyword] = result['pagination']['total']
+        return timings, hits
+    finally:
+        db.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='对比新闻搜索引擎的查询耗时')
+    parser.add_argument('keywords', nargs='*', default=DEFAULT_KEYWORDS)
+    parser.add_argument('--rounds', type=int, default=5)
+    args = parser.parse_args()
+
+    for name in SEARCH_ENGINES:
+        timings, hits = run(name, args.keywords, args.rounds)
+        timings.sort()
+        p95 = timings[int(len(timings) * 0.95) - 1] if len(timings) >= 20 else timings[-1]
+        print(f'[{name}] 查询 {len(timings)} 次: '
+              f'平均 {statistics.mean(timings):.1f}ms, 中位数 {statistics.median(timings):.1f}ms, p95 {p95:.1f}ms')
+        for keyword, total in hits.items():
+            print(f'    {keyword}: {total} 条')
+
+if __name__ == '__main__':
+    main()
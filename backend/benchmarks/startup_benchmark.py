@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+启动耗时基准测试
+功能：在独立子进程中多次导入 main（创建 Flask 应用、Redis 客户端、服务对象），
+统计导入耗时；同时调用一次 /ready，确认数据库不可用时进程能正常启动并报告未就绪
+
+默认把数据库指向不可达的地址，模拟数据库尚未启动的情况；加 --use-env 使用当前环境变量。
+
+用法: python benchmarks/startup_benchmark.py [--rounds N] [--use-env]
+"""
+
+import os
+import sys
+import json
+import argparse
+import statistics
+import subprocess
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 子进程中执行：计时导入 main，再请求一次就绪检查
+PROBE = '''
+import json, time
+start = time.perf_counter()
+import main
+import_ms = (time.perf_counter() - start) * 1000
+start = time.perf_counter()
+response = main.app.test_client().get("/ready")
+ready_ms = (time.perf_counter() - start) * 1000
+print(json.dumps({"import_ms": import_ms, "ready_ms": ready_ms, "status": response.status_code}))
+'''
+
+def run_once(env):
+    output = subprocess.run(
+        [sys.executable, '-c', PROBE], cwd=BACKEND_DIR, env=env,
+        capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description='测量后端进程的启动耗时')
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--use-env', action='store_true', help='使用当前环境变量中的数据库配置')
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    if not args.use_env:
+        # TEST-NET 地址，连接会超时而不是立即被拒绝
+        env.update({'DB_HOST': '192.0.2.1', 'DB_CONNECT_TIMEOUT': '1', 'REDIS_URL': 'redis://192.0.2.1:6379/0'})
+
+    results = [run_once(env) for _ in range(args.rounds)]
+    import_times = [result['import_ms'] for result in results]
+    print(f'导入 main {args.rounds} 次: 平均 {statistics.mean(import_times):.0f}ms, '
+          f'最小 {min(import_times):.0f}ms, 最大 {max(import_times):.0f}ms')
+    print(f'/ready 返回 {results[-1]["status"]}, 耗时 {results[-1]["ready_ms"]:.0f}ms')
+
+if __name__ == '__main__':
+    main()
@@ -31,7 +31,12 @@ CREATE TABLE IF NOT EXISTS `news` (
   `has_image` BOOLEAN DEFAULT FALSE,
   `image_url` VARCHAR(500),
   `summary` VARCHAR(500),
-  `url` VARCHAR(500) UNIQUE
+  `url` VARCHAR(500) UNIQUE,
+  `simhash` BIGINT,
+  INDEX `idx_publish_time_id` (`publish_time`, `id`),
+  INDEX `idx_views_id` (`views`, `id`),
+  INDEX `idx_simhash` (`simhash`),
+  FULLTEXT INDEX `ft_title_content` (`title`, `content`) WITH PARSER ngram
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
 -- 新闻分类关系表
@@ -52,6 +57,26 @@ CREATE TABLE IF NOT EXISTS `news_tag_relation` (
   FOREIGN KEY (`tag_id`) REFERENCES `news_tags` (`id`) ON DELETE CASCADE
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
+-- 相关新闻表
+CREATE TABLE IF NOT EXISTS `news_related` (
+  `news_id` INT NOT NULL,
+  `related_id` INT NOT NULL,
+  `score` FLOAT NOT NULL,
+  PRIMARY KEY (`news_id`, `related_id`),
+  FOREIGN KEY (`news_id`) REFERENCES `news` (`id`) ON DELETE CASCADE,
+  FOREIGN KEY (`related_id`) REFERENCES `news` (`id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
+-- 近似重复新闻表
+CREATE TABLE IF NOT EXISTS `news_duplicates` (
+  `url` VARCHAR(500) NOT NULL PRIMARY KEY,
+  `news_id` INT NOT NULL,
+  `distance` INT NOT NULL,
+  `created_at` DATETIME DEFAULT CURRENT_TIMESTAMP,
+  INDEX `idx_news_id` (`news_id`),
+  FOREIGN KEY (`news_id`) REFERENCES `news` (`id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
+
 -- 用户表
 CREATE TABLE IF NOT EXISTS `users` (
   `id` INT AUTO_INCREMENT PRIMARY KEY,
@@ -68,6 +93,7 @@ CREATE TABLE IF NOT EXISTS `sessions` (
   `id` VARCHAR(36) PRIMARY KEY,
   `user_id` INT,
   `title` VARCHAR(200) DEFAULT '新会话',
+  `message_count` INT NOT NULL DEFAULT 0,
   `created_at` DATETIME DEFAULT CURRENT_TIMESTAMP,
   `updated_at` DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
   FOREIGN KEY (`user_id`) REFERENCES `users` (`id`) ON DELETE CASCADE,
@@ -80,9 +106,11 @@ CREATE TABLE IF NOT EXISTS `messages` (
   `session_id` VARCHAR(36) NOT NULL,
   `role` VARCHAR(20) NOT NULL,
   `content` TEXT NOT NULL,
+  `seq` INT,
   `created_at` DATETIME DEFAULT CURRENT_TIMESTAMP,
   FOREIGN KEY (`session_id`) REFERENCES `sessions` (`id`) ON DELETE CASCADE,
   INDEX `idx_session_id` (`session_id`),
+  UNIQUE INDEX `idx_session_seq` (`session_id`, `seq`),
   INDEX `idx_created_at` (`created_at`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
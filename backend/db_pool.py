@@ -0,0 +1,109 @@
+import os
+import time
+import threading
+from typing import Any, Dict
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+# 连接池配置，均可通过环境变量调整
+POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 20))
+# 获取连接的最长等待时间（秒），超时抛出 sqlalchemy.exc.TimeoutError
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 10))
+# 连接最长使用时间（秒），需小于 MySQL 的 wait_timeout，避免拿到已被服务端断开的连接
+POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+# 取出连接前先 ping 一次，失效的连接会被透明地重建
+POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+
+class PoolMetrics:
+    """连接池的累计指标：取连接次数、等待耗时、超时、新建和失效连接数"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {
+            "checkouts": 0,
+            "timeouts": 0,
+            "connects": 0,
+            "invalidations": 0,
+            "wait_time_ms": 0.0,
+            "max_wait_ms": 0.0
+        }
+
+    def record_wait(self, start: float, timed_out: bool = False) -> None:
+        elapsed = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self._stats["wait_time_ms"] += elapsed
+            self._stats["max_wait_ms"] = max(self._stats["max_wait_ms"], elapsed)
+            self._stats["timeouts" if timed_out else "checkouts"] += 1
+
+    def incr(self, counter: str) -> None:
+        with self._lock:
+            self._stats[counter] += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+        waits = stats["checkouts"] + stats["timeouts"]
+        return {
+            "checkouts": stats["checkouts"],
+            "timeouts": stats["timeouts"],
+            "connects": stats["connects"],
+            "invalidations": stats["invalidations"],
+            "avg_wait_ms": round(stats["wait_time_ms"] / waits, 3) if waits else None,
+            "max_wait_ms": round(stats["max_wait_ms"], 3)
+        }
+
+class MeteredQueuePool(QueuePool):
+    """记录每次从池中取连接的等待时间的 QueuePool，指标记录在子类的 metrics 上"""
+
+    metrics: PoolMetrics = None
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except exc.TimeoutError:
+            self.metrics.record_wait(start, timed_out=True)
+            raise
+        self.metrics.record_wait(start)
+        return connection
+
+def engine_options() -> Dict[str, Any]:
+    """create_engine 的连接池参数，每次调用得到一份独立的指标"""
+    # 每个引擎使用单独的子类，engine.dispose() 重建连接池后指标仍然保留
+    poolclass = type("MeteredQueuePool", (MeteredQueuePool,), {"metrics": PoolMetrics()})
+    return {
+        "poolclass": poolclass,
+        "pool_size": POOL_SIZE,
+        "max_overflow": MAX_OVERFLOW,
+        "pool_timeout": POOL_TIMEOUT,
+        "pool_recycle": POOL_RECYCLE,
+        "pool_pre_ping": POOL_PRE_PING
+    }
+
+def instrument_engine(engine) -> None:
+    """注册新建连接和连接失效的事件计数"""
+    metrics = engine.pool.metrics
+    event.listen(engine, "connect", lambda *args: metrics.incr("connects"))
+    event.listen(engine, "invalidate", lambda *args: metrics.incr("invalidations"))
+
+def pool_status(engine) -> Dict[str, Any]:
+    """
+    返回连接池的当前状态和本进程的累计指标
+
+    Args:
+        engine: 数据库引擎
+
+    Returns:
+        池大小、已借出、空闲、溢出连接数以及等待耗时等指标
+    """
+    pool = engine.pool
+    return {
+        "size": pool.size(),
+        "max_overflow": MAX_OVERFLOW,
+        "checked_out": pool.checkedout(),
+        "checked_in": pool.checkedin(),
+        # overflow() 为负数表示池还未填满
+        "overflow": max(pool.overflow(), 0),
+        **pool.metrics.snapshot()
+    }
@@ -0,0 +1,33 @@
+from flask import g
+
+_session_factory = None
+
+def get_request_db():
+    """
+    返回当前请求的数据库会话，同一请求内多次调用得到同一会话；
+    会话在请求结束时由 teardown 钩子关闭，连接归还连接池
+    """
+    if "db" not in g:
+        g.db = _session_factory()
+    return g.db
+
+def close_request_db(exception=None):
+    db = g.pop("db", None)
+    if db is None:
+        return
+    # 请求异常结束时回滚未提交的事务，再把连接还给连接池
+    if exception is not None:
+        db.rollback()
+    db.close()
+
+def init_db_session(app, session_factory):
+    """
+    注册请求级数据库会话
+
+    Args:
+        app: Flask 应用
+        session_factory: 会话工厂（SessionLocal）
+    """
+    global _session_factory
+    _session_factory = session_factory
+    app.teardown_appcontext(close_request_db)
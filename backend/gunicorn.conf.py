@@ -0,0 +1,50 @@
+"""
+gunicorn 配置，所有参数都可通过环境变量覆盖
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+工作模式由 GUNICORN_WORKER_CLASS 选择，未设置时安装了 gevent 就使用 gevent：
+- gevent：协程模式，每路流式聊天只占用一个协程，适合大量并发的流式请求
+- gthread：每个工作进程 GUNICORN_THREADS 个线程，每路流式聊天占用一个线程
+"""
+
+import os
+import importlib.util
+import multiprocessing
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+worker_class = os.getenv("GUNICORN_WORKER_CLASS") or ("gevent" if importlib.util.find_spec("gevent") else "gthread")
+threads = int(os.getenv("GUNICORN_THREADS", 4))
+# gevent 模式下每个工作进程的最大并发连接数
+worker_connections = int(os.getenv("GUNICORN_WORKER_CONNECTIONS", 1000))
+
+# 主进程导入一次应用再 fork，工作进程共享只读内存、启动更快；
+# 连接和后台线程在 post_fork 中按进程重新建立
+preload_app = os.getenv("GUNICORN_PRELOAD", "true").lower() == "true"
+
+# 流式聊天响应可能持续较长时间
+timeout = int(os.getenv("GUNICORN_TIMEOUT", 120))
+# 收到 SIGTERM 后等待进行中请求完成的时间
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", 5))
+# 处理一定数量请求后重启工作进程，0 表示不重启
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", 0))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", 0))
+
+accesslog = os.getenv("GUNICORN_ACCESS_LOG", "-")
+errorlog = "-"
+loglevel = os.getenv("GUNICORN_LOG_LEVEL", "info")
+
+if worker_class == "gevent":
+    # 在导入应用（redis、pymysql、requests）之前打补丁，预加载时也能生效
+    from gevent import monkey
+    monkey.patch_all()
+
+def post_fork(server, worker):
+    import main
+    main.init_worker()
+
+def worker_exit(server, worker):
+    import main
+    main.shutdown_worker()
@@ -4,12 +4,23 @@ import redis
 import random
 from datetime import timedelta
 from dotenv import load_dotenv
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity
+from flask_jwt_extended import create_access_token
 from services.ai_service import AIService
-from services.news_service import NewsService
-from services.user_service import UserService
-from spiders.database_news import get_db, News, NewsCategory, NewsTag
+from services.news_service import NewsService, resolve_fields
+from services.news_cache import NewsCache, LIST_TTL, DETAIL_TTL, HOT_TTL, TAXONOMY_TTL
+from services.llm_cache import LLMCache
+from services.context_window import ContextWindow
+from services.llm_limiter import ConcurrencyLimiter
+from services.session_store import MemorySessionStore, RedisSessionStore
+from services.session_cache import SessionCache
+from services.view_counter import ViewCounter
+from services.trending import TrendingRanking
+from services.user_service import UserService, USER_NEWS_FIELDS
+from spiders.database_news import SessionLocal, get_engine, get_replica_engine, check_db, dispose_engines
 from extensions import bcrypt, jwt, mail
+from response_hooks import init_response_hooks, discard_validator
+from db_session import init_db_session, get_request_db
+from db_pool import pool_status
 from flask_mail import Message
 
 # 加载环境变量
@@ -39,8 +50,55 @@ mail.init_app(app)
 redis_url = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
 redis_client = redis.from_url(redis_url)
 
-# 初始化 AI 服务
-ai_service = AIService()
+# 初始化新闻缓存（NEWS_CACHE_ENABLED=false 时关闭）
+news_cache = NewsCache(redis_client) if os.getenv('NEWS_CACHE_ENABLED', 'true').lower() == 'true' else None
+
+# 初始化阅读量计数器，阅读量先写 Redis，由后台线程批量写回数据库（线程由 init_worker 启动）
+view_counter = ViewCounter(redis_client)
+
+# 初始化按时间衰减的热度排行
+trending = TrendingRanking(redis_client)
+
+# 初始化大模型响应缓存（LLM_CACHE_ENABLED=false 时关闭）
+llm_cache = LLMCache(redis_client) if os.getenv('LLM_CACHE_ENABLED', 'true').lower() == 'true' else None
+
+# 数据库不可用时的会话存储：默认保存在 Redis 中，多个工作进程共享（Redis 也不可用时退回进程内）；
+# SESSION_STORE=memory 时保存在进程内
+session_store = MemorySessionStore() if os.getenv('SESSION_STORE', 'redis').lower() == 'memory' else RedisSessionStore(redis_client)
+
+# 活跃会话消息的 Redis 写穿缓存（SESSION_CACHE_ENABLED=false 时关闭），每轮对话不必再从数据库读取历史
+session_cache = SessionCache(redis_client) if os.getenv('SESSION_CACHE_ENABLED', 'true').lower() == 'true' else None
+
+# 初始化 AI 服务，对话历史按 token 预算裁剪，更早的消息以缓存在 Redis 中的滚动摘要代替；
+# 上游调用的并发名额保存在 Redis 中，上限对全部工作进程合计生效
+ai_service = AIService(
+    cache=llm_cache,
+    context_window=ContextWindow(redis_client),
+    session_store=session_store,
+    session_cache=session_cache,
+    limiter=ConcurrencyLimiter(redis_client)
+)
+
+def init_worker():
+    """
+    工作进程初始化：丢弃从父进程继承的连接并启动后台线程
+
+    模块导入时只创建对象、不建立连接，因此 gunicorn 可以在主进程预加载应用；
+    fork 出的每个工作进程再调用本函数（见 gunicorn.conf.py 的 post_fork）。
+    """
+    redis_client.connection_pool.reset()
+    dispose_engines()
+    ai_service.http.reset()
+    view_counter.start_flusher(SessionLocal)
+    if ai_service.writer is not None:
+        ai_service.writer.start()
+
+def shutdown_worker():
+    """工作进程退出：停止后台线程，把未写回的阅读量和对话消息写入数据库，然后关闭连接池"""
+    view_counter.stop_flusher(SessionLocal)
+    if ai_service.writer is not None:
+        ai_service.writer.stop()
+    dispose_engines()
 
 # 配置 CORS
 @app.after_request
@@ -50,8 +108,40 @@ def after_request(response):
     response.headers.add('Access-Control-Allow-Methods', 'GET,POST,PUT,DELETE,OPTIONS')
     return response
 
+# 处理请求前即可生成 ETag 的新闻接口：端点 -> (缓存作用域, 有效期)，与接口缓存同时失效
+CONDITIONAL_ENDPOINTS = {
+    'get_news_list': ('news', LIST_TTL),
+    'search_news': ('news', LIST_TTL),
+    'get_news_by_category': ('news', LIST_TTL),
+    'get_news_by_tag': ('news', LIST_TTL),
+    'get_hot_news': ('news', HOT_TTL),
+    'get_trending_news': ('news', HOT_TTL),
+    'get_news_detail': ('detail', DETAIL_TTL),
+    'get_news_batch': ('detail', DETAIL_TTL),
+    'get_related_news': ('related', DETAIL_TTL),
+    'get_categories': ('taxonomy', TAXONOMY_TTL),
+    'get_tags': ('taxonomy', TAXONOMY_TTL)
+}
+
+def news_validator():
+    """新闻接口按缓存代数生成验证值，未启用新闻缓存时和其他接口一样由响应体生成 ETag"""
+    if news_cache is None or request.endpoint not in CONDITIONAL_ENDPOINTS:
+        return None
+    return news_cache.validator(*CONDITIONAL_ENDPOINTS[request.endpoint])
+
+# ETag 条件请求和响应压缩；新闻接口未变化时在查询数据库前返回 304
+init_response_hooks(app, validator=news_validator)
+
+# 请求级数据库会话，请求结束时自动关闭
+init_db_session(app, SessionLocal)
+
+def get_news_service():
+    """创建绑定当前请求数据库会话的新闻服务"""
+    return NewsService(get_request_db(), cache=news_cache, view_counter=view_counter, trending=trending)
+
 # 错误处理
 def error_response(code: str, message: str):
+    discard_validator()
     return jsonify({
         "success": False,
         "error": {
@@ -76,8 +166,28 @@ def read_root():
 def health_check():
     return jsonify({"status": "healthy"})
 
+# 就绪检查：数据库和 Redis 都可用时返回 200，否则返回 503
+@app.route('/ready')
+def readiness_check():
+    checks = {"database": check_db()}
+    replica_engine = get_replica_engine()
+    if replica_engine is not None:
+        checks["replica"] = check_db(replica_engine)
+    try:
+        redis_client.ping()
+        checks["redis"] = {"ok": True}
+    except Exception as e:
+        checks["redis"] = {"ok": False, "error": str(e)}
+    
+    ready = all(check["ok"] for check in checks.values())
+    return jsonify({"status": "ready" if ready else "not_ready", "checks": checks}), 200 if ready else 503
+
 # ==================== AI 助手接口 ====================
 
+def get_cache_control(data):
+    """大模型响应缓存的控制指令：请求体的 cache_control 字段优先，其次为 Cache-Control 请求头"""
+    return data.get('cache_control') or request.headers.get('Cache-Control')
+
 # 生成 AI 响应接口
 @app.route('/api/generate', methods=['POST'])
 def generate_response():
@@ -85,7 +195,11 @@ def generate_response():
     prompt = data.get('prompt')
     if not prompt:
         return error_response("INVALID_PARAMETER", "Prompt is required")
-    return success_response(ai_service.generate_response(prompt))
+    result = ai_service.generate_response(prompt, cache_control=get_cache_control(data), user_id=data.get('user_id'))
+    # 大模型调用排队超时或队列已满
+    if "code" in result:
+        return error_response(result["code"], result["error"])
+    return success_response(result)
 
 # 创建会话接口
 @app.route('/api/session/create', methods=['POST'])
@@ -99,10 +213,13 @@ def create_session():
 @app.route('/api/session/<session_id>')
 def get_session(session_id):
     user_id = request.args.get('user_id', type=int)
-    messages = ai_service.get_session(session_id, user_id)
-    if messages is None:
+    # limit 和 before 用于分页：返回 before 之前最新的 limit 条消息，不传 limit 时返回全部
+    limit = request.args.get('limit', type=int)
+    before = request.args.get('before', type=int)
+    result = ai_service.get_session(session_id, user_id, limit=limit, before=before)
+    if result is None:
         return error_response("SESSION_NOT_FOUND", "Session not found or not owned by user")
-    return success_response({"messages": messages})
+    return success_response(result)
 
 # 删除会话接口
 @app.route('/api/session/<session_id>', methods=['DELETE'])
@@ -151,20 +268,21 @@ def chat_completion():
     user_id = data.get('user_id')
     if not messages:
         return error_response("INVALID_PARAMETER", "Messages is required")
+    cache_control = get_cache_control(data)
     
     if stream:
         @stream_with_context
         def generate():
-            for chunk in ai_service.chat_completion(messages, session_id, stream=True, user_id=user_id):
+            for chunk in ai_service.chat_completion(messages, session_id, stream=True, user_id=user_id, cache_control=cache_control):
                 import json
                 yield json.dumps(chunk) + '\n'
         return Response(generate(), mimetype='application/json')
     else:
-        result = ai_service.chat_completion(messages, session_id, stream=False, user_id=user_id)
+        result = ai_service.chat_completion(messages, session_id, stream=False, user_id=user_id, cache_control=cache_control)
         # 检查result是否为字典（非流式响应）
         if isinstance(result, dict):
             if "error" in result:
-                return error_response("SESSION_ERROR", result["error"])
+                return error_response(result.get("code", "SESSION_ERROR"), result["error"])
             return success_response(result)
         # 检查result是否为可迭代对象（可能的其他情况）
         elif hasattr(result, '__iter__'):
@@ -172,48 +290,99 @@ def chat_completion():
                 return success_response(item)
         return error_response("NO_RESPONSE", "No response generated")
 
+# 大模型响应缓存统计
+@app.route('/api/ai/cache/stats')
+def get_ai_cache_stats():
+    if llm_cache is None:
+        return error_response("CACHE_DISABLED", "LLM cache is disabled")
+    return success_response(llm_cache.stats())
+
+# 大模型 API 客户端指标、并发限制和请求合并统计（当前工作进程）
+@app.route('/api/ai/client/stats')
+def get_ai_client_stats():
+    return success_response({
+        **ai_service.http.stats(),
+        "concurrency": ai_service.limiter.stats(),
+        "coalescing": ai_service.single_flight.stats()
+    })
+
+# 会话消息缓存统计（当前工作进程）
+@app.route('/api/ai/session-cache/stats')
+def get_session_cache_stats():
+    if session_cache is None:
+        return error_response("CACHE_DISABLED", "Session cache is disabled")
+    return success_response(session_cache.stats())
+
+# 会话存储的容量和淘汰统计（数据库可用时不使用会话存储）
+@app.route('/api/ai/session-store/stats')
+def get_session_store_stats():
+    return success_response({"in_use": not ai_service.use_database, **session_store.stats()})
+
 # ==================== 新闻接口 ====================
 
 # 获取新闻列表
 @app.route('/api/news')
 def get_news_list():
     try:
-        db = next(get_db())
-        news_service = NewsService(db)
+        news_service = get_news_service()
         
         page = int(request.args.get('page', 1))
         page_size = min(int(request.args.get('page_size', 20)), 100)
         category_id = request.args.get('category_id', type=int)
         tag_id = request.args.get('tag_id', type=int)
         sort = request.args.get('sort', 'publish_time')
+        cursor = request.args.get('cursor')
+        count = request.args.get('count')
         
         if page < 1:
             return error_response("INVALID_PARAMETER", "Page must be greater than 0")
         if page_size < 1:
             return error_response("INVALID_PARAMETER", "Page size must be greater than 0")
-        if sort not in ['publish_time', 'views']:
-            return error_response("INVALID_PARAMETER", "Sort must be 'publish_time' or 'views'")
+        if sort not in ['publish_time', 'views', 'trending']:
+            return error_response("INVALID_PARAMETER", "Sort must be 'publish_time', 'views' or 'trending'")
         
         result = news_service.get_news_list(
             page=page,
             page_size=page_size,
             category_id=category_id,
             tag_id=tag_id,
-            sort=sort
+            sort=sort,
+            cursor=cursor,
+            count=count,
+            fields=resolve_fields(request.args.get('fields'), request.args.get('view'))
         )
         return success_response(result)
+    except ValueError as e:
+        return error_response("INVALID_PARAMETER", str(e))
+    except Exception as e:
+        return error_response("DATABASE_ERROR", str(e))
+
+# 批量获取新闻详情
+@app.route('/api/news/batch')
+def get_news_batch():
+    try:
+        news_service = get_news_service()
+        
+        ids = request.args.get('ids', '')
+        try:
+            news_ids = [int(news_id) for news_id in ids.split(',') if news_id.strip()]
+        except ValueError:
+            return error_response("INVALID_PARAMETER", "IDs must be comma-separated integers")
+        if not news_ids:
+            return error_response("INVALID_PARAMETER", "IDs are required")
+        if len(news_ids) > 100:
+            return error_response("INVALID_PARAMETER", "At most 100 IDs are allowed")
+        
+        news = news_service.get_news_by_ids(news_ids)
+        return success_response({"news": news})
     except Exception as e:
         return error_response("DATABASE_ERROR", str(e))
-    finally:
-        if 'db' in locals():
-            db.close()
 
 # 获取单条新闻详情
 @app.route('/api/news/<int:news_id>')
 def get_news_detail(news_id):
     try:
-        db = next(get_db())
-        news_service = NewsService(db)
+        news_service = get_news_service()
         
         news = news_service.get_news_by_id(news_id)
         if not news:
@@ -222,46 +391,58 @@ def get_news_detail(news_id):
         return success_response(news)
     except Exception as e:
         return error_response("DATABASE_ERROR", str(e))
-    finally:
-        if 'db' in locals():
-            db.close()
+
+# 获取相关新闻
+@app.route('/api/news/<int:news_id>/related')
+def get_related_news(news_id):
+    try:
+        news_service = get_news_service()
+        
+        limit = min(int(request.args.get('limit', 10)), 20)
+        
+        news = news_service.get_related_news(news_id, limit=limit)
+        return success_response({"news": news})
+    except Exception as e:
+        return error_response("DATABASE_ERROR", str(e))
 
 # 获取新闻分类列表
 @app.route('/api/news/categories')
 def get_categories():
     try:
-        db = next(get_db())
-        news_service = NewsService(db)
+        news_service = get_news_service()
         
         categories = news_service.get_categories()
         return success_response({"categories": categories})
     except Exception as e:
         return error_response("DATABASE_ERROR", str(e))
-    finally:
-        if 'db' in locals():
-            db.close()
 
 # 获取新闻标签列表
 @app.route('/api/news/tags')
 def get_tags():
     try:
-        db = next(get_db())
-        news_service = NewsService(db)
+        news_service = get_news_service()
+        
+        page = request.args.get('page', type=int)
+        page_size = min(int(request.args.get('page_size', 100)), 100)
+        top = request.args.get('top', type=int)
+        
+        if page is not None and page < 1:
+            return error_response("INVALID_PARAMETER", "Page must be greater than 0")
+        if page_size < 1:
+            return error_response("INVALID_PARAMETER", "Page size must be greater than 0")
+        if top is not None and not 1 <= top <= 100:
+            return error_response("INVALID_PARAMETER", "Top must be between 1 and 100")
         
-        tags = news_service.get_tags()
-        return success_response({"tags": tags})
+        result = news_service.get_tags(page=page, page_size=page_size, top=top)
+        return success_response(result)
     except Exception as e:
         return error_response("DATABASE_ERROR", str(e))
-    finally:
-        if 'db' in locals():
-            db.close()
 
 # 搜索新闻
 @app.route('/api/news/search')
 def search_news():
     try:
-        db = next(get_db())
-        news_service = NewsService(db)
+        news_service = get_news_service()
         
         keyword = request.args.get('keyword')
         if not keyword:
@@ -269,25 +450,30 @@ def search_news():
         
         page = int(request.args.get('page', 1))
         page_size = min(int(request.args.get('page_size', 20)), 100)
+        sort = request.args.get('sort', 'publish_time')
+        if sort not in ['publish_time', 'views', 'relevance']:
+            return error_response("INVALID_PARAMETER", "Sort must be 'publish_time', 'views' or 'relevance'")
         
         result = news_service.search_news(
             keyword=keyword,
             page=page,
-            page_size=page_size
+            page_size=page_size,
+            cursor=request.args.get('cursor'),
+            count=request.args.get('count'),
+            sort=sort,
+            fields=resolve_fields(request.args.get('fields'), request.args.get('view'))
         )
         return success_response(result)
+    except ValueError as e:
+        return error_response("INVALID_PARAMETER", str(e))
     except Exception as e:
         return error_response("DATABASE_ERROR", str(e))
-    finally:
-        if 'db' in locals():
-            db.close()
 
 # 按分类获取新闻
 @app.route('/api/news/category/<int:category_id>')
 def get_news_by_category(category_id):
     try:
-        db = next(get_db())
-        news_service = NewsService(db)
+        news_service = get_news_service()
         
         page = int(request.args.get('page', 1))
         page_size = min(int(request.args.get('page_size', 20)), 100)
@@ -295,21 +481,22 @@ def get_news_by_category(category_id):
         result = news_service.get_news_by_category(
             category_id=category_id,
             page=page,
-            page_size=page_size
+            page_size=page_size,
+            cursor=request.args.get('cursor'),
+            count=request.args.get('count'),
+            fields=resolve_fields(request.args.get('fields'), request.args.get('view'))
         )
         return success_response(result)
+    except ValueError as e:
+        return error_response("INVALID_PARAMETER", str(e))
     except Exception as e:
         return error_response("DATABASE_ERROR", str(e))
-    finally:
-        if 'db' in locals():
-            db.close()
 
 # 按标签获取新闻
 @app.route('/api/news/tag/<int:tag_id>')
 def get_news_by_tag(tag_id):
     try:
-        db = next(get_db())
-        news_service = NewsService(db)
+        news_service = get_news_service()
         
         page = int(request.args.get('page', 1))
         page_size = min(int(request.args.get('page_size', 20)), 100)
@@ -317,21 +504,22 @@ def get_news_by_tag(tag_id):
         result = news_service.get_news_by_tag(
             tag_id=tag_id,
             page=page,
-            page_size=page_size
+            page_size=page_size,
+            cursor=request.args.get('cursor'),
+            count=request.args.get('count'),
+            fields=resolve_fields(request.args.get('fields'), request.args.get('view'))
         )
         return success_response(result)
+    except ValueError as e:
+        return error_response("INVALID_PARAMETER", str(e))
     except Exception as e:
         return error_response("DATABASE_ERROR", str(e))
-    finally:
-        if 'db' in locals():
-            db.close()
 
 # 获取热门新闻
 @app.route('/api/news/hot')
 def get_hot_news():
     try:
-        db = next(get_db())
-        news_service = NewsService(db)
+        news_service = get_news_service()
         
         limit = min(int(request.args.get('limit', 10)), 20)
         
@@ -339,16 +527,25 @@ def get_hot_news():
         return success_response({"news": news})
     except Exception as e:
         return error_response("DATABASE_ERROR", str(e))
-    finally:
-        if 'db' in locals():
-            db.close()
+
+# 获取热度上升的新闻
+@app.route('/api/news/trending')
+def get_trending_news():
+    try:
+        news_service = get_news_service()
+        
+        limit = min(int(request.args.get('limit', 10)), 50)
+        
+        news = news_service.get_trending_news(limit=limit)
+        return success_response({"news": news})
+    except Exception as e:
+        return error_response("DATABASE_ERROR", str(e))
 
 # 增加新闻阅读量
 @app.route('/api/news/<int:news_id>/view', methods=['POST'])
 def increment_news_views(news_id):
     try:
-        db = next(get_db())
-        news_service = NewsService(db)
+        news_service = get_news_service()
         
         result = news_service.increment_views(news_id)
         if not result:
@@ -357,9 +554,22 @@ def increment_news_views(news_id):
         return success_response(result)
     except Exception as e:
         return error_response("DATABASE_ERROR", str(e))
-    finally:
-        if 'db' in locals():
-            db.close()
+
+# 获取新闻缓存统计
+@app.route('/api/news/cache/stats')
+def get_news_cache_stats():
+    if news_cache is None:
+        return error_response("CACHE_DISABLED", "News cache is disabled")
+    return success_response(news_cache.stats())
+
+# 获取数据库连接池状态
+@app.route('/api/db/pool/stats')
+def get_db_pool_stats():
+    stats = pool_status(get_engine())
+    replica_engine = get_replica_engine()
+    if replica_engine is not None:
+        stats["replica"] = pool_status(replica_engine)
+    return success_response(stats)
 
 # ==================== 用户认证接口 ====================
 
@@ -402,7 +612,7 @@ def send_code():
 @app.route('/api/auth/register', methods=['POST'])
 def register_user():
     try:
-        db = next(get_db())
+        db = get_request_db()
         user_service = UserService(db)
         
         data = request.json
@@ -433,15 +643,12 @@ def register_user():
         return success_response(result)
     except Exception as e:
         return error_response("DATABASE_ERROR", str(e))
-    finally:
-        if 'db' in locals():
-            db.close()
 
 # 用户登录接口
 @app.route('/api/auth/login', methods=['POST'])
 def login_user():
     try:
-        db = next(get_db())
+        db = get_request_db()
         user_service = UserService(db)
         
         data = request.json
@@ -464,9 +671,6 @@ def login_user():
         })
     except Exception as e:
         return error_response("DATABASE_ERROR", str(e))
-    finally:
-        if 'db' in locals():
-            db.close()
 
 
 
@@ -474,7 +678,7 @@ def login_user():
 @app.route('/api/user/<int:user_id>/favorites', methods=['POST'])
 def add_favorite(user_id):
     try:
-        db = next(get_db())
+        db = get_request_db()
         user_service = UserService(db)
         
         data = request.json
@@ -490,15 +694,12 @@ def add_favorite(user_id):
         return success_response({"message": "Favorite added successfully"})
     except Exception as e:
         return error_response("DATABASE_ERROR", str(e))
-    finally:
-        if 'db' in locals():
-            db.close()
 
 # 取消收藏接口
 @app.route('/api/user/<int:user_id>/favorites/<int:news_id>', methods=['DELETE'])
 def remove_favorite(user_id, news_id):
     try:
-        db = next(get_db())
+        db = get_request_db()
         user_service = UserService(db)
         
         result = user_service.remove_favorite(user_id, news_id)
@@ -508,48 +709,43 @@ def remove_favorite(user_id, news_id):
         return success_response({"message": "Favorite removed successfully"})
     except Exception as e:
         return error_response("DATABASE_ERROR", str(e))
-    finally:
-        if 'db' in locals():
-            db.close()
 
 # 获取收藏列表接口
 @app.route('/api/user/<int:user_id>/favorites')
 def get_favorites(user_id):
     try:
-        db = next(get_db())
+        db = get_request_db()
         user_service = UserService(db)
         
         page = int(request.args.get('page', 1))
         page_size = min(int(request.args.get('page_size', 20)), 100)
         
-        result = user_service.get_favorites(user_id, page, page_size)
+        fields = resolve_fields(request.args.get('fields'), request.args.get('view'), allowed=USER_NEWS_FIELDS)
+        
+        result = user_service.get_favorites(user_id, page, page_size, fields=fields)
         return success_response(result)
+    except ValueError as e:
+        return error_response("INVALID_PARAMETER", str(e))
     except Exception as e:
         return error_response("DATABASE_ERROR", str(e))
-    finally:
-        if 'db' in locals():
-            db.close()
 
 # 检查是否收藏接口
 @app.route('/api/user/<int:user_id>/favorites/<int:news_id>/check')
 def check_favorite(user_id, news_id):
     try:
-        db = next(get_db())
+        db = get_request_db()
         user_service = UserService(db)
         
         result = user_service.is_favorite(user_id, news_id)
         return success_response({"is_favorite": result})
     except Exception as e:
         return error_response("DATABASE_ERROR", str(e))
-    finally:
-        if 'db' in locals():
-            db.close()
 
 # 添加浏览历史接口
 @app.route('/api/user/<int:user_id>/history', methods=['POST'])
 def add_history(user_id):
     try:
-        db = next(get_db())
+        db = get_request_db()
         user_service = UserService(db)
         
         data = request.json
@@ -562,48 +758,43 @@ def add_history(user_id):
         return success_response({"message": "History added successfully"})
     except Exception as e:
         return error_response("DATABASE_ERROR", str(e))
-    finally:
-        if 'db' in locals():
-            db.close()
 
 # 获取浏览历史接口
 @app.route('/api/user/<int:user_id>/history')
 def get_history(user_id):
     try:
-        db = next(get_db())
+        db = get_request_db()
         user_service = UserService(db)
         
         page = int(request.args.get('page', 1))
         page_size = min(int(request.args.get('page_size', 20)), 100)
         
-        result = user_service.get_history(user_id, page, page_size)
+        fields = resolve_fields(request.args.get('fields'), request.args.get('view'), allowed=USER_NEWS_FIELDS)
+        
+        result = user_service.get_history(user_id, page, page_size, fields=fields)
         return success_response(result)
+    except ValueError as e:
+        return error_response("INVALID_PARAMETER", str(e))
     except Exception as e:
         return error_response("DATABASE_ERROR", str(e))
-    finally:
-        if 'db' in locals():
-            db.close()
 
 # 获取用户会话列表接口
 @app.route('/api/user/<int:user_id>/sessions')
 def get_user_sessions(user_id):
     try:
-        db = next(get_db())
+        db = get_request_db()
         user_service = UserService(db)
         
         result = user_service.get_user_sessions(user_id)
         return success_response({"sessions": result})
     except Exception as e:
         return error_response("DATABASE_ERROR", str(e))
-    finally:
-        if 'db' in locals():
-            db.close()
 
 # 创建用户会话接口
 @app.route('/api/user/<int:user_id>/session/create', methods=['POST'])
 def create_user_session(user_id):
     try:
-        db = next(get_db())
+        db = get_request_db()
         
         data = request.json
         title = data.get('title', '新会话')
@@ -620,9 +811,10 @@ def create_user_session(user_id):
         return success_response({"session_id": session_id})
     except Exception as e:
         return error_response("DATABASE_ERROR", str(e))
-    finally:
-        if 'db' in locals():
-            db.close()
 
 if __name__ == "__main__":
+    # 开发服务器；生产环境使用 gunicorn -c gunicorn.conf.py wsgi:app
+    import atexit
+    init_worker()
+    atexit.register(shutdown_worker)
     app.run(host="0.0.0.0", port=8000, debug=True)
@@ -0,0 +1,12 @@
+-- 为已有数据库补齐新闻表的分页索引和全文索引（新部署由 db_init/init.sql 创建）
+-- 执行: mysql -u <user> -p ai_financial_news < migrations/001_news_fulltext.sql
+-- 建完索引后设置环境变量 SEARCH_ENGINE=fulltext 启用
+
+USE `ai_financial_news`;
+
+ALTER TABLE `news`
+  ADD INDEX `idx_publish_time_id` (`publish_time`, `id`),
+  ADD INDEX `idx_views_id` (`views`, `id`);
+
+ALTER TABLE `news`
+  ADD FULLTEXT INDEX `ft_title_content` (`title`, `content`) WITH PARSER ngram;
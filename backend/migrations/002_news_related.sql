@@ -0,0 +1,14 @@
+-- 为已有数据库添加相关新闻表（新部署由 db_init/init.sql 创建）
+-- 执行: mysql -u <user> -p ai_financial_news < migrations/002_news_related.sql
+-- 建表后运行 python -m services.related_news build 生成相关新闻
+
+USE `ai_financial_news`;
+
+CREATE TABLE IF NOT EXISTS `news_related` (
+  `news_id` INT NOT NULL,
+  `related_id` INT NOT NULL,
+  `score` FLOAT NOT NULL,
+  PRIMARY KEY (`news_id`, `related_id`),
+  FOREIGN KEY (`news_id`) REFERENCES `news` (`id`) ON DELETE CASCADE,
+  FOREIGN KEY (`related_id`) REFERENCES `news` (`id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
@@ -0,0 +1,18 @@
+-- 为已有数据库添加新闻指纹列和近似重复表（新部署由 db_init/init.sql 创建）
+-- 执行: mysql -u <user> -p ai_financial_news < migrations/003_news_simhash.sql
+-- 执行后运行 python -m services.duplicate_detector backfill 为已有新闻补算指纹
+
+USE `ai_financial_news`;
+
+ALTER TABLE `news`
+  ADD COLUMN `simhash` BIGINT,
+  ADD INDEX `idx_simhash` (`simhash`);
+
+CREATE TABLE IF NOT EXISTS `news_duplicates` (
+  `url` VARCHAR(500) NOT NULL PRIMARY KEY,
+  `news_id` INT NOT NULL,
+  `distance` INT NOT NULL,
+  `created_at` DATETIME DEFAULT CURRENT_TIMESTAMP,
+  INDEX `idx_news_id` (`news_id`),
+  FOREIGN KEY (`news_id`) REFERENCES `news` (`id`) ON DELETE CASCADE
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
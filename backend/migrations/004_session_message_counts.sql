@@ -0,0 +1,22 @@
+-- 为已有数据库添加会话消息计数和消息序号（新部署由 db_init/init.sql 创建）
+-- 执行: mysql -u <user> -p ai_financial_news < migrations/004_session_message_counts.sql
+
+USE `ai_financial_news`;
+
+ALTER TABLE `sessions`
+  ADD COLUMN `message_count` INT NOT NULL DEFAULT 0;
+
+ALTER TABLE `messages`
+  ADD COLUMN `seq` INT,
+  ADD INDEX `idx_session_seq` (`session_id`, `seq`);
+
+-- 已有消息按写入时间编号
+UPDATE `messages` m
+JOIN (
+  SELECT `id`, ROW_NUMBER() OVER (PARTITION BY `session_id` ORDER BY `created_at`, `id`) - 1 AS `seq`
+  FROM `messages`
+) numbered ON m.`id` = numbered.`id`
+SET m.`seq` = numbered.`seq`;
+
+UPDATE `sessions` s
+SET s.`message_count` = (SELECT COUNT(*) FROM `messages` m WHERE m.`session_id` = s.`id`);
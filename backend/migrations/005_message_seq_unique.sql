@@ -0,0 +1,9 @@
+-- 消息序号改为会话内唯一，对话消息的批量写入依赖唯一索引发现并发写入的序号冲突
+-- （新部署由 db_init/init.sql 创建）
+-- 执行: mysql -u <user> -p ai_financial_news < migrations/005_message_seq_unique.sql
+
+USE `ai_financial_news`;
+
+ALTER TABLE `messages`
+  DROP INDEX `idx_session_seq`,
+  ADD UNIQUE INDEX `idx_session_seq` (`session_id`, `seq`);
@@ -0,0 +1,113 @@
+import os
+import gzip
+import hashlib
+from flask import current_app, g, request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# 小于该字节数的响应不压缩
+COMPRESS_MIN_SIZE = int(os.getenv("COMPRESS_MIN_SIZE", 1024))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+def _choose_encoding():
+    """按 Accept-Encoding 选择压缩算法，优先 brotli"""
+    accepted = request.accept_encodings
+    if brotli is not None and accepted["br"]:
+        return "br"
+    if accepted["gzip"]:
+        return "gzip"
+    return None
+
+def _set_validation_headers(response, etag):
+    response.vary.add("Accept-Encoding")
+    # 要求客户端每次用 ETag 重新验证，而不是直接使用本地缓存
+    if not response.cache_control:
+        response.cache_control.no_cache = True
+    response.set_etag(etag)
+
+def check_not_modified(validator):
+    """
+    处理请求前按 validator 生成 ETag，与 If-None-Match 相同时直接返回 304，
+    不再执行查询和序列化
+
+    Args:
+        validator: 返回当前请求验证值的函数，返回 None 时由响应体的哈希生成 ETag
+
+    Returns:
+        304 响应，内容可能已变化时返回 None 继续处理请求
+    """
+    if request.method not in ("GET", "HEAD"):
+        return None
+    value = validator()
+    if value is None:
+        return None
+    # 验证值相同的不同地址（查询参数）和不同压缩编码使用不同的 ETag
+    encoding = _choose_encoding()
+    etag = hashlib.md5(f"{value}:{request.full_path}".encode("utf-8")).hexdigest()
+    if encoding:
+        etag = f"{etag}-{encoding}"
+    g.etag = etag
+    if not request.if_none_match.contains(etag):
+        return None
+    response = current_app.response_class(status=304)
+    _set_validation_headers(response, etag)
+    return response
+
+def discard_validator():
+    """出错的响应不使用处理请求前生成的 ETag，改为由响应体的哈希生成"""
+    g.pop("etag", None)
+
+def conditional_and_compress(response):
+    """
+    为 GET 请求的 JSON 响应添加强 ETag、处理 If-None-Match（返回 304），
+    并按客户端支持压缩较大的响应体
+
+    处理请求前已生成 ETag 时（见 check_not_modified）直接使用，否则由响应体的哈希生成；
+    不同压缩编码使用不同的 ETag。流式响应（如 /api/chat 的流式输出）不做处理。
+    """
+    if (
+        request.method not in ("GET", "HEAD")
+        or response.status_code != 200
+        or response.mimetype != "application/json"
+        or response.is_streamed
+        or response.direct_passthrough
+        or "Content-Encoding" in response.headers
+    ):
+        return response
+
+    body = response.get_data()
+    encoding = _choose_encoding() if len(body) >= COMPRESS_MIN_SIZE else None
+    etag = g.get("etag")
+    if etag is None:
+        etag = hashlib.md5(body).hexdigest()
+        if encoding:
+            etag = f"{etag}-{encoding}"
+
+    _set_validation_headers(response, etag)
+    response.make_conditional(request)
+    if response.status_code == 304 or not encoding:
+        return response
+
+    if encoding == "br":
+        compressed = brotli.compress(body, quality=BROTLI_QUALITY)
+    else:
+        compressed = gzip.compress(body, compresslevel=GZIP_LEVEL)
+    response.set_data(compressed)
+    response.headers["Content-Encoding"] = encoding
+    return response
+
+def init_response_hooks(app, validator=None):
+    """
+    注册响应钩子
+
+    Args:
+        app: Flask 应用
+        validator: 可选，处理请求前生成验证值的函数（见 check_not_modified）
+    """
+    if validator is not None:
+        app.before_request(lambda: check_not_modified(validator))
+    app.after_request(conditional_and_compress)
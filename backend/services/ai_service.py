@@ -1,32 +1,93 @@
 import os
+import json
+import time
 import uuid
-import requests
-from typing import Dict, Any, Optional, List
+import logging
+import threading
+from typing import Dict, Any, Optional, List, Tuple
+from sqlalchemy import func
+from services.llm_client import LLMClient, MAX_CALL_DURATION
+from services.llm_cache import payload_hash
+from services.llm_limiter import ConcurrencyLimiter, SingleFlight, LLMBusyError
+from services.context_window import SUMMARY_TOKENS
+from services.session_store import MemorySessionStore
+
+logger = logging.getLogger(__name__)
+
+# 分页获取会话消息时每页的最大条数
+MAX_PAGE_SIZE = 200
+# 数据库不可用时重新检测的间隔（秒）
+DB_PROBE_INTERVAL = int(os.getenv("AI_DB_PROBE_INTERVAL", 30))
 
 class AIService:
     """大语言模型服务类"""
     
-    def __init__(self):
-        """初始化 AI 服务"""
+    def __init__(self, cache=None, context_window=None, session_store=None, session_cache=None, limiter=None):
+        """
+        初始化 AI 服务
+        
+        Args:
+            cache: 大模型响应缓存（LLMCache），为 None 时不使用缓存
+            context_window: 对话历史的 token 预算裁剪（ContextWindow），为 None 时发送全部历史
+            session_store: 数据库不可用时的会话存储（MemorySessionStore 或 RedisSessionStore），
+                为 None 时使用进程内存储
+            session_cache: 活跃会话消息的 Redis 写穿缓存（SessionCache），为 None 时每轮都读数据库
+            limiter: 上游调用的并发限制（ConcurrencyLimiter），为 None 时只在进程内限制
+        """
         self.api_key = os.getenv("AI_API_KEY")
         self.model = os.getenv("AI_MODEL", "deepseek-chat")
         # DeepSeek API 基础 URL
         self.api_base = os.getenv("AI_API_BASE", "https://api.deepseek.com/v1")
-        # 会话存储：使用字典存储会话，键为会话ID，值为包含messages和user_id的字典
-        self.sessions: Dict[str, Dict[str, Any]] = {}
-        # 数据库标志
-        self.use_database = False
+        # 共享的上游 HTTP 客户端：keep-alive 连接池、超时、重试和延迟指标
+        self.http = LLMClient()
+        # 上游调用的总并发和每个用户的并发限制，以及相同请求的合并；
+        # 合并的请求最多等待领头请求排队和调用（含重试）的最长时间
+        self.limiter = limiter or ConcurrencyLimiter()
+        self.single_flight = SingleFlight(self.limiter.queue_timeout + MAX_CALL_DURATION)
+        self.cache = cache
+        self.context_window = context_window
+        # 数据库不可用时的会话存储，有会话数、消息数和内存上限
+        self.session_store = session_store or MemorySessionStore()
+        self.session_cache = session_cache
+        # 数据库是否可用，首次使用时检测（见 use_database），构造时不连接数据库
+        self._database_ok = None
+        self._database_probed_at = 0.0
+        self._database_lock = threading.Lock()
+        self.writer = None
         
-        # 尝试初始化数据库
+        # 使用数据库存储会话（表结构由 python -m spiders.database_news init 或 db_init/init.sql 创建）
         try:
-            from spiders.database_news import SessionLocal, Session as DBSession, Message, init_db
-            init_db()
-            self.use_database = True
-            self.SessionLocal = SessionLocal
+            from spiders.database_news import PrimarySessionLocal, Session as DBSession, Message, check_db
+            from services.chat_writer import ChatWriter
+            self._check_db = check_db
+            # 会话消息写入后马上会被读取，不走只读副本
+            self.SessionLocal = PrimarySessionLocal
             self.DBSession = DBSession
             self.Message = Message
-        except Exception as e:
-            self.use_database = False
+            # 每轮对话的消息在回复结束后一次写入（CHAT_WRITE_MODE=background 时由后台线程写入）
+            self.writer = ChatWriter(PrimarySessionLocal, cache=session_cache)
+        except Exception:
+            self._database_ok = False
+            self._database_probed_at = float("inf")
+    
+    @property
+    def use_database(self) -> bool:
+        """
+        是否用数据库存储会话，否则使用 session_store
+        
+        首次使用时检测数据库连通性；不可用时改用会话存储，并每隔 DB_PROBE_INTERVAL 秒重新检测，
+        数据库恢复后切换回数据库（此后不再切回会话存储，期间创建的会话不迁移）。
+        """
+        if self._database_ok:
+            return True
+        with self._database_lock:
+            if self._database_ok is None or time.monotonic() - self._database_probed_at >= DB_PROBE_INTERVAL:
+                status = self._check_db()
+                self._database_probed_at = time.monotonic()
+                if not status["ok"] and self._database_ok is None:
+                    logger.warning(f"数据库不可用，会话改用{type(self.session_store).__name__}存储: {status.get('error')}")
+                self._database_ok = status["ok"]
+            return self._database_ok
     
     def generate_response(self, prompt: str, **kwargs) -> Dict[str, Any]:
         """
@@ -34,7 +95,8 @@ class AIService:
         
         Args:
             prompt: 提示词
-            **kwargs: 其他参数
+            **kwargs: 其他参数，cache_control 为缓存控制（no-cache / no-store / max-age=N），
+                user_id 为用户 ID（用于每个用户的并发限制）
             
         Returns:
             包含响应的字典
@@ -55,11 +117,6 @@ class AIService:
                 }
             
             # 调用 DeepSeek API
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {self.api_key}"
-            }
-            
             payload = {
                 "model": self.model,
                 "messages": [
@@ -69,32 +126,21 @@ class AIService:
                 "max_tokens": 1000
             }
             
-            response = requests.post(
-                f"{self.api_base}/chat/completions",
-                headers=headers,
-                json=payload
-            )
-            
-            # 检查响应状态
-            if response.status_code != 200:
-                return {
-                    "error": f"API 请求失败: {response.status_code} - {response.text}"
-                }
-            
-            # 处理响应
-            result = response.json()
-            ai_response = result["choices"][0]["message"]["content"]
-            usage = result["usage"]
+            completion = self._request_completion(payload, kwargs.get("cache_control"), kwargs.get("user_id"))
+            if "error" in completion:
+                return completion
+            usage = completion["usage"]
             
             return {
                 "prompt": prompt,
-                "response": ai_response,
+                "response": completion["response"],
                 "model": self.model,
                 "usage": {
                     "prompt_tokens": usage["prompt_tokens"],
                     "completion_tokens": usage["completion_tokens"],
                     "total_tokens": usage["total_tokens"]
-                }
+                },
+                "cached": completion["cached"]
             }
         except Exception as e:
             return {
@@ -123,27 +169,39 @@ class AIService:
                 db.refresh(new_session)
             finally:
                 db.close()
+            if self.session_cache is not None:
+                self.session_cache.create(session_id, user_id)
         else:
             # 使用内存存储
-            self.sessions[session_id] = {
-                "messages": [],
-                "user_id": user_id
-            }
+            self.session_store.create(session_id, user_id)
         
         return session_id
     
-    def get_session(self, session_id: str, user_id: Optional[int] = None) -> Optional[List[Dict[str, str]]]:
+    def get_session(self, session_id: str, user_id: Optional[int] = None, limit: Optional[int] = None, before: Optional[int] = None) -> Optional[Dict[str, Any]]:
         """
-        获取会话消息
+        获取会话消息，可按游标分页
         
         Args:
             session_id: 会话 ID
             user_id: 用户 ID（可选），用于验证会话所属权
+            limit: 每页条数（可选），指定时返回 before 之前最新的 limit 条，不指定时返回全部
+            before: 分页游标（可选），只返回序号小于该值的消息，取上一页返回的 next_before
             
         Returns:
-            会话消息列表，如果会话不存在或不属于该用户则返回 None
+            {"messages", "total", "has_more", "next_before"}，每条消息带有位置 index 和序号 seq；
+            如果会话不存在或不属于该用户则返回 None
         """
+        if limit is not None:
+            limit = max(1, min(limit, MAX_PAGE_SIZE))
+        
         if self.use_database:
+            # 活跃会话直接从缓存分页
+            cached, _ = self._get_cached_session(session_id)
+            if cached is not None:
+                if user_id and cached["owner"] != user_id:
+                    return None
+                return self.session_cache.page(cached, limit, before)
+            
             db = self.SessionLocal()
             try:
                 # 查询会话，添加用户 ID 验证
@@ -154,25 +212,62 @@ class AIService:
                 if not session:
                     return None
                 
-                # 构建消息列表
-                messages = []
-                for msg in session.messages:
-                    messages.append({
-                        "role": msg.role,
-                        "content": msg.content
-                    })
-                return messages
+                # 通过 (session_id, seq) 索引只读取本页的消息
+                message_query = db.query(self.Message.seq, self.Message.role, self.Message.content).filter(
+                    self.Message.session_id == session_id
+                )
+                if before is not None:
+                    message_query = message_query.filter(self.Message.seq < before)
+                if limit:
+                    rows = message_query.order_by(self.Message.seq.desc()).limit(limit + 1).all()
+                    has_more = len(rows) > limit
+                    rows = rows[:limit][::-1]
+                else:
+                    rows = message_query.order_by(self.Message.seq).all()
+                    has_more = False
+                
+                # 本页第一条消息的位置 = 游标之前的消息数 - 本页条数
+                if before is None:
+                    preceding = session.message_count
+                else:
+                    preceding = db.query(func.count(self.Message.id)).filter(
+                        self.Message.session_id == session_id,
+                        self.Message.seq < before
+                    ).scalar()
+                first_index = preceding - len(rows)
+                
+                return {
+                    "messages": [
+                        {"role": row.role, "content": row.content, "index": first_index + i, "seq": row.seq}
+                        for i, row in enumerate(rows)
+                    ],
+                    "total": session.message_count,
+                    "has_more": has_more,
+                    "next_before": rows[0].seq if has_more else None
+                }
             finally:
                 db.close()
         else:
             # 使用内存存储
-            session_data = self.sessions.get(session_id)
+            session_data = self.session_store.get(session_id)
             if not session_data:
                 return None
             # 验证用户ID
             if user_id is not None and session_data.get("user_id") != user_id:
                 return None
-            return session_data.get("messages", [])
+            messages = session_data.get("messages", [])
+            # 内存存储的序号即位置
+            end = len(messages) if before is None else max(0, min(before, len(messages)))
+            start = max(0, end - limit) if limit else 0
+            return {
+                "messages": [
+                    {**msg, "index": index, "seq": index}
+                    for index, msg in enumerate(messages[start:end], start)
+                ],
+                "total": len(messages),
+                "has_more": start > 0,
+                "next_before": start if start > 0 else None
+            }
     
     def chat_completion(self, messages: list, session_id: Optional[str] = None, stream: bool = False, user_id: Optional[int] = None, **kwargs):
         """
@@ -183,11 +278,14 @@ class AIService:
             session_id: 会话 ID（可选）
             stream: 是否使用流式输出
             user_id: 用户 ID（可选），用于验证会话所属权
-            **kwargs: 其他参数
+            **kwargs: 其他参数，cache_control 为缓存控制（no-cache / no-store / max-age=N）；
+                会话内的对话依赖历史且用户可能希望重新生成，只有不带会话的单轮请求使用缓存
             
         Returns:
             包含响应的字典或流式生成器
         """
+        if session_id:
+            kwargs["cache_control"] = "no-store"
         if stream:
             return self._chat_completion_stream(messages, session_id, user_id, **kwargs)
         else:
@@ -209,66 +307,16 @@ class AIService:
         full_messages = []
         
         if self.use_database:
-            db = self.SessionLocal()
+            turn = None
             try:
-                # 处理会话
+                # 校验会话并读取历史，本轮的消息在响应后一起保存，调用大模型期间不占用数据库连接
                 if session_id:
-                    # 检查会话是否存在，并验证用户 ID
-                    query = db.query(self.DBSession).filter(self.DBSession.id == session_id)
-                    if user_id:
-                        query = query.filter(self.DBSession.user_id == user_id)
-                    session = query.first()
-                    if not session:
+                    loaded = self._load_session_messages(session_id, messages, user_id)
+                    if loaded is None:
                         return {
                             "error": "Session not found or not owned by user"
                         }
-                    
-                    # 获取当前会话中已有的消息数量
-                    existing_message_count = len(session.messages)
-                    
-                    # 只保存新增的用户消息到数据库
-                    # 假设前端发送的是完整的对话历史，我们只需要存储新增的消息
-                    # 检查messages中哪些是新增的消息
-                    new_messages = []
-                    if existing_message_count > 0:
-                        # 如果会话中已有消息，只存储新增的消息
-                        # 假设前端发送的是完整的对话历史
-                        # 我们只需要存储前端发送的消息中，角色为"user"的最新消息
-                        # 因为assistant的消息是由我们的API生成的，不需要重复存储
-                        user_messages = [msg for msg in messages if msg.get("role") == "user"]
-                        if user_messages:
-                            # 只存储最新的用户消息
-                            latest_user_message = user_messages[-1]
-                            msg_id = str(uuid.uuid4())
-                            new_message = self.Message(
-                                id=msg_id,
-                                session_id=session_id,
-                                role=latest_user_message.get("role"),
-                                content=latest_user_message.get("content")
-                            )
-                            db.add(new_message)
-                            db.commit()
-                            new_messages.append(latest_user_message)
-                    else:
-                        # 如果会话是空的，存储所有消息
-                        for msg in messages:
-                            msg_id = str(uuid.uuid4())
-                            new_message = self.Message(
-                                id=msg_id,
-                                session_id=session_id,
-                                role=msg.get("role"),
-                                content=msg.get("content")
-                            )
-                            db.add(new_message)
-                            new_messages.append(msg)
-                        db.commit()
-                    
-                    # 获取完整的消息列表
-                    for msg in session.messages:
-                        full_messages.append({
-                            "role": msg.role,
-                            "content": msg.content
-                        })
+                    full_messages, turn = loaded
                 else:
                     # 如果没有会话 ID，只使用当前消息
                     full_messages = messages
@@ -278,17 +326,9 @@ class AIService:
                     # 模拟响应
                     ai_response = "这是模拟的 AI 聊天响应"
                     
-                    # 保存模拟响应到数据库
+                    # 本轮的用户消息和模拟响应一起保存到数据库
                     if session_id:
-                        msg_id = str(uuid.uuid4())
-                        new_message = self.Message(
-                            id=msg_id,
-                            session_id=session_id,
-                            role="assistant",
-                            content=ai_response
-                        )
-                        db.add(new_message)
-                        db.commit()
+                        self._save_turn(turn, ai_response)
                         full_messages.append({"role": "assistant", "content": ai_response})
                     
                     return {
@@ -304,48 +344,24 @@ class AIService:
                     }
                 
                 # 调用 DeepSeek API
-                headers = {
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {self.api_key}"
-                }
-                
                 payload = {
                     "model": self.model,
-                    "messages": full_messages,
+                    "messages": self._context_messages(session_id, full_messages),
                     "temperature": 0.7,
                     "max_tokens": 1000,
                     "stream": False
                 }
                 
                 # 非流式响应处理
-                response = requests.post(
-                    f"{self.api_base}/chat/completions",
-                    headers=headers,
-                    json=payload
-                )
-                
-                # 检查响应状态
-                if response.status_code != 200:
-                    return {
-                        "error": f"API 请求失败: {response.status_code} - {response.text}"
-                    }
-                
-                # 处理响应
-                result = response.json()
-                ai_response = result["choices"][0]["message"]["content"]
-                usage = result["usage"]
+                completion = self._request_completion(payload, kwargs.get("cache_control"), user_id)
+                if "error" in completion:
+                    return completion
+                ai_response = completion["response"]
+                usage = completion["usage"]
                 
-                # 保存 AI 响应到数据库
+                # 本轮的用户消息和 AI 响应一起保存到数据库
                 if session_id:
-                    msg_id = str(uuid.uuid4())
-                    new_message = self.Message(
-                        id=msg_id,
-                        session_id=session_id,
-                        role="assistant",
-                        content=ai_response
-                    )
-                    db.add(new_message)
-                    db.commit()
+                    self._save_turn(turn, ai_response)
                     full_messages.append({"role": "assistant", "content": ai_response})
                 
                 return {
@@ -357,50 +373,25 @@ class AIService:
                         "completion_tokens": usage["completion_tokens"],
                         "total_tokens": usage["total_tokens"]
                     },
-                    "session_id": session_id
+                    "session_id": session_id,
+                    "cached": completion["cached"]
                 }
             except Exception as e:
-                db.rollback()
                 return {
                     "error": str(e)
                 }
             finally:
-                db.close()
+                # 调用大模型失败时仍保存本轮的用户消息
+                self._save_unfinished_turn(turn)
         else:
             # 使用内存存储
             if session_id:
-                # 检查会话是否存在
-                session_data = self.sessions.get(session_id)
-                if not session_data:
-                    # 创建新会话
-                    self.sessions[session_id] = {
-                        "messages": [],
-                        "user_id": user_id
-                    }
-                    session_data = self.sessions[session_id]
-                # 验证用户ID
-                if user_id is not None and session_data.get("user_id") != user_id:
+                # 读取会话（不存在时创建）并保存本轮的用户消息
+                full_messages = self._load_memory_session(session_id, messages, user_id)
+                if full_messages is None:
                     return {
                         "error": "Session not found or not owned by user"
                     }
-                
-                # 获取当前会话中已有的消息数量
-                existing_message_count = len(session_data.get("messages", []))
-                
-                if existing_message_count > 0:
-                    # 如果会话中已有消息，只存储新增的用户消息
-                    # 假设前端发送的是完整的对话历史
-                    # 我们只需要存储前端发送的消息中，角色为"user"的最新消息
-                    user_messages = [msg for msg in messages if msg.get("role") == "user"]
-                    if user_messages:
-                        # 只存储最新的用户消息
-                        latest_user_message = user_messages[-1]
-                        session_data["messages"].append(latest_user_message)
-                else:
-                    # 如果会话是空的，存储所有消息
-                    session_data["messages"].extend(messages)
-                
-                full_messages = session_data["messages"]
             else:
                 # 如果没有会话 ID，只使用当前消息
                 full_messages = messages
@@ -412,9 +403,7 @@ class AIService:
                 
                 # 保存模拟响应
                 if session_id:
-                    session_data = self.sessions.get(session_id)
-                    if session_data:
-                        session_data["messages"].append({"role": "assistant", "content": ai_response})
+                    self.session_store.append(session_id, [{"role": "assistant", "content": ai_response}])
                 
                 return {
                     "messages": full_messages + [{"role": "assistant", "content": ai_response}],
@@ -429,42 +418,24 @@ class AIService:
                 }
             
             # 调用 DeepSeek API
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {self.api_key}"
-            }
-            
             payload = {
                 "model": self.model,
-                "messages": full_messages,
+                "messages": self._context_messages(session_id, full_messages),
                 "temperature": 0.7,
                 "max_tokens": 1000,
                 "stream": False
             }
             
             # 非流式响应处理
-            response = requests.post(
-                f"{self.api_base}/chat/completions",
-                headers=headers,
-                json=payload
-            )
-            
-            # 检查响应状态
-            if response.status_code != 200:
-                return {
-                    "error": f"API 请求失败: {response.status_code} - {response.text}"
-                }
-            
-            # 处理响应
-            result = response.json()
-            ai_response = result["choices"][0]["message"]["content"]
-            usage = result["usage"]
+            completion = self._request_completion(payload, kwargs.get("cache_control"), user_id)
+            if "error" in completion:
+                return completion
+            ai_response = completion["response"]
+            usage = completion["usage"]
             
             # 保存模拟响应
             if session_id:
-                session_data = self.sessions.get(session_id)
-                if session_data:
-                    session_data["messages"].append({"role": "assistant", "content": ai_response})
+                self.session_store.append(session_id, [{"role": "assistant", "content": ai_response}])
             
             return {
                 "messages": full_messages + [{"role": "assistant", "content": ai_response}],
@@ -475,7 +446,8 @@ class AIService:
                     "completion_tokens": usage["completion_tokens"],
                     "total_tokens": usage["total_tokens"]
                 },
-                "session_id": session_id
+                "session_id": session_id,
+                "cached": completion["cached"]
             }
     
     def _chat_completion_stream(self, messages: list, session_id: Optional[str] = None, user_id: Optional[int] = None, **kwargs):
@@ -494,68 +466,18 @@ class AIService:
         full_messages = []
         
         if self.use_database:
-            db = self.SessionLocal()
+            turn = None
             try:
-                # 处理会话
+                # 第一步：校验会话并读取历史，数据库连接随即归还连接池
                 if session_id:
-                    # 检查会话是否存在，并验证用户 ID
-                    query = db.query(self.DBSession).filter(self.DBSession.id == session_id)
-                    if user_id:
-                        query = query.filter(self.DBSession.user_id == user_id)
-                    session = query.first()
-                    if not session:
+                    loaded = self._load_session_messages(session_id, messages, user_id)
+                    if loaded is None:
                         # 会话不存在或不属于该用户，返回错误
                         yield {
                             "error": "Session not found or not owned by user"
                         }
                         return
-                    
-                    # 获取当前会话中已有的消息数量
-                    existing_message_count = len(session.messages)
-                    
-                    # 只保存新增的用户消息到数据库
-                    # 假设前端发送的是完整的对话历史，我们只需要存储新增的消息
-                    # 检查messages中哪些是新增的消息
-                    new_messages = []
-                    if existing_message_count > 0:
-                        # 如果会话中已有消息，只存储新增的消息
-                        # 假设前端发送的是完整的对话历史
-                        # 我们只需要存储前端发送的消息中，角色为"user"的最新消息
-                        # 因为assistant的消息是由我们的API生成的，不需要重复存储
-                        user_messages = [msg for msg in messages if msg.get("role") == "user"]
-                        if user_messages:
-                            # 只存储最新的用户消息
-                            latest_user_message = user_messages[-1]
-                            msg_id = str(uuid.uuid4())
-                            new_message = self.Message(
-                                id=msg_id,
-                                session_id=session_id,
-                                role=latest_user_message.get("role"),
-                                content=latest_user_message.get("content")
-                            )
-                            db.add(new_message)
-                            db.commit()
-                            new_messages.append(latest_user_message)
-                    else:
-                        # 如果会话是空的，存储所有消息
-                        for msg in messages:
-                            msg_id = str(uuid.uuid4())
-                            new_message = self.Message(
-                                id=msg_id,
-                                session_id=session_id,
-                                role=msg.get("role"),
-                                content=msg.get("content")
-                            )
-                            db.add(new_message)
-                            new_messages.append(msg)
-                        db.commit()
-                    
-                    # 获取完整的消息列表
-                    for msg in session.messages:
-                        full_messages.append({
-                            "role": msg.role,
-                            "content": msg.content
-                        })
+                    full_messages, turn = loaded
                 else:
                     # 如果没有会话 ID，只使用当前消息
                     full_messages = messages
@@ -565,17 +487,9 @@ class AIService:
                     # 模拟响应
                     ai_response = "这是模拟的 AI 聊天响应"
                     
-                    # 保存模拟响应到数据库
+                    # 本轮的用户消息和模拟响应一起保存到数据库
                     if session_id:
-                        msg_id = str(uuid.uuid4())
-                        new_message = self.Message(
-                            id=msg_id,
-                            session_id=session_id,
-                            role="assistant",
-                            content=ai_response
-                        )
-                        db.add(new_message)
-                        db.commit()
+                        self._save_turn(turn, ai_response)
                         full_messages.append({"role": "assistant", "content": ai_response})
                     
                     # 流式模拟响应
@@ -600,78 +514,37 @@ class AIService:
                     return
                 
                 # 调用 DeepSeek API
-                headers = {
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {self.api_key}"
-                }
-                
                 payload = {
                     "model": self.model,
-                    "messages": full_messages,
+                    "messages": self._context_messages(session_id, full_messages),
                     "temperature": 0.7,
                     "max_tokens": 1000,
                     "stream": True
                 }
                 
-                # 流式响应处理
-                response = requests.post(
-                    f"{self.api_base}/chat/completions",
-                    headers=headers,
-                    json=payload,
-                    stream=True
-                )
-                
-                # 检查响应状态
-                if response.status_code != 200:
-                    yield {
-                        "error": f"API 请求失败: {response.status_code} - {response.text}"
-                    }
-                    return
-                
-                # 保存完整响应的变量
-                full_response = ""
-                usage = None
-                
-                # 流式生成响应
-                for chunk in response.iter_lines():
-                    if chunk:
-                        # 处理 SSE 格式
-                        chunk = chunk.decode('utf-8')
-                        if chunk.startswith('data: '):
-                            chunk_data = chunk[6:]
-                            if chunk_data == '[DONE]':
-                                break
-                            try:
-                                import json
-                                chunk_json = json.loads(chunk_data)
-                                # 提取内容
-                                delta = chunk_json['choices'][0]['delta']
-                                if 'content' in delta:
-                                    content = delta['content']
-                                    full_response += content
-                                    # 生成流式响应
-                                    yield {
-                                        "chunk": content,
-                                        "session_id": session_id
-                                    }
-                                # 提取使用情况
-                                if 'usage' in chunk_json:
-                                    usage = chunk_json['usage']
-                            except Exception as e:
-                                pass
+                # 第二步：转发上游（或缓存重放）的流式输出，期间不持有数据库连接；
+                # 客户端中途断开时上游连接随之释放
+                completion = {}
+                for item in self._request_completion_stream(payload, kwargs.get("cache_control"), user_id):
+                    if "error" in item:
+                        yield item
+                        return
+                    if "chunk" in item:
+                        # 生成流式响应
+                        yield {
+                            "chunk": item["chunk"],
+                            "session_id": session_id
+                        }
+                    else:
+                        completion = item
+                full_response = completion["response"]
+                usage = completion["usage"]
                 
-                # 保存完整响应到数据库
-                if session_id and full_response:
-                    msg_id = str(uuid.uuid4())
-                    new_message = self.Message(
-                        id=msg_id,
-                        session_id=session_id,
-                        role="assistant",
-                        content=full_response
-                    )
-                    db.add(new_message)
-                    db.commit()
-                    full_messages.append({"role": "assistant", "content": full_response})
+                # 第三步：用新的数据库会话在一个事务中保存本轮的用户消息和完整响应
+                if session_id:
+                    self._save_turn(turn, full_response)
+                    if full_response:
+                        full_messages.append({"role": "assistant", "content": full_response})
                 
                 # 生成最终响应
                 yield {
@@ -684,52 +557,27 @@ class AIService:
                         "total_tokens": sum(len(msg.get("content", "").split()) for msg in full_messages) + len(full_response.split())
                     },
                     "session_id": session_id,
+                    "cached": completion["cached"],
                     "finish": True
                 }
             except Exception as e:
-                db.rollback()
                 yield {
                     "error": str(e)
                 }
             finally:
-                db.close()
+                # 上游出错或客户端中途断开时仍保存本轮的用户消息
+                self._save_unfinished_turn(turn)
         else:
             # 使用内存存储
             if session_id:
-                # 检查会话是否存在
-                session_data = self.sessions.get(session_id)
-                if not session_data:
-                    # 创建新会话
-                    self.sessions[session_id] = {
-                        "messages": [],
-                        "user_id": user_id
-                    }
-                    session_data = self.sessions[session_id]
-                # 验证用户ID
-                if user_id is not None and session_data.get("user_id") != user_id:
+                # 读取会话（不存在时创建）并保存本轮的用户消息
+                full_messages = self._load_memory_session(session_id, messages, user_id)
+                if full_messages is None:
                     # 会话不存在或不属于该用户，返回错误
                     yield {
                         "error": "Session not found or not owned by user"
                     }
                     return
-                
-                # 获取当前会话中已有的消息数量
-                existing_message_count = len(session_data.get("messages", []))
-                
-                if existing_message_count > 0:
-                    # 如果会话中已有消息，只存储新增的用户消息
-                    # 假设前端发送的是完整的对话历史
-                    # 我们只需要存储前端发送的消息中，角色为"user"的最新消息
-                    user_messages = [msg for msg in messages if msg.get("role") == "user"]
-                    if user_messages:
-                        # 只存储最新的用户消息
-                        latest_user_message = user_messages[-1]
-                        session_data["messages"].append(latest_user_message)
-                else:
-                    # 如果会话是空的，存储所有消息
-                    session_data["messages"].extend(messages)
-                
-                full_messages = session_data["messages"]
             else:
                 # 如果没有会话 ID，只使用当前消息
                 full_messages = messages
@@ -741,9 +589,7 @@ class AIService:
                 
                 # 保存模拟响应
                 if session_id:
-                    session_data = self.sessions.get(session_id)
-                    if session_data:
-                        session_data["messages"].append({"role": "assistant", "content": ai_response})
+                    self.session_store.append(session_id, [{"role": "assistant", "content": ai_response}])
                 
                 # 流式模拟响应
                 for char in ai_response:
@@ -767,71 +613,34 @@ class AIService:
                 return
             
             # 调用 DeepSeek API
-            headers = {
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {self.api_key}"
-            }
-            
             payload = {
                 "model": self.model,
-                "messages": full_messages,
+                "messages": self._context_messages(session_id, full_messages),
                 "temperature": 0.7,
                 "max_tokens": 1000,
                 "stream": True
             }
             
             # 流式响应处理
-            response = requests.post(
-                f"{self.api_base}/chat/completions",
-                headers=headers,
-                json=payload,
-                stream=True
-            )
-            
-            # 检查响应状态
-            if response.status_code != 200:
-                yield {
-                    "error": f"API 请求失败: {response.status_code} - {response.text}"
-                }
-                return
-            
-            # 保存完整响应的变量
-            full_response = ""
-            usage = None
-            
-            # 流式生成响应
-            for chunk in response.iter_lines():
-                if chunk:
-                    # 处理 SSE 格式
-                    chunk = chunk.decode('utf-8')
-                    if chunk.startswith('data: '):
-                        chunk_data = chunk[6:]
-                        if chunk_data == '[DONE]':
-                            break
-                        try:
-                            import json
-                            chunk_json = json.loads(chunk_data)
-                            # 提取内容
-                            delta = chunk_json['choices'][0]['delta']
-                            if 'content' in delta:
-                                content = delta['content']
-                                full_response += content
-                                # 生成流式响应
-                                yield {
-                                    "chunk": content,
-                                    "session_id": session_id
-                                }
-                            # 提取使用情况
-                            if 'usage' in chunk_json:
-                                usage = chunk_json['usage']
-                        except Exception as e:
-                            pass
+            completion = {}
+            for item in self._request_completion_stream(payload, kwargs.get("cache_control"), user_id):
+                if "error" in item:
+                    yield item
+                    return
+                if "chunk" in item:
+                    # 生成流式响应
+                    yield {
+                        "chunk": item["chunk"],
+                        "session_id": session_id
+                    }
+                else:
+                    completion = item
+            full_response = completion["response"]
+            usage = completion["usage"]
             
             # 保存完整响应
             if session_id and full_response:
-                session_data = self.sessions.get(session_id)
-                if session_data:
-                    session_data["messages"].append({"role": "assistant", "content": full_response})
+                self.session_store.append(session_id, [{"role": "assistant", "content": full_response}])
             
             # 生成最终响应
             yield {
@@ -844,9 +653,322 @@ class AIService:
                     "total_tokens": sum(len(msg.get("content", "").split()) for msg in full_messages) + len(full_response.split())
                 },
                 "session_id": session_id,
+                "cached": completion["cached"],
                 "finish": True
             }
     
+    def _request_completion(self, payload: Dict[str, Any], cache_control: Optional[str] = None, user_id: Optional[int] = None) -> Dict[str, Any]:
+        """
+        非流式调用大模型，命中缓存时不请求上游；相同的请求正在进行时等待并共享它的结果
+        
+        Args:
+            payload: 请求体
+            cache_control: 缓存控制（no-cache / no-store / max-age=N），是否写入缓存由真正发出请求的调用决定
+            user_id: 用户 ID（可选），用于每个用户的并发限制
+            
+        Returns:
+            {"response", "usage", "cached"}，上游失败时为 {"error"}，排队超时时为 {"error", "code": "LLM_BUSY"}
+        """
+        if self.cache is not None:
+            entry = self.cache.get(payload, cache_control)
+            if entry is not None:
+                return {"response": "".join(entry["chunks"]), "usage": entry["usage"], "cached": True}
+        
+        # 合并的是正在进行的请求，与缓存控制无关：no-cache / no-store 的请求同样共享其结果；
+        # 跟随者拿到的是领头请求结果的副本，各自修改互不影响
+        try:
+            return dict(self.single_flight.do(payload_hash(payload), lambda: self._call_completion(payload, cache_control, user_id)))
+        except LLMBusyError as e:
+            return {"error": str(e), "code": "LLM_BUSY"}
+    
+    def _call_completion(self, payload: Dict[str, Any], cache_control: Optional[str] = None, user_id: Optional[int] = None) -> Dict[str, Any]:
+        """占用并发名额后请求上游，成功的响应写入缓存"""
+        try:
+            with self.limiter.slot(user_id):
+                response = self.http.post(
+                    f"{self.api_base}/chat/completions",
+                    self._headers(),
+                    payload
+                )
+        except LLMBusyError as e:
+            return {"error": str(e), "code": "LLM_BUSY"}
+        
+        # 检查响应状态
+        if response.status_code != 200:
+            return {
+                "error": f"API 请求失败: {response.status_code} - {response.text}"
+            }
+        
+        # 处理响应
+        result = response.json()
+        ai_response = result["choices"][0]["message"]["content"]
+        usage = result["usage"]
+        if self.cache is not None:
+            self.cache.set(payload, [ai_response], usage, cache_control)
+        return {"response": ai_response, "usage": usage, "cached": False}
+    
+    def _request_completion_stream(self, payload: Dict[str, Any], cache_control: Optional[str] = None, user_id: Optional[int] = None):
+        """
+        流式调用大模型，命中缓存时按原样逐块重放缓存的响应
+        
+        Args:
+            payload: 请求体
+            cache_control: 缓存控制（no-cache / no-store / max-age=N）
+            user_id: 用户 ID（可选），用于每个用户的并发限制
+            
+        Yields:
+            {"chunk"} 文本块，最后是 {"response", "usage", "cached"}；上游失败时为 {"error"}，
+            排队超时时为 {"error", "code": "LLM_BUSY"}
+        """
+        if self.cache is not None:
+            entry = self.cache.get(payload, cache_control)
+            if entry is not None:
+                for chunk in entry["chunks"]:
+                    yield {"chunk": chunk}
+                yield {"response": "".join(entry["chunks"]), "usage": entry["usage"], "cached": True}
+                return
+        
+        chunks = []
+        usage = None
+        try:
+            # 并发名额一直占用到输出结束；客户端中途断开时退出 with 块，名额和上游连接随之释放
+            with self.limiter.slot(user_id), self.http.stream(
+                f"{self.api_base}/chat/completions",
+                self._headers(),
+                payload
+            ) as response:
+                # 检查响应状态
+                if response.status_code != 200:
+                    yield {
+                        "error": f"API 请求失败: {response.status_code} - {response.text}"
+                    }
+                    return
+                
+                for content, chunk_usage in self._iter_stream_chunks(response):
+                    if content:
+                        chunks.append(content)
+                        yield {"chunk": content}
+                    if chunk_usage:
+                        usage = chunk_usage
+        except LLMBusyError as e:
+            yield {"error": str(e), "code": "LLM_BUSY"}
+            return
+        
+        # 客户端中途断开时生成器在 yield 处退出，不完整的响应不会写入缓存
+        if self.cache is not None and chunks:
+            self.cache.set(payload, chunks, usage, cache_control)
+        yield {"response": "".join(chunks), "usage": usage, "cached": False}
+    
+    def _context_messages(self, session_id: Optional[str], messages: List[Dict[str, str]]) -> List[Dict[str, str]]:
+        """
+        按 token 预算裁剪发给大模型的历史消息，更早的消息以摘要代替
+        
+        Args:
+            session_id: 会话 ID（可选），用于缓存滚动摘要
+            messages: 完整消息列表
+            
+        Returns:
+            本轮发给大模型的消息列表
+        """
+        if self.context_window is None:
+            return messages
+        return self.context_window.build(session_id, messages, self._summarize)
+    
+    def _summarize(self, summary: Optional[str], messages: List[Dict[str, str]]) -> Optional[str]:
+        """
+        把已有摘要和新移出窗口的消息合并为新的摘要
+        
+        Args:
+            summary: 已有摘要（可选）
+            messages: 需要并入摘要的消息
+            
+        Returns:
+            新摘要，调用失败时返回 None
+        """
+        transcript = "\n".join(f"{msg.get('role')}: {msg.get('content')}" for msg in messages)
+        if summary:
+            transcript = f"已有摘要：\n{summary}\n\n新的对话：\n{transcript}"
+        payload = {
+            "model": self.model,
+            "messages": [
+                {"role": "system", "content": "你是对话摘要助手。请把用户提供的内容合并成一段简洁的中文摘要，保留用户的问题和关注点、涉及的公司、股票、数据以及已经得出的结论，不要添加新的信息。"},
+                {"role": "user", "content": transcript}
+            ],
+            "temperature": 0.3,
+            "max_tokens": SUMMARY_TOKENS
+        }
+        try:
+            with self.limiter.slot():
+                response = self.http.post(f"{self.api_base}/chat/completions", self._headers(), payload)
+            if response.status_code != 200:
+                return None
+            return response.json()["choices"][0]["message"]["content"]
+        except Exception:
+            return None
+    
+    def _invalidate_context(self, session_id: str) -> None:
+        if self.context_window is not None:
+            self.context_window.invalidate(session_id)
+    
+    def _get_cached_session(self, session_id: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """读取会话缓存，返回 (缓存的会话, 回填令牌)，未启用缓存时均为 None"""
+        if self.session_cache is None:
+            return None, None
+        return self.session_cache.get(session_id)
+    
+    def _invalidate_session_cache(self, session_id: str) -> None:
+        if self.session_cache is not None:
+            self.session_cache.invalidate(session_id)
+    
+    def _headers(self) -> Dict[str, str]:
+        return {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
+        }
+    
+    def _load_session_messages(self, session_id: str, messages: list, user_id: Optional[int] = None) -> Optional[Tuple[List[Dict[str, str]], Dict[str, Any]]]:
+        """
+        校验会话所属并读取历史消息，确定本轮需要保存的消息
+        
+        活跃会话从缓存读取，不访问数据库；未命中时校验和读取合并为一次查询，并回填缓存。
+        本方法不写数据库：本轮的用户消息在回复结束后与回复一起由 _save_turn 写入。
+        数据库会话只在本方法内使用，调用大模型期间不占用数据库连接。
+        
+        Args:
+            session_id: 会话 ID
+            messages: 前端发送的消息列表
+            user_id: 用户 ID（可选），用于验证会话所属权
+            
+        Returns:
+            (含本轮用户消息的完整消息列表, 待保存的对话轮)，会话不存在或不属于该用户时返回 None
+        """
+        cached, token = self._get_cached_session(session_id)
+        if cached is not None:
+            if user_id and cached["owner"] != user_id:
+                return None
+            stored = cached["messages"]
+            last_seq = None if cached["last_seq"] < 0 else cached["last_seq"]
+        else:
+            db = self.SessionLocal()
+            try:
+                # 会话左连接消息：会话不存在时没有结果，空会话只有一行消息字段为空的结果
+                query = db.query(
+                    self.DBSession.user_id, self.Message.seq, self.Message.role, self.Message.content
+                ).select_from(self.DBSession).outerjoin(
+                    self.Message, self.Message.session_id == self.DBSession.id
+                ).filter(self.DBSession.id == session_id)
+                if user_id:
+                    query = query.filter(self.DBSession.user_id == user_id)
+                rows = query.order_by(self.Message.seq).all()
+            finally:
+                db.close()
+            if not rows:
+                return None
+            stored = [(row.seq, row.role, row.content) for row in rows if row.role is not None]
+            last_seq = rows[-1].seq
+            if self.session_cache is not None:
+                self.session_cache.fill(session_id, token, rows[0].user_id, stored)
+        
+        history = [{"role": role, "content": content} for _, role, content in stored]
+        # 后台写入模式下本进程已提交、尚未写入数据库的消息
+        history.extend(self.writer.pending(session_id))
+        if history:
+            # 会话中已有消息时，前端发送的是完整的对话历史，
+            # assistant 的消息由本服务生成并已保存，只需存储最新的用户消息
+            user_messages = [msg for msg in messages if msg.get("role") == "user"]
+            new_messages = user_messages[-1:]
+        else:
+            # 如果会话是空的，存储所有消息
+            new_messages = list(messages)
+        turn = {
+            "session_id": session_id,
+            "messages": new_messages,
+            "last_seq": last_seq,
+            "saved": False
+        }
+        return history + new_messages, turn
+    
+    def _save_turn(self, turn: Optional[Dict[str, Any]], reply: Optional[str] = None) -> None:
+        """
+        保存一轮对话：本轮的用户消息和回复用一条多行 INSERT 在一个事务中写入，每轮只保存一次；
+        写入失败时由 ChatWriter 保留并重试，不影响本轮的响应
+        
+        Args:
+            turn: _load_session_messages 返回的对话轮，为 None（没有会话）时不做任何事
+            reply: 大模型的回复，为空时只保存用户消息
+        """
+        if turn is None or turn["saved"]:
+            return
+        turn["saved"] = True
+        messages = turn["messages"] + ([{"role": "assistant", "content": reply}] if reply else [])
+        self.writer.submit({"session_id": turn["session_id"], "messages": messages, "last_seq": turn["last_seq"]})
+    
+    def _save_unfinished_turn(self, turn: Optional[Dict[str, Any]]) -> None:
+        """没有得到回复（上游出错、客户端断开）的对话轮只保存用户消息，失败时只记录日志"""
+        try:
+            self._save_turn(turn)
+        except Exception as e:
+            logger.error(f"保存会话 {turn['session_id']} 的用户消息失败: {e}")
+    
+    def _load_memory_session(self, session_id: str, messages: list, user_id: Optional[int] = None) -> Optional[List[Dict[str, str]]]:
+        """
+        内存存储模式下读取会话（不存在时创建）并保存本轮新增的消息
+        
+        Args:
+            session_id: 会话 ID
+            messages: 前端发送的消息列表
+            user_id: 用户 ID（可选），用于验证会话所属权
+            
+        Returns:
+            完整消息列表，会话不属于该用户时返回 None
+        """
+        session_data = self.session_store.get(session_id)
+        if session_data is None:
+            # 创建新会话
+            self.session_store.create(session_id, user_id)
+            session_data = {"user_id": user_id, "messages": []}
+        # 验证用户ID
+        if user_id is not None and session_data.get("user_id") != user_id:
+            return None
+        
+        if session_data["messages"]:
+            # 如果会话中已有消息，前端发送的是完整的对话历史，只存储最新的用户消息
+            user_messages = [msg for msg in messages if msg.get("role") == "user"]
+            new_messages = user_messages[-1:]
+        else:
+            # 如果会话是空的，存储所有消息
+            new_messages = list(messages)
+        self.session_store.append(session_id, new_messages)
+        return session_data["messages"] + new_messages
+    
+    def _iter_stream_chunks(self, response):
+        """
+        解析上游的 SSE 流式响应
+        
+        Args:
+            response: requests 的流式响应
+            
+        Yields:
+            (本块的文本内容, 用量统计)，两者都可能为 None
+        """
+        for line in response.iter_lines():
+            if not line:
+                continue
+            # 处理 SSE 格式
+            line = line.decode('utf-8')
+            if not line.startswith('data: '):
+                continue
+            chunk_data = line[6:]
+            if chunk_data == '[DONE]':
+                # 不提前退出：把响应读完，连接才能放回连接池复用
+                continue
+            try:
+                chunk_json = json.loads(chunk_data)
+            except ValueError:
+                continue
+            choices = chunk_json.get('choices') or [{}]
+            yield choices[0].get('delta', {}).get('content'), chunk_json.get('usage')
+    
     def delete_session(self, session_id: str, user_id: Optional[int] = None) -> Dict[str, Any]:
         """
         删除会话
@@ -872,6 +994,8 @@ class AIService:
                 # 删除会话（级联删除消息）
                 db.delete(session)
                 db.commit()
+                self._invalidate_context(session_id)
+                self._invalidate_session_cache(session_id)
                 
                 return {"session_id": session_id}
             except Exception as e:
@@ -881,13 +1005,14 @@ class AIService:
                 db.close()
         else:
             # 使用内存存储
-            session_data = self.sessions.get(session_id)
+            session_data = self.session_store.get(session_id)
             if not session_data:
                 return {"error": "Session not found"}
             # 验证用户ID
             if user_id is not None and session_data.get("user_id") != user_id:
                 return {"error": "Session not found or not owned by user"}
-            del self.sessions[session_id]
+            self.session_store.delete(session_id)
+            self._invalidate_context(session_id)
             return {"session_id": session_id}
     
     def delete_message(self, session_id: str, message_index: int, user_id: Optional[int] = None) -> Dict[str, Any]:
@@ -914,13 +1039,23 @@ class AIService:
                     return {"error": "Session not found or not owned by user"}
                 
                 # 检查消息索引是否有效
-                if message_index < 0 or message_index >= len(session.messages):
+                if message_index < 0 or message_index >= session.message_count:
+                    return {"error": "Invalid message index"}
+                
+                # 按位置定位只需扫描 (session_id, seq) 索引，不读取消息内容
+                message_id = db.query(self.Message.id).filter(
+                    self.Message.session_id == session_id
+                ).order_by(self.Message.seq).offset(message_index).limit(1).scalar()
+                if message_id is None:
                     return {"error": "Invalid message index"}
                 
                 # 删除指定索引的消息
-                message_to_delete = session.messages[message_index]
-                db.delete(message_to_delete)
+                db.query(self.Message).filter(self.Message.id == message_id).delete(synchronize_session=False)
+                session.message_count = self.DBSession.message_count - 1
                 db.commit()
+                # 摘要按消息位置记录，删除消息后需重新生成
+                self._invalidate_context(session_id)
+                self._invalidate_session_cache(session_id)
                 
                 return {
                     "session_id": session_id,
@@ -933,17 +1068,16 @@ class AIService:
                 db.close()
         else:
             # 使用内存存储
-            session_data = self.sessions.get(session_id)
+            session_data = self.session_store.get(session_id)
             if not session_data:
                 return {"error": "Session not found"}
             # 验证用户ID
             if user_id is not None and session_data.get("user_id") != user_id:
                 return {"error": "Session not found or not owned by user"}
-            messages = session_data.get("messages", [])
-            if message_index < 0 or message_index >= len(messages):
-                return {"error": "Invalid message index"}
             # 删除指定索引的消息
-            del messages[message_index]
+            if not self.session_store.delete_message(session_id, message_index):
+                return {"error": "Invalid message index"}
+            self._invalidate_context(session_id)
             
             return {
                 "session_id": session_id,
@@ -975,6 +1109,7 @@ class AIService:
                     sessions_list.append({
                         "session_id": session.id,
                         "title": session.title,
+                        "message_count": session.message_count,
                         "created_at": session.created_at.isoformat() if session.created_at else None,
                         "updated_at": session.updated_at.isoformat() if session.updated_at else None
                     })
@@ -987,13 +1122,11 @@ class AIService:
         else:
             # 使用内存存储
             sessions_list = []
-            for session_id, session_data in self.sessions.items():
-                # 验证用户ID
-                if user_id is not None and session_data.get("user_id") != user_id:
-                    continue
+            for session_data in self.session_store.list(user_id):
                 sessions_list.append({
-                    "session_id": session_id,
+                    "session_id": session_data["session_id"],
                     "title": "新会话",
+                    "message_count": session_data["message_count"],
                     "created_at": None,
                     "updated_at": None
                 })
@@ -1038,7 +1171,7 @@ class AIService:
                 db.close()
         else:
             # 使用内存存储
-            session_data = self.sessions.get(session_id)
+            session_data = self.session_store.get(session_id)
             if not session_data:
                 return {"error": "Session not found"}
             # 验证用户ID
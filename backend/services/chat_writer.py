@@ -0,0 +1,253 @@
+import os
+import uuid
+import queue
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import func
+from sqlalchemy.exc import IntegrityError
+from spiders.database_news import Session as DBSession, Message
+
+logger = logging.getLogger(__name__)
+
+# 写入方式：sync 在请求内写入；background 交给后台线程写入，回复结束后不等待数据库
+WRITE_MODE = os.getenv("CHAT_WRITE_MODE", "sync").lower()
+# 后台线程一个事务最多合并的对话轮数
+BATCH_SIZE = int(os.getenv("CHAT_WRITE_BATCH_SIZE", 100))
+# 后台队列最多积压的对话轮数，队列满时退回在请求内写入
+QUEUE_SIZE = int(os.getenv("CHAT_WRITE_QUEUE_SIZE", 10000))
+# 写入失败（数据库暂时不可用等）的对话轮最多尝试的次数，之后丢弃并记录日志
+MAX_ATTEMPTS = int(os.getenv("CHAT_WRITE_MAX_ATTEMPTS", 5))
+# 后台模式下重试失败对话轮的间隔（秒）；同步模式下在下一次写入时重试
+RETRY_INTERVAL = float(os.getenv("CHAT_WRITE_RETRY_INTERVAL", 5))
+
+class ChatWriter:
+    """
+    对话消息的批量写入
+
+    一轮对话的用户消息和回复在回复结束后一起写入：一条多行 INSERT、每个会话一条计数 UPDATE
+    和一次提交。序号从读取历史时的最大序号顺延，不再另外查询 MAX(seq)；并发写入同一会话时
+    由 (session_id, seq) 唯一索引发现冲突，查询最新序号后重试一次。后台模式下由后台线程把
+    多个请求的写入合并到一个事务中，尚未写入的消息保留在进程内，同一进程读取历史时一并返回。
+    写入失败的对话轮同样保留在进程内并在之后重试，不会因为数据库暂时不可用而丢失已生成的回复；
+    会话已被删除的对话轮直接丢弃，序号反复冲突的对话轮同样留待重试。提交后把消息追加到会话缓存（SessionCache）。
+    """
+
+    def __init__(self, session_factory, background: bool = WRITE_MODE == "background", cache=None):
+        self.session_factory = session_factory
+        self.background = background
+        self.cache = cache
+        self._queue: "queue.Queue" = queue.Queue(maxsize=QUEUE_SIZE)
+        # 尚未写入数据库的对话轮（按会话，按提交顺序），包括等待重试的对话轮
+        self._pending: Dict[str, List[Dict[str, Any]]] = {}
+        # 等待重试的对话轮
+        self._retry: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, turn: Dict[str, Any]) -> None:
+        """
+        写入一轮对话的消息，写入失败时保留在进程内稍后重试，不抛出异常
+
+        Args:
+            turn: {"session_id": 会话 ID, "messages": [{"role", "content"}, ...],
+                "last_seq": 读取历史时会话的最大序号，空会话为 None}
+        """
+        if not turn["messages"]:
+            return
+        with self._lock:
+            if self._thread is not None:
+                try:
+                    self._queue.put_nowait(turn)
+                    self._pending.setdefault(turn["session_id"], []).append(turn)
+                    return
+                except queue.Full:
+                    logger.warning("对话写入队列已满，改为同步写入")
+        self._flush([turn])
+
+    def pending(self, session_id: str) -> List[Dict[str, str]]:
+        """返回本进程已提交、尚未写入数据库的消息（含等待重试的消息）"""
+        with self._lock:
+            return [msg for turn in self._pending.get(session_id, ()) for msg in turn["messages"]]
+
+    def write(self, turns: List[Dict[str, Any]]) -> None:
+        """
+        在一个事务中写入多轮对话的消息
+
+        Args:
+            turns: 对话轮列表，格式同 submit
+        """
+        db = self.session_factory()
+        try:
+            rows = self._write_batch(db, turns)
+        finally:
+            db.close()
+        if self.cache is not None:
+            appended: Dict[str, List[Tuple[int, str, str]]] = {}
+            for row in rows:
+                appended.setdefault(row["session_id"], []).append((row["seq"], row["role"], row["content"]))
+            for session_id, messages in appended.items():
+                self.cache.append(session_id, messages)
+
+    def start(self) -> None:
+        """后台模式下启动写入线程，同步模式下不做任何事"""
+        if not self.background or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="chat-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """停止写入线程，退出前写完队列中的消息"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        # 之后提交的消息直接同步写入，结束标记排在已提交的消息之后
+        self._queue.put(None)
+        thread.join(timeout=30)
+        # 退出前最后重试一次仍未写入的对话轮
+        if self._retry:
+            self._flush([])
+
+    def _write_batch(self, db, turns: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        last_seqs: Dict[str, int] = {}
+        for attempt in range(2):
+            rows, counts = self._build_rows(turns, last_seqs)
+            try:
+                db.execute(Message.__table__.insert().values(rows))
+                for session_id, count in counts.items():
+                    db.query(DBSession).filter(DBSession.id == session_id).update(
+                        {DBSession.message_count: DBSession.message_count + count},
+                        synchronize_session=False
+                    )
+                db.commit()
+                return rows
+            except IntegrityError:
+                db.rollback()
+                if attempt:
+                    raise
+                # 其他请求已写入同一会话，序号冲突：按数据库中最新的序号重新编号
+                last_seqs = dict(
+                    db.query(Message.session_id, func.max(Message.seq))
+                    .filter(Message.session_id.in_(list(counts)))
+                    .group_by(Message.session_id)
+                    .all()
+                )
+            except Exception:
+                db.rollback()
+                raise
+
+    def _build_rows(self, turns: List[Dict[str, Any]], last_seqs: Dict[str, int]):
+        """为各轮消息按会话连续编号，返回 (INSERT 的行, 各会话新增的消息数)"""
+        rows = []
+        next_seqs: Dict[str, int] = {}
+        for turn in turns:
+            session_id = turn["session_id"]
+            last_seq = last_seqs.get(session_id, turn["last_seq"])
+            # 同一批中同一会话的后一轮接在前一轮之后
+            seq = max(next_seqs.get(session_id, 0), 0 if last_seq is None else last_seq + 1)
+            for msg in turn["messages"]:
+                rows.append({
+                    "id": str(uuid.uuid4()),
+                    "session_id": session_id,
+                    "role": msg.get("role"),
+                    "content": msg.get("content"),
+                    "seq": seq
+                })
+                seq += 1
+            next_seqs[session_id] = seq
+        counts: Dict[str, int] = {}
+        for row in rows:
+            counts[row["session_id"]] = counts.get(row["session_id"], 0) + 1
+        return rows, counts
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            batch = []
+            try:
+                # 有等待重试的对话轮时定期醒来重试
+                item = self._queue.get(timeout=RETRY_INTERVAL if self._retry else None)
+            except queue.Empty:
+                self._flush([])
+                continue
+            while item is not None:
+                batch.append(item)
+                if len(batch) >= BATCH_SIZE:
+                    break
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+            stopping = item is None
+            if batch:
+                self._flush(batch)
+
+    def _flush(self, batch: List[Dict[str, Any]]) -> None:
+        """写入一批对话轮和等待重试的对话轮，失败的对话轮留待重试"""
+        with self._lock:
+            retry, self._retry = self._retry, []
+        # 等待重试的对话轮更早提交，排在前面，同一会话的序号保持提交顺序
+        turns = retry + batch
+        if not turns:
+            return
+        done = []
+        try:
+            self.write(turns)
+            done = turns
+        except IntegrityError as e:
+            # 批次中有无法写入的对话轮（如会话已被删除）：逐轮写入，只丢弃这些对话轮
+            logger.warning(f"批量写入对话消息失败，改为逐轮写入: {e}")
+            for turn in turns:
+                try:
+                    self.write([turn])
+                    done.append(turn)
+                except IntegrityError as e:
+                    # 会话已被删除（外键约束）时丢弃；会话仍在说明是其他进程再次写入了同一会话，
+                    # 重新编号后序号仍然冲突，留待重试
+                    if self._session_exists(turn["session_id"]) is False:
+                        logger.error(f"会话 {turn['session_id']} 已不存在，消息已丢弃: {e}")
+                        done.append(turn)
+                    elif self._give_up(turn, e):
+                        done.append(turn)
+                except Exception as e:
+                    if self._give_up(turn, e):
+                        done.append(turn)
+        except Exception as e:
+            # 数据库暂时不可用等：整批留待重试，不再逐轮尝试
+            logger.warning(f"写入 {len(turns)} 轮对话消息失败，稍后重试: {e}")
+            done = [turn for turn in turns if self._give_up(turn, e)]
+        done_ids = {id(turn) for turn in done}
+        with self._lock:
+            for turn in turns:
+                # 按对象比较，内容相同的两轮对话互不影响
+                pending = self._pending.get(turn["session_id"], [])
+                if id(turn) in done_ids:
+                    pending = [item for item in pending if item is not turn]
+                else:
+                    if not any(item is turn for item in pending):
+                        pending.append(turn)
+                    self._retry.append(turn)
+                if pending:
+                    self._pending[turn["session_id"]] = pending
+                else:
+                    self._pending.pop(turn["session_id"], None)
+
+    def _session_exists(self, session_id: str) -> Optional[bool]:
+        """会话是否仍在数据库中，查询失败时返回 None"""
+        db = self.session_factory()
+        try:
+            return db.query(DBSession.id).filter(DBSession.id == session_id).first() is not None
+        except Exception as e:
+            logger.warning(f"查询会话 {session_id} 失败: {e}")
+            return None
+        finally:
+            db.close()
+
+    def _give_up(self, turn: Dict[str, Any], error: Exception) -> bool:
+        """记录一次失败，达到 MAX_ATTEMPTS 次时放弃该对话轮"""
+        turn["attempts"] = turn.get("attempts", 0) + 1
+        if turn["attempts"] < MAX_ATTEMPTS:
+            return False
+        logger.error(f"写入会话 {turn['session_id']} 的消息失败 {turn['attempts']} 次，已丢弃: {error}")
+        return True
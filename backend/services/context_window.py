@@ -0,0 +1,157 @@
+import os
+import json
+import logging
+import threading
+import functools
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 分词器：本地 tokenizer.json 路径（Docker 镜像构建时从 deepseek-ai/DeepSeek-V3 下载），
+# 也可以设为 Hugging Face 仓库名，在首次使用时下载
+TOKENIZER = os.getenv("LLM_TOKENIZER", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "deepseek_tokenizer.json"))
+# 每轮发给大模型的历史消息 token 上限（含摘要和 system 消息，不含回复）
+CONTEXT_TOKENS = int(os.getenv("CHAT_CONTEXT_TOKENS", 6000))
+# 超出上限时，最近的消息保留到上限的该比例，更早的消息并入摘要；
+# 留出余量使之后几轮都不需要再次生成摘要
+KEEP_RATIO = float(os.getenv("CHAT_CONTEXT_KEEP_RATIO", 0.5))
+# 摘要的最大 token 数
+SUMMARY_TOKENS = int(os.getenv("CHAT_SUMMARY_TOKENS", 512))
+# 摘要在 Redis 中的保留时间（秒）
+STATE_TTL = int(os.getenv("CHAT_CONTEXT_STATE_TTL", 7 * 24 * 3600))
+# 每条消息的格式开销（角色标记等）
+MESSAGE_OVERHEAD = 4
+
+KEY_PREFIX = "chat_context"
+
+_tokenizer = None
+_tokenizer_loaded = False
+_tokenizer_lock = threading.Lock()
+
+def _get_tokenizer():
+    """首次使用时加载分词器，加载失败（未安装 tokenizers 或无法下载）时返回 None"""
+    global _tokenizer, _tokenizer_loaded
+    if not _tokenizer_loaded:
+        with _tokenizer_lock:
+            if not _tokenizer_loaded:
+                try:
+                    from tokenizers import Tokenizer
+                    if os.path.exists(TOKENIZER):
+                        _tokenizer = Tokenizer.from_file(TOKENIZER)
+                    elif not TOKENIZER.endswith(".json"):
+                        _tokenizer = Tokenizer.from_pretrained(TOKENIZER)
+                    else:
+                        logger.warning(f"分词器文件 {TOKENIZER} 不存在，按字符估算 token 数")
+                except Exception as e:
+                    logger.warning(f"加载分词器 {TOKENIZER} 失败，按字符估算 token 数: {e}")
+                _tokenizer_loaded = True
+    return _tokenizer
+
+def estimate_tokens(text: str) -> int:
+    """按 DeepSeek 官方的换算估算：中文字符约 0.6 token，其他字符约 0.3 token"""
+    cjk = sum(1 for char in text if "一" <= char <= "鿿")
+    return int(cjk * 0.6 + (len(text) - cjk) * 0.3) + 1
+
+@functools.lru_cache(maxsize=4096)
+def count_tokens(text: str) -> int:
+    """
+    计算文本的 token 数，结果按文本缓存，历史消息每轮只需分词一次
+
+    Args:
+        text: 文本
+
+    Returns:
+        token 数
+    """
+    tokenizer = _get_tokenizer()
+    if tokenizer is None:
+        return estimate_tokens(text)
+    return len(tokenizer.encode(text, add_special_tokens=False).ids)
+
+def message_tokens(message: Dict[str, str]) -> int:
+    return count_tokens(message.get("content") or "") + MESSAGE_OVERHEAD
+
+class ContextWindow:
+    """
+    按 token 预算裁剪发给大模型的对话历史
+
+    从最新的消息往前保留，直到用完预算；更早的消息由大模型压缩成一段滚动摘要，
+    摘要和它覆盖到的消息位置缓存在 Redis 中。之后每轮只需处理摘要之后的消息，
+    分词和摘要的开销都与会话总长度无关。Redis 不可用时不使用摘要，只保留最近的消息。
+    """
+
+    def __init__(self, redis_client):
+        self.redis = redis_client
+
+    def build(self, session_id: Optional[str], messages: List[Dict[str, str]], summarize: Callable[[Optional[str], List[Dict[str, str]]], Optional[str]]) -> List[Dict[str, str]]:
+        """
+        生成本轮发给大模型的消息列表
+
+        Args:
+            session_id: 会话 ID，为 None 时不生成摘要，只裁剪
+            messages: 会话的完整消息列表（含本轮的用户消息）
+            summarize: 摘要函数，参数为已有摘要和需要并入的消息，返回新摘要，失败时返回 None
+
+        Returns:
+            开头的 system 消息 + 摘要 + 最近的消息
+        """
+        # 开头的 system 消息始终保留
+        system_count = 0
+        while system_count < len(messages) and messages[system_count].get("role") == "system":
+            system_count += 1
+        system, history = messages[:system_count], messages[system_count:]
+        budget = CONTEXT_TOKENS - sum(message_tokens(msg) for msg in system)
+
+        state = self._load_state(session_id)
+        summarized = state["upto"] if state and state["upto"] <= len(history) else 0
+        summary = state["summary"] if summarized else None
+
+        summary_tokens = count_tokens(summary) + MESSAGE_OVERHEAD if summary else 0
+        start = self._window_start(history, summarized, len(history), budget - summary_tokens)
+        if start > summarized and session_id:
+            # 放不下的消息并入摘要；最近的消息只保留到预算的 KEEP_RATIO，
+            # 之后几轮的新消息仍能直接放进窗口
+            keep_start = max(start, self._window_start(history, summarized, len(history), int(budget * KEEP_RATIO) - SUMMARY_TOKENS))
+            # 一次最多摘要 CONTEXT_TOKENS 的消息，尚无摘要的长会话更早的部分直接舍弃
+            summary_start = self._window_start(history, summarized, keep_start, CONTEXT_TOKENS)
+            new_summary = summarize(summary, history[summary_start:keep_start])
+            if new_summary:
+                summarized, summary, start = keep_start, new_summary, keep_start
+                self._save_state(session_id, summarized, summary)
+
+        window = history[start:]
+        if summary:
+            window = [{"role": "system", "content": f"以下是此前对话的摘要：\n{summary}"}] + window
+        return system + window
+
+    def invalidate(self, session_id: str) -> None:
+        """会话的消息被删除后清除摘要，下一轮重新生成"""
+        try:
+            self.redis.delete(f"{KEY_PREFIX}:{session_id}")
+        except Exception as e:
+            logger.warning(f"清除对话摘要失败: {e}")
+
+    def _window_start(self, history: List[Dict[str, str]], lower: int, upper: int, budget: int) -> int:
+        """从 upper 之前的消息往前累加到 lower，返回预算内能保留的最早位置（至少保留一条消息）"""
+        used = 0
+        for index in range(upper - 1, lower - 1, -1):
+            used += message_tokens(history[index])
+            if used > budget:
+                return min(index + 1, upper - 1)
+        return lower
+
+    def _load_state(self, session_id: Optional[str]) -> Optional[Dict]:
+        if not session_id:
+            return None
+        try:
+            state = self.redis.get(f"{KEY_PREFIX}:{session_id}")
+        except Exception as e:
+            logger.warning(f"读取对话摘要失败: {e}")
+            return None
+        return json.loads(state) if state else None
+
+    def _save_state(self, session_id: str, upto: int, summary: str) -> None:
+        try:
+            self.redis.setex(f"{KEY_PREFIX}:{session_id}", STATE_TTL, json.dumps({"upto": upto, "summary": summary}, ensure_ascii=False))
+        except Exception as e:
+            logger.warning(f"保存对话摘要失败: {e}")
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+新闻近似重复检测
+功能：为新闻正文计算 64 位 SimHash 指纹，在内存索引中查找海明距离不超过阈值的
+已有新闻，供爬虫在入库前识别同一稿件在不同 URL 下的转载
+
+用法:
+    python -m services.duplicate_detector backfill   # 为已有新闻补算指纹
+"""
+
+import os
+import re
+import sys
+import hashlib
+import logging
+import argparse
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+# 添加上级目录到系统路径，以便直接运行本脚本
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+logger = logging.getLogger(__name__)
+
+# 海明距离不超过该值视为近似重复
+MAX_DISTANCE = int(os.getenv("SIMHASH_MAX_DISTANCE", 3))
+# 字符 shingle 长度
+SHINGLE_SIZE = 3
+FINGERPRINT_BITS = 64
+
+TAG_RE = re.compile(r"<[^>]+>")
+# 去掉空白和标点，只保留文字和数字，避免排版差异影响指纹
+NOISE_RE = re.compile(r"[^0-9a-zA-Z一-鿿]+")
+
+BIT_MASKS = np.array([1 << i for i in range(FINGERPRINT_BITS)], dtype=np.uint64)
+
+def simhash(title: str, content: str) -> int:
+    """
+    计算新闻的 SimHash 指纹
+
+    Args:
+        title: 标题
+        content: 正文（HTML）
+
+    Returns:
+        64 位无符号整数指纹
+    """
+    text = NOISE_RE.sub("", f"{title or ''}{TAG_RE.sub(' ', content or '')}").lower()
+    shingles = Counter(text[i:i + SHINGLE_SIZE] for i in range(max(len(text) - SHINGLE_SIZE + 1, 1)))
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=8).digest(), "little") for s in shingles],
+        dtype=np.uint64
+    )
+    weights = np.array(list(shingles.values()), dtype=np.int64)
+    # 每一位：该位为 1 的 shingle 加权重，为 0 的减权重，最终大于 0 的位置 1
+    bits = (hashes[:, None] & BIT_MASKS) != 0
+    totals = weights @ np.where(bits, 1, -1)
+    return sum(1 << int(i) for i in np.flatnonzero(totals > 0))
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+def to_db(fingerprint: int) -> int:
+    """无符号指纹转为有符号 64 位整数，以便存入 BIGINT 列"""
+    return fingerprint - (1 << 64) if fingerprint >= 1 << 63 else fingerprint
+
+def from_db(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+class SimHashIndex:
+    """
+    SimHash 指纹的内存索引
+
+    按抽屉原理把 64 位指纹切成 MAX_DISTANCE + 1 段：海明距离不超过 MAX_DISTANCE
+    的两个指纹至少有一段完全相同。每段各建一个哈希表，查询只需比较与任一段相同的
+    少量候选，几十万条指纹下单次查询也在亚毫秒级。
+    """
+
+    def __init__(self, max_distance: int = MAX_DISTANCE):
+        self.max_distance = max_distance
+        band_count = max_distance + 1
+        width = FINGERPRINT_BITS // band_count
+        # (起始位, 位宽)，最后一段包含剩余的位
+        self.bands = [
+            (i * width, width if i < band_count - 1 else FINGERPRINT_BITS - i * width)
+            for i in range(band_count)
+        ]
+        self.tables: List[Dict[int, List[int]]] = [{} for _ in self.bands]
+        self.fingerprints: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self.fingerprints)
+
+    def add(self, news_id: int, fingerprint: int) -> None:
+        self.fingerprints[news_id] = fingerprint
+        for table, key in zip(self.tables, self._band_keys(fingerprint)):
+            table.setdefault(key, []).append(news_id)
+
+    def find(self, fingerprint: int) -> Optional[Tuple[int, int]]:
+        """
+        查找最相近的近似重复新闻
+
+        Args:
+            fingerprint: 待查指纹
+
+        Returns:
+            (新闻 ID, 海明距离)；没有近似重复时返回 None
+        """
+        best = None
+        for table, key in zip(self.tables, self._band_keys(fingerprint)):
+            for news_id in table.get(key, ()):
+                distance = hamming(fingerprint, self.fingerprints[news_id])
+                if distance <= self.max_distance and (best is None or distance < best[1]):
+                    best = (news_id, distance)
+        return best
+
+    def _band_keys(self, fingerprint: int) -> List[int]:
+        return [(fingerprint >> start) & ((1 << width) - 1) for start, width in self.bands]
+
+def load_index(db) -> SimHashIndex:
+    """
+    从数据库加载全部已有指纹
+
+    Args:
+        db: 数据库会话
+
+    Returns:
+        指纹索引
+    """
+    from spiders.database_news import News
+
+    index = SimHashIndex()
+    for news_id, value in db.query(News.id, News.simhash).filter(News.simhash.isnot(None)).yield_per(10000):
+        index.add(news_id, from_db(value))
+    logger.info(f"已加载 {len(index)} 条新闻指纹")
+    return index
+
+def backfill(batch_size: int = 500) -> int:
+    """
+    为尚无指纹的已有新闻计算并写入指纹
+
+    Returns:
+        补算的新闻数量
+    """
+    from spiders.database_news import SessionLocal, News
+
+    db = SessionLocal()
+    total = 0
+    try:
+        while True:
+            rows = db.query(News.id, News.title, News.content).filter(
+                News.simhash.is_(None)
+            ).order_by(News.id).limit(batch_size).all()
+            if not rows:
+                break
+            db.bulk_update_mappings(News, [
+                {"id": row.id, "simhash": to_db(simhash(row.title, row.content))} for row in rows
+            ])
+            db.commit()
+            total += len(rows)
+        return total
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="新闻近似重复检测")
+    parser.add_argument("action", choices=["backfill"])
+    args = parser.parse_args()
+    print(f"补算指纹 {backfill()} 篇")
@@ -0,0 +1,184 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 缓存有效期（秒）
+CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", 300))
+# 最多保留的缓存条数，超出时淘汰最早写入的条目
+MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", 10000))
+# 单条缓存的最大字节数，更大的响应不缓存
+MAX_ENTRY_BYTES = int(os.getenv("LLM_CACHE_MAX_ENTRY_BYTES", 65536))
+
+KEY_PREFIX = "llm_cache"
+# 按写入时间排序的缓存键索引，用于条数上限的淘汰
+INDEX_KEY = f"{KEY_PREFIX}:index"
+
+# 影响大模型输出的请求参数，其余字段（如 stream）不进入缓存键
+KEY_PARAMS = ("model", "temperature", "top_p", "max_tokens", "presence_penalty", "frequency_penalty", "stop")
+
+def parse_cache_control(value: Optional[str]) -> Dict[str, Any]:
+    """
+    解析请求的缓存控制，语义与 HTTP Cache-Control 相同
+
+    - no-cache：不读缓存，结果照常写入（强制刷新）
+    - no-store：既不读也不写缓存
+    - max-age=N：只接受 N 秒内写入的缓存
+
+    Args:
+        value: 缓存控制字符串，多个指令以逗号分隔
+
+    Returns:
+        {"no_cache": bool, "no_store": bool, "max_age": int 或 None}
+    """
+    flags = {"no_cache": False, "no_store": False, "max_age": None}
+    for directive in (value or "").lower().split(","):
+        directive = directive.strip()
+        if directive == "no-cache":
+            flags["no_cache"] = True
+        elif directive == "no-store":
+            flags["no_store"] = True
+        elif directive.startswith("max-age="):
+            try:
+                flags["max_age"] = int(directive[8:])
+            except ValueError:
+                pass
+    return flags
+
+def normalize_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """只保留影响输出的字段，去掉消息首尾空白，使等价请求得到同一缓存键"""
+    messages = [
+        {"role": (msg.get("role") or "").strip().lower(), "content": (msg.get("content") or "").strip()}
+        for msg in payload.get("messages", [])
+    ]
+    params = {name: payload[name] for name in KEY_PARAMS if payload.get(name) is not None}
+    return {"messages": messages, **params}
+
+def payload_hash(payload: Dict[str, Any]) -> str:
+    """规范化请求体的 SHA-256，等价请求得到同一个值（缓存键和请求合并共用）"""
+    normalized = json.dumps(normalize_payload(payload), sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+class LLMCache:
+    """
+    大模型响应的 Redis 精确匹配缓存
+
+    缓存键为规范化后的模型、消息和参数的哈希；缓存内容是按块保存的回复文本和用量，
+    流式请求命中时按原样逐块重放。条数和单条大小都有上限。Redis 不可用时直接
+    请求上游，不影响接口可用性。
+    """
+
+    def __init__(self, redis_client):
+        self.redis = redis_client
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "bypasses": 0,
+            "stores": 0,
+            "evictions": 0,
+            "oversize": 0,
+            "errors": 0,
+            "tokens_saved": 0
+        }
+
+    def get(self, payload: Dict[str, Any], cache_control: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        读取缓存
+
+        Args:
+            payload: 发往大模型的请求体
+            cache_control: 请求的缓存控制
+
+        Returns:
+            {"chunks": [...], "usage": {...}, "created_at": 写入时间}，未命中时返回 None
+        """
+        flags = parse_cache_control(cache_control)
+        if flags["no_cache"] or flags["no_store"]:
+            self._record("bypasses")
+            return None
+        try:
+            cached = self.redis.get(self._key(payload))
+        except Exception as e:
+            logger.warning(f"读取大模型缓存失败: {e}")
+            self._record("errors")
+            return None
+
+        if cached is None:
+            self._record("misses")
+            return None
+        entry = json.loads(cached)
+        if flags["max_age"] is not None and time.time() - entry["created_at"] > flags["max_age"]:
+            self._record("misses")
+            return None
+        with self._lock:
+            self._stats["hits"] += 1
+            self._stats["tokens_saved"] += (entry.get("usage") or {}).get("total_tokens", 0)
+        return entry
+
+    def set(self, payload: Dict[str, Any], chunks: List[str], usage: Optional[Dict[str, Any]], cache_control: Optional[str] = None) -> None:
+        """
+        写入缓存，超出条数上限时淘汰最早写入的条目
+
+        Args:
+            payload: 发往大模型的请求体
+            chunks: 回复文本，流式响应为各块，非流式响应为单个元素
+            usage: 上游返回的用量
+            cache_control: 请求的缓存控制，no-store 时不写入
+        """
+        if parse_cache_control(cache_control)["no_store"]:
+            return
+        now = time.time()
+        value = json.dumps({"chunks": chunks, "usage": usage, "created_at": now}, ensure_ascii=False)
+        if len(value.encode("utf-8")) > MAX_ENTRY_BYTES:
+            self._record("oversize")
+            return
+
+        key = self._key(payload)
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.setex(key, CACHE_TTL, value)
+            pipe.zadd(INDEX_KEY, {key: now})
+            # 已过期的键从索引中移除，索引条数即有效缓存条数
+            pipe.zremrangebyscore(INDEX_KEY, 0, now - CACHE_TTL)
+            pipe.zcard(INDEX_KEY)
+            size = pipe.execute()[-1]
+            evicted = self.redis.zpopmin(INDEX_KEY, size - MAX_ENTRIES) if size > MAX_ENTRIES else []
+            if evicted:
+                self.redis.delete(*[member for member, _ in evicted])
+        except Exception as e:
+            logger.warning(f"写入大模型缓存失败: {e}")
+            self._record("errors")
+            return
+        with self._lock:
+            self._stats["stores"] += 1
+            self._stats["evictions"] += len(evicted)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回本进程的命中率和节省的 token 数，以及 Redis 中的有效缓存条数"""
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        try:
+            entries = self.redis.zcount(INDEX_KEY, time.time() - CACHE_TTL, "+inf")
+        except Exception:
+            entries = None
+        return {
+            **stats,
+            "hit_rate": round(stats["hits"] / lookups, 4) if lookups else None,
+            "entries": entries,
+            "max_entries": MAX_ENTRIES,
+            "ttl": CACHE_TTL
+        }
+
+    def _key(self, payload: Dict[str, Any]) -> str:
+        return f"{KEY_PREFIX}:{payload_hash(payload)}"
+
+    def _record(self, counter: str) -> None:
+        with self._lock:
+            self._stats[counter] += 1
@@ -0,0 +1,235 @@
+import os
+import time
+import random
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# 建立 TCP/TLS 连接的超时（秒）
+CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", 5))
+# 两次收到数据之间的最长间隔（秒），流式响应按块计算
+READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", 90))
+# 失败后的最多重试次数，不含第一次请求
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", 2))
+# 退避基数和上限（秒），第 n 次重试在 [0, min(上限, 基数 × 2^n)] 内随机等待
+RETRY_BACKOFF = float(os.getenv("LLM_RETRY_BACKOFF", 0.5))
+RETRY_BACKOFF_MAX = float(os.getenv("LLM_RETRY_BACKOFF_MAX", 8))
+# 一次调用含全部重试和退避的最长耗时（秒），按每次尝试建连和读取各用满超时估算
+MAX_CALL_DURATION = (CONNECT_TIMEOUT + READ_TIMEOUT) * (MAX_RETRIES + 1) + RETRY_BACKOFF_MAX * MAX_RETRIES
+# 每个进程保留的上游空闲连接数，gevent 模式下并发流式会话较多
+POOL_MAXSIZE = int(os.getenv("LLM_POOL_MAXSIZE", 100))
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# 每项延迟指标保留的最近样本数，用于计算分位数
+SAMPLE_SIZE = 1000
+
+# 当前调用新建连接的耗时；gevent 打补丁后为协程局部变量
+_call = threading.local()
+
+class _TimedConnectMixin:
+    def connect(self):
+        start = time.perf_counter()
+        super().connect()
+        _call.connect_ms = getattr(_call, "connect_ms", 0.0) + (time.perf_counter() - start) * 1000
+
+class _TimedHTTPConnection(_TimedConnectMixin, HTTPConnection):
+    pass
+
+class _TimedHTTPSConnection(_TimedConnectMixin, HTTPSConnection):
+    pass
+
+class _TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TimedHTTPConnection
+
+class _TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TimedHTTPSConnection
+
+class _TimedAdapter(HTTPAdapter):
+    """新建连接时记录建连耗时（含 TLS 握手）的 HTTPAdapter"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        # 替换实例属性，不修改 urllib3 的全局映射
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TimedHTTPConnectionPool,
+            "https": _TimedHTTPSConnectionPool
+        }
+
+class LLMMetrics:
+    """调用次数、重试、失败以及建连、首字节、总耗时的累计指标"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {
+            "calls": 0,
+            "retries": 0,
+            "errors": 0,
+            "new_connections": 0
+        }
+        self._statuses: Dict[str, int] = {}
+        self._samples = {name: deque(maxlen=SAMPLE_SIZE) for name in ("connect_ms", "ttfb_ms", "total_ms")}
+
+    def incr(self, counter: str) -> None:
+        with self._lock:
+            self._counters[counter] += 1
+
+    def record_response(self, status_code: int, connect_ms: float, ttfb_ms: float) -> None:
+        with self._lock:
+            key = str(status_code)
+            self._statuses[key] = self._statuses.get(key, 0) + 1
+            if connect_ms:
+                self._counters["new_connections"] += 1
+                self._samples["connect_ms"].append(connect_ms)
+            self._samples["ttfb_ms"].append(ttfb_ms)
+
+    def record_total(self, total_ms: float) -> None:
+        with self._lock:
+            self._samples["total_ms"].append(total_ms)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._counters)
+            stats["statuses"] = dict(self._statuses)
+            samples = {name: sorted(values) for name, values in self._samples.items()}
+        for name, values in samples.items():
+            stats[name] = {
+                "avg": round(sum(values) / len(values), 1),
+                "p50": round(values[len(values) // 2], 1),
+                "p95": round(values[min(int(len(values) * 0.95), len(values) - 1)], 1),
+                "max": round(values[-1], 1)
+            } if values else None
+        return stats
+
+class LLMClient:
+    """
+    大模型 API 客户端
+
+    进程内共享一个 requests.Session，复用到上游的 keep-alive 连接；统一设置连接/读取超时，
+    遇到 429、5xx 和连接失败时带随机抖动地指数退避重试，并记录建连、首字节和总耗时。
+    连接池在每个进程内首次调用时创建；gunicorn fork 出工作进程后需调用 reset()，
+    不能与主进程共用继承来的连接（见 main.init_worker）。
+    """
+
+    def __init__(self):
+        self.metrics = LLMMetrics()
+        self._session: Optional[requests.Session] = None
+        self._lock = threading.Lock()
+
+    @property
+    def session(self) -> requests.Session:
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = _TimedAdapter(pool_connections=4, pool_maxsize=POOL_MAXSIZE)
+                    session.mount("https://", adapter)
+                    session.mount("http://", adapter)
+                    self._session = session
+        return self._session
+
+    def reset(self) -> None:
+        """丢弃当前进程的连接池，下次调用时重新建立"""
+        with self._lock:
+            session, self._session = self._session, None
+        if session is not None:
+            session.close()
+
+    def post(self, url: str, headers: Dict[str, str], payload: Dict[str, Any]) -> requests.Response:
+        """
+        发送非流式请求，返回时响应体已读取完毕
+
+        Args:
+            url: 接口地址
+            headers: 请求头
+            payload: JSON 请求体
+
+        Returns:
+            最后一次尝试的响应；重试用尽后仍为 429/5xx 时原样返回
+        """
+        start = time.perf_counter()
+        response = self._send(url, headers, payload, stream=False)
+        self.metrics.record_total((time.perf_counter() - start) * 1000)
+        return response
+
+    @contextmanager
+    def stream(self, url: str, headers: Dict[str, str], payload: Dict[str, Any]) -> Iterator[requests.Response]:
+        """
+        发送流式请求，退出上下文时关闭响应并记录总耗时（包括客户端中途断开的情况）
+
+        Args:
+            url: 接口地址
+            headers: 请求头
+            payload: JSON 请求体
+
+        Yields:
+            已收到响应头、尚未读取响应体的响应
+        """
+        start = time.perf_counter()
+        response = self._send(url, headers, payload, stream=True)
+        try:
+            yield response
+        finally:
+            response.close()
+            self.metrics.record_total((time.perf_counter() - start) * 1000)
+
+    def stats(self) -> Dict[str, Any]:
+        """当前进程的累计指标和客户端配置"""
+        return {
+            "connect_timeout": CONNECT_TIMEOUT,
+            "read_timeout": READ_TIMEOUT,
+            "max_retries": MAX_RETRIES,
+            "pool_maxsize": POOL_MAXSIZE,
+            **self.metrics.snapshot()
+        }
+
+    def _send(self, url: str, headers: Dict[str, str], payload: Dict[str, Any], stream: bool) -> requests.Response:
+        self.metrics.incr("calls")
+        attempt = 0
+        while True:
+            _call.connect_ms = 0.0
+            try:
+                response = self.session.post(
+                    url,
+                    headers=headers,
+                    json=payload,
+                    stream=stream,
+                    timeout=(CONNECT_TIMEOUT, READ_TIMEOUT)
+                )
+            except (requests.ConnectionError, requests.ConnectTimeout):
+                # 建连失败或复用的空闲连接已被上游关闭时重试；读取超时说明上游已在处理，不重试
+                if attempt >= MAX_RETRIES:
+                    self.metrics.incr("errors")
+                    raise
+                self._backoff(attempt)
+                attempt += 1
+                continue
+            except Exception:
+                self.metrics.incr("errors")
+                raise
+
+            # elapsed 为发出请求到解析完响应头的时间
+            self.metrics.record_response(
+                response.status_code,
+                _call.connect_ms,
+                response.elapsed.total_seconds() * 1000
+            )
+            if response.status_code not in RETRY_STATUSES or attempt >= MAX_RETRIES:
+                return response
+            retry_after = response.headers.get("Retry-After")
+            response.close()
+            self._backoff(attempt, retry_after)
+            attempt += 1
+
+    def _backoff(self, attempt: int, retry_after: Optional[str] = None) -> None:
+        self.metrics.incr("retries")
+        delay = random.uniform(0, min(RETRY_BACKOFF_MAX, RETRY_BACKOFF * (2 ** attempt)))
+        if retry_after and retry_after.isdigit():
+            # 上游明确要求的等待时间优先，但不超过退避上限
+            delay = max(delay, min(float(retry_after), RETRY_BACKOFF_MAX))
+        time.sleep(delay)
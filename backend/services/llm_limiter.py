@@ -0,0 +1,316 @@
+import os
+import time
+import uuid
+import logging
+import threading
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 同时进行的大模型调用数上限（含流式调用的整个输出过程）；传入 Redis 时为全部工作进程合计，否则为每个进程
+MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 32))
+# 每个用户同时进行的调用数上限，不带用户 ID 的请求只受总上限限制
+MAX_CONCURRENCY_PER_USER = int(os.getenv("LLM_MAX_CONCURRENCY_PER_USER", 4))
+# 排队等待调用名额的最长时间（秒），超时返回 LLM_BUSY
+QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", 10))
+# 排队请求数上限，队列已满时不再等待，直接返回 LLM_BUSY
+MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", 200))
+
+# 等待时间保留的最近样本数，用于计算分位数
+SAMPLE_SIZE = 1000
+
+# 全部工作进程共享的调用名额（有序集合，member 为租约 ID，score 为租约到期时间）
+SLOTS_KEY = "llm_slots"
+# 每个用户的调用名额，键为 llm_slots:user:<用户ID>
+USER_SLOTS_PREFIX = "llm_slots:user:"
+# 租约有效期（秒），应大于单次调用（含流式输出）的最长时间；进程崩溃后未释放的名额到期后自动回收
+LEASE_TTL = float(os.getenv("LLM_LEASE_TTL", 300))
+# 其他进程释放名额时无法唤醒本进程的等待者，排队时按此间隔（秒）重新尝试
+POLL_INTERVAL = 0.05
+
+# 先清理到期的租约，所有键都有空余名额时才在每个键中加入租约；
+# KEYS 为总名额和用户名额的键，ARGV 为 [当前时间, 租约到期时间, 租约 ID, 各键的名额上限...]
+ACQUIRE_SCRIPT = """
+local now, expires = tonumber(ARGV[1]), tonumber(ARGV[2])
+for i = 1, #KEYS do
+    redis.call('ZREMRANGEBYSCORE', KEYS[i], '-inf', now)
+    if redis.call('ZCARD', KEYS[i]) >= tonumber(ARGV[3 + i]) then
+        return 0
+    end
+end
+for i = 1, #KEYS do
+    redis.call('ZADD', KEYS[i], expires, ARGV[3])
+    redis.call('EXPIRE', KEYS[i], math.ceil(expires - now))
+end
+return 1
+"""
+
+class LLMBusyError(Exception):
+    """排队超时或队列已满，没有拿到大模型调用名额"""
+
+class ConcurrencyLimiter:
+    """
+    大模型调用的并发限制：总并发和每个用户的并发各有上限
+
+    没有名额时在队列中等待，名额释放后唤醒；等待超过 QUEUE_TIMEOUT 或队列已满时
+    抛出 LLMBusyError，由调用方返回 LLM_BUSY。突发流量下上游始终只承受固定的并发，
+    超出部分排队或快速失败，不会因大量 429 使所有请求一起失败。
+
+    传入 Redis 客户端时，名额是 Redis 有序集合中带到期时间的租约，上限对全部工作进程
+    合计生效；进程内的计数仍然保留，Redis 不可用时退回为每个进程各自限制。
+    """
+
+    def __init__(self, redis_client=None, max_concurrency: int = MAX_CONCURRENCY, max_per_user: int = MAX_CONCURRENCY_PER_USER, queue_timeout: float = QUEUE_TIMEOUT, max_queue: int = MAX_QUEUE, lease_ttl: float = LEASE_TTL):
+        self.redis = redis_client
+        self.max_concurrency = max_concurrency
+        self.max_per_user = max_per_user
+        self.queue_timeout = queue_timeout
+        self.max_queue = max_queue
+        self.lease_ttl = lease_ttl
+        self._acquire_script = redis_client.register_script(ACQUIRE_SCRIPT) if redis_client is not None else None
+        self._cond = threading.Condition()
+        self._active = 0
+        self._active_by_user: Dict[Any, int] = {}
+        self._waiting = 0
+        self._counters = {
+            "acquired": 0,
+            "queued": 0,
+            "timeouts": 0,
+            "rejected": 0,
+            "max_active": 0,
+            "max_waiting": 0,
+            "redis_errors": 0
+        }
+        self._wait_samples = deque(maxlen=SAMPLE_SIZE)
+
+    @contextmanager
+    def slot(self, user_id: Optional[int] = None) -> Iterator[None]:
+        """
+        占用一个调用名额，退出上下文时释放
+
+        Args:
+            user_id: 用户 ID（可选），用于每个用户的并发限制
+
+        Raises:
+            LLMBusyError: 排队超时或队列已满
+        """
+        start = time.perf_counter()
+        deadline = start + self.queue_timeout
+        lease = uuid.uuid4().hex
+        queued = False
+        with self._cond:
+            try:
+                while True:
+                    while not self._available(user_id):
+                        queued = self._wait(queued, deadline)
+                    # 先占用进程内的名额，再在锁外到 Redis 申请租约，
+                    # 网络往返不阻塞本进程的其他等待者和释放者
+                    self._reserve(user_id)
+                    if self.redis is None:
+                        break
+                    acquired = False
+                    self._cond.release()
+                    try:
+                        acquired = self._acquire(user_id, lease)
+                    finally:
+                        self._cond.acquire()
+                        if not acquired:
+                            self._unreserve(user_id)
+                    if acquired:
+                        break
+                    # 其他进程占满了名额，退还进程内的名额后隔一段时间再试
+                    queued = self._wait(queued, deadline, POLL_INTERVAL)
+            finally:
+                if queued:
+                    self._waiting -= 1
+            self._counters["acquired"] += 1
+            self._counters["max_active"] = max(self._counters["max_active"], self._active)
+            self._wait_samples.append((time.perf_counter() - start) * 1000)
+        try:
+            yield
+        finally:
+            self._release(user_id, lease)
+            with self._cond:
+                self._unreserve(user_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """当前并发数、排队数，以及累计的排队、超时次数和等待时间分位数"""
+        with self._cond:
+            stats = dict(self._counters)
+            stats["active"] = self._active
+            stats["waiting"] = self._waiting
+            waits = sorted(self._wait_samples)
+        if self.redis is not None:
+            try:
+                stats["leases"] = self.redis.zcount(SLOTS_KEY, time.time(), "+inf")
+            except Exception:
+                stats["leases"] = None
+        stats["wait_ms"] = {
+            "avg": round(sum(waits) / len(waits), 1),
+            "p50": round(waits[len(waits) // 2], 1),
+            "p95": round(waits[min(int(len(waits) * 0.95), len(waits) - 1)], 1),
+            "max": round(waits[-1], 1)
+        } if waits else None
+        return {
+            "shared": self.redis is not None,
+            "max_concurrency": self.max_concurrency,
+            "max_concurrency_per_user": self.max_per_user,
+            "queue_timeout": self.queue_timeout,
+            "max_queue": self.max_queue,
+            "lease_ttl": self.lease_ttl,
+            **stats
+        }
+
+    def _available(self, user_id: Optional[int]) -> bool:
+        if self._active >= self.max_concurrency:
+            return False
+        return user_id is None or self._active_by_user.get(user_id, 0) < self.max_per_user
+
+    def _wait(self, queued: bool, deadline: float, timeout: Optional[float] = None) -> bool:
+        """
+        排队等待名额释放（调用时持有 self._cond）
+
+        Args:
+            queued: 是否已在队列中
+            deadline: 排队的截止时间
+            timeout: 本次最多等待的秒数，为 None 时等到截止时间或被唤醒
+
+        Returns:
+            True（已在队列中）
+
+        Raises:
+            LLMBusyError: 排队超时或队列已满
+        """
+        if not queued:
+            if self._waiting >= self.max_queue:
+                self._counters["rejected"] += 1
+                raise LLMBusyError("大模型调用排队已满，请稍后重试")
+            self._counters["queued"] += 1
+            self._waiting += 1
+            self._counters["max_waiting"] = max(self._counters["max_waiting"], self._waiting)
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            self._counters["timeouts"] += 1
+            raise LLMBusyError("大模型调用排队超时，请稍后重试")
+        self._cond.wait(remaining if timeout is None else min(remaining, timeout))
+        return True
+
+    def _reserve(self, user_id: Optional[int]) -> None:
+        self._active += 1
+        if user_id is not None:
+            self._active_by_user[user_id] = self._active_by_user.get(user_id, 0) + 1
+
+    def _unreserve(self, user_id: Optional[int]) -> None:
+        self._active -= 1
+        if user_id is not None:
+            remaining_slots = self._active_by_user[user_id] - 1
+            if remaining_slots:
+                self._active_by_user[user_id] = remaining_slots
+            else:
+                del self._active_by_user[user_id]
+        # 等待者的用户各不相同，全部唤醒后各自检查名额
+        self._cond.notify_all()
+
+    def _acquire(self, user_id: Optional[int], lease: str) -> bool:
+        """在 Redis 中申请租约，全部进程合计仍有空余名额时返回 True（调用时不持有 self._cond）"""
+        keys = self._lease_keys(user_id)
+        now = time.time()
+        try:
+            return bool(self._acquire_script(
+                keys=keys,
+                args=[now, now + self.lease_ttl, lease, self.max_concurrency, self.max_per_user][:3 + len(keys)]
+            ))
+        except Exception as e:
+            # Redis 不可用时只按进程内的计数限制，不让调用因此失败
+            with self._cond:
+                self._counters["redis_errors"] += 1
+            logger.warning(f"大模型调用名额改为进程内限制: {e}")
+            return True
+
+    def _release(self, user_id: Optional[int], lease: str) -> None:
+        if self.redis is None:
+            return
+        try:
+            pipe = self.redis.pipeline()
+            for key in self._lease_keys(user_id):
+                pipe.zrem(key, lease)
+            pipe.execute()
+        except Exception as e:
+            # 释放失败的租约到期后自动回收
+            logger.warning(f"释放大模型调用名额失败: {e}")
+
+    def _lease_keys(self, user_id: Optional[int]) -> List[str]:
+        return [SLOTS_KEY] if user_id is None else [SLOTS_KEY, f"{USER_SLOTS_PREFIX}{user_id}"]
+
+class _Call:
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+class SingleFlight:
+    """
+    合并进行中的相同请求
+
+    同一个键同时只有一个调用（leader）真正执行，其余调用等待它完成并共享结果或异常，
+    一批相同的突发请求只向上游发出一次。调用结束后即从表中移除，不缓存结果。
+    等待者最多等待 timeout 秒，超时抛出 LLMBusyError；timeout 应不小于领头调用排队和
+    执行（含重试）的最长耗时，否则领头调用正常返回时等待者已全部失败。
+    """
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._counters = {"leaders": 0, "coalesced": 0, "timeouts": 0}
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """
+        执行 fn，键相同的调用正在进行时等待并返回它的结果
+
+        Args:
+            key: 请求的键，等价请求的键相同
+            fn: 实际执行的调用
+
+        Returns:
+            fn 的返回值；fn 抛出异常时所有等待者都抛出同一异常
+
+        Raises:
+            LLMBusyError: 等待相同调用的结果超时
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self._counters["leaders"] += 1
+            else:
+                self._counters["coalesced"] += 1
+
+        if not leader:
+            if not call.done.wait(self.timeout):
+                with self._lock:
+                    self._counters["timeouts"] += 1
+                raise LLMBusyError("等待相同请求的结果超时，请稍后重试")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {**self._counters, "timeout": self.timeout, "in_flight": len(self._calls)}
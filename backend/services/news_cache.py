@@ -0,0 +1,245 @@
+import os
+import json
+import time
+import hashlib
+import inspect
+import logging
+import threading
+import functools
+from typing import Any, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# 缓存作用域：news 为列表/搜索/热门，detail 为新闻详情，related 为相关新闻，taxonomy 为分类和标签
+SCOPES = ("news", "detail", "related", "taxonomy")
+
+# 各类缓存的有效期（秒）
+LIST_TTL = int(os.getenv("NEWS_CACHE_LIST_TTL", 60))
+DETAIL_TTL = int(os.getenv("NEWS_CACHE_DETAIL_TTL", 300))
+HOT_TTL = int(os.getenv("NEWS_CACHE_HOT_TTL", 30))
+TAXONOMY_TTL = int(os.getenv("NEWS_CACHE_TAXONOMY_TTL", 300))
+
+KEY_PREFIX = "news_cache"
+
+class NewsCache:
+    """
+    新闻接口的 Redis 读穿透缓存
+
+    缓存键中带有作用域的代数（generation），爬虫入库后递增代数即可让
+    该作用域下的旧缓存全部失效，旧键随 TTL 自然过期。Redis 不可用时
+    直接回源，不影响接口可用性。
+    """
+
+    def __init__(self, redis_client):
+        self.redis = redis_client
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "errors": 0,
+            "hit_time_ms": 0.0,
+            "miss_time_ms": 0.0
+        }
+
+    def get_or_set(self, scope: str, name: str, params: Dict[str, Any], ttl: int, loader: Callable[[], Any]) -> Any:
+        """
+        读取缓存，未命中时调用 loader 回源并写入缓存
+
+        Args:
+            scope: 缓存作用域
+            name: 接口名称
+            params: 影响结果的参数
+            ttl: 有效期（秒）
+            loader: 回源函数，返回值需可 JSON 序列化
+
+        Returns:
+            缓存或回源得到的结果
+        """
+        start = time.perf_counter()
+        try:
+            key = self._key(scope, name, params)
+            cached = self.redis.get(key)
+        except Exception as e:
+            logger.warning(f"读取新闻缓存失败: {e}")
+            self._record("errors")
+            return loader()
+
+        if cached is not None:
+            self._record("hits", "hit_time_ms", start)
+            return json.loads(cached)
+
+        result = loader()
+        # 不缓存空结果，避免把不存在的新闻 ID 缓存下来
+        if result is not None:
+            try:
+                self.redis.setex(key, ttl, json.dumps(result, ensure_ascii=False))
+            except Exception as e:
+                logger.warning(f"写入新闻缓存失败: {e}")
+                self._record("errors")
+        self._record("misses", "miss_time_ms", start)
+        return result
+
+    def get_or_set_many(
+        self,
+        scope: str,
+        name: str,
+        params_list: List[Dict[str, Any]],
+        ttl: int,
+        loader: Callable[[List[Dict[str, Any]]], List[Any]]
+    ) -> List[Any]:
+        """
+        批量读取缓存（一次 MGET），未命中的部分交给 loader 一次性回源
+
+        与 get_or_set 使用相同的缓存键，因此批量接口和单条接口共享缓存。
+
+        Args:
+            scope: 缓存作用域
+            name: 接口名称
+            params_list: 每一项的参数
+            ttl: 有效期（秒）
+            loader: 回源函数，接收未命中项的参数列表，按相同顺序返回结果
+
+        Returns:
+            与 params_list 顺序一致的结果列表
+        """
+        start = time.perf_counter()
+        try:
+            generation = self._generation(scope)
+            keys = [self._format_key(scope, generation, name, params) for params in params_list]
+            cached = self.redis.mget(keys) if keys else []
+        except Exception as e:
+            logger.warning(f"读取新闻缓存失败: {e}")
+            self._record("errors")
+            return loader(params_list)
+
+        results = [json.loads(value) if value is not None else None for value in cached]
+        missing = [i for i, value in enumerate(cached) if value is None]
+        if missing:
+            loaded = loader([params_list[i] for i in missing])
+            try:
+                pipe = self.redis.pipeline(transaction=False)
+                for i, result in zip(missing, loaded):
+                    results[i] = result
+                    if result is not None:
+                        pipe.setex(keys[i], ttl, json.dumps(result, ensure_ascii=False))
+                pipe.execute()
+            except Exception as e:
+                logger.warning(f"写入新闻缓存失败: {e}")
+                self._record("errors")
+
+        # 耗时按条目平均分摊到命中和未命中
+        if params_list:
+            elapsed = (time.perf_counter() - start) * 1000 / len(params_list)
+            hits = len(params_list) - len(missing)
+            with self._lock:
+                self._stats["hits"] += hits
+                self._stats["misses"] += len(missing)
+                self._stats["hit_time_ms"] += elapsed * hits
+                self._stats["miss_time_ms"] += elapsed * len(missing)
+        return results
+
+    def validator(self, scope: str, ttl: int) -> Optional[str]:
+        """
+        返回作用域的验证值，用于在查询前生成 ETag
+
+        验证值由作用域代数和按有效期划分的时间段组成：与缓存一样，爬虫入库后立即变化，
+        阅读量等不递增代数的变化最多延迟一个有效期。
+
+        Args:
+            scope: 缓存作用域
+            ttl: 有效期（秒）
+
+        Returns:
+            验证值，Redis 不可用时返回 None
+        """
+        try:
+            generation = self._generation(scope)
+        except Exception as e:
+            logger.warning(f"读取新闻缓存代数失败: {e}")
+            self._record("errors")
+            return None
+        return f"{scope}:{generation}:{int(time.time() // ttl)}"
+
+    def bump(self, *scopes: str) -> None:
+        """递增作用域代数，使其下所有缓存失效"""
+        bump_generations(self.redis, *scopes)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回本进程的命中率和平均耗时"""
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        return {
+            "hits": stats["hits"],
+            "misses": stats["misses"],
+            "errors": stats["errors"],
+            "hit_rate": round(stats["hits"] / lookups, 4) if lookups else None,
+            "avg_hit_ms": round(stats["hit_time_ms"] / stats["hits"], 3) if stats["hits"] else None,
+            "avg_miss_ms": round(stats["miss_time_ms"] / stats["misses"], 3) if stats["misses"] else None
+        }
+
+    def _key(self, scope: str, name: str, params: Dict[str, Any]) -> str:
+        return self._format_key(scope, self._generation(scope), name, params)
+
+    def _generation(self, scope: str) -> str:
+        return (self.redis.get(f"{KEY_PREFIX}:gen:{scope}") or b"0").decode()
+
+    def _format_key(self, scope: str, generation: str, name: str, params: Dict[str, Any]) -> str:
+        digest = hashlib.md5(json.dumps(params, sort_keys=True, ensure_ascii=False).encode("utf-8")).hexdigest()
+        return f"{KEY_PREFIX}:{scope}:{generation}:{name}:{digest}"
+
+    def _record(self, counter: str, timer: str = None, start: float = None) -> None:
+        with self._lock:
+            self._stats[counter] += 1
+            if timer is not None:
+                self._stats[timer] += (time.perf_counter() - start) * 1000
+
+def cached(scope: str, ttl: int):
+    """
+    NewsService 方法的缓存装饰器，以方法名和绑定后的参数作为缓存键；
+    服务未配置 cache 时直接执行原方法
+
+    Args:
+        scope: 缓存作用域
+        ttl: 有效期（秒）
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            if self.cache is None:
+                return func(self, *args, **kwargs)
+            bound = signature.bind(self, *args, **kwargs)
+            bound.apply_defaults()
+            params = dict(bound.arguments)
+            params.pop("self")
+            return self.cache.get_or_set(scope, func.__name__, params, ttl, lambda: func(self, *args, **kwargs))
+        return wrapper
+    return decorator
+
+def bump_generations(redis_client, *scopes: str) -> None:
+    """
+    递增缓存作用域代数
+
+    Args:
+        redis_client: Redis 客户端
+        *scopes: 需要失效的作用域，默认全部
+    """
+    pipe = redis_client.pipeline()
+    for scope in scopes or SCOPES:
+        pipe.incr(f"{KEY_PREFIX}:gen:{scope}")
+    pipe.execute()
+
+_env_client = None
+
+def bump_generations_from_env(*scopes: str) -> None:
+    """供爬虫使用：按 REDIS_URL 连接 Redis 并递增代数，失败只记录日志"""
+    global _env_client
+    try:
+        if _env_client is None:
+            import redis
+            _env_client = redis.from_url(os.getenv("REDIS_URL", "redis://localhost:6379/0"))
+        bump_generations(_env_client, *scopes)
+    except Exception as e:
+        logger.warning(f"刷新新闻缓存代数失败: {e}")
@@ -1,21 +1,117 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import func, desc, or_
-from spiders.database_news import News, NewsCategory, NewsTag, NewsCategoryRelation, NewsTagRelation
+from sqlalchemy.orm import Session, selectinload, load_only
+from sqlalchemy import func, desc, or_, and_
+from spiders.database_news import News, NewsCategory, NewsTag, NewsCategoryRelation, NewsTagRelation, NewsRelated
+from services.search_engine import get_search_engine
+from services.news_cache import cached, LIST_TTL, DETAIL_TTL, HOT_TTL, TAXONOMY_TTL
 from typing import List, Optional, Dict, Any
 from datetime import datetime
+import base64
+import json
+import time
+import threading
+from collections import OrderedDict
+
+# 游标分页支持的排序键
+CURSOR_SORTS = ("publish_time", "views")
+
+# 总数统计方式：exact 精确 COUNT，approx 使用缓存的 COUNT，none 不统计
+COUNT_MODES = ("exact", "approx", "none")
+
+# approx 模式下总数缓存的有效期（秒）
+COUNT_CACHE_TTL = 60
+# 总数缓存的最大条数（键含搜索关键词，取值不受控），超出时淘汰最久未使用的条目
+COUNT_CACHE_MAX_ENTRIES = 1024
+
+# 进程内总数缓存（LRU）：键为查询条件，值为 (总数, 过期时间)，只在 approx 模式下读写
+_count_cache: "OrderedDict[str, tuple]" = OrderedDict()
+_count_cache_lock = threading.Lock()
+
+# 列表接口可返回的字段，按响应中的顺序排列
+NEWS_FIELDS = (
+    "id", "title", "content", "source", "publish_time", "views",
+    "has_image", "image_url", "summary", "categories", "tags"
+)
+
+# 字段预设：card 为列表卡片所需字段，不包含正文
+VIEW_FIELDS = {
+    "full": NEWS_FIELDS,
+    "card": tuple(field for field in NEWS_FIELDS if field != "content"),
+}
+
+def resolve_fields(fields: Optional[str] = None, view: Optional[str] = None, allowed: tuple = NEWS_FIELDS) -> Optional[tuple]:
+    """
+    解析列表接口的 fields / view 参数
+    
+    Args:
+        fields: 逗号分隔的字段列表，优先于 view
+        view: 字段预设，full 或 card
+        allowed: 接口支持的字段
+        
+    Returns:
+        按响应顺序排列的字段元组，未指定时返回 None（全部字段）
+    """
+    if fields:
+        requested = {field.strip() for field in fields.split(",") if field.strip()}
+        unknown = requested - set(allowed)
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+        return tuple(field for field in allowed if field in requested or field == "id")
+    if view:
+        if view not in VIEW_FIELDS:
+            raise ValueError("View must be 'full' or 'card'")
+        return tuple(field for field in VIEW_FIELDS[view] if field in allowed)
+    return None
+
+def encode_cursor(sort: str, value: Any, news_id: int) -> str:
+    """把 (排序值, id) 编码为不透明的游标字符串"""
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([sort, value, news_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str, sort: str) -> tuple:
+    """解析游标字符串，游标无效或与排序方式不匹配时抛出 ValueError"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        cursor_sort, value, news_id = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        if cursor_sort != sort:
+            raise ValueError
+        if sort == "publish_time":
+            value = datetime.fromisoformat(value)
+        else:
+            value = int(value)
+        return value, int(news_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
 
 class NewsService:
-    def __init__(self, db: Session):
+    def __init__(self, db: Session, search_engine=None, cache=None, view_counter=None, trending=None):
         self.db = db
+        self.search_engine = search_engine or get_search_engine()
+        # 可选的 NewsCache，为 None 时不缓存
+        self.cache = cache
+        # 可选的 ViewCounter，为 None 时阅读量直接读写数据库
+        self.view_counter = view_counter
+        # 可选的 TrendingRanking，为 None 时不支持按热度排序
+        self.trending = trending
     
+    @cached("news", LIST_TTL)
     def get_news_list(
         self,
         page: int = 1,
         page_size: int = 20,
         category_id: Optional[int] = None,
         tag_id: Optional[int] = None,
-        sort: str = "publish_time"
+        sort: str = "publish_time",
+        cursor: Optional[str] = None,
+        count: Optional[str] = None,
+        fields: Optional[tuple] = None
     ) -> Dict[str, Any]:
+        if sort == "trending":
+            if category_id or tag_id or cursor is not None:
+                raise ValueError("Trending sort does not support category, tag or cursor")
+            return self._get_trending_page(page, page_size, fields)
+        
         query = self.db.query(News)
         
         if category_id:
@@ -28,107 +124,197 @@ class NewsService:
                 NewsTagRelation.tag_id == tag_id
             )
         
-        if sort == "views":
-            query = query.order_by(desc(News.views))
-        else:
-            query = query.order_by(desc(News.publish_time))
-        
-        total = query.count()
-        total_pages = (total + page_size - 1) // page_size
-        
-        news_list = query.offset((page - 1) * page_size).limit(page_size).all()
-        
-        return {
-            "news": [self._format_news(news) for news in news_list],
-            "pagination": {
-                "page": page,
-                "page_size": page_size,
-                "total": total,
-                "total_pages": total_pages
-            }
-        }
+        count_key = f"list:{category_id}:{tag_id}"
+        return self._paginate(query, sort, page, page_size, cursor, count, count_key, fields=fields)
     
+    @cached("detail", DETAIL_TTL)
     def get_news_by_id(self, news_id: int) -> Optional[Dict[str, Any]]:
-        news = self.db.query(News).filter(News.id == news_id).first()
+        news = self.db.query(News).options(*self._relation_loaders()).filter(News.id == news_id).first()
         if not news:
             return None
         return self._format_news_detail(news)
     
+    def get_news_by_ids(self, news_ids: List[int]) -> List[Dict[str, Any]]:
+        """
+        批量获取新闻详情
+        
+        新闻、分类和标签各用一条查询读取，与 get_news_by_id 共享详情缓存。
+        
+        Args:
+            news_ids: 新闻 ID 列表
+            
+        Returns:
+            按请求顺序排列的新闻详情，不存在的 ID 会被跳过
+        """
+        # 去重并保持请求顺序
+        news_ids = list(dict.fromkeys(news_ids))
+        
+        def load(params_list: List[Dict[str, Any]]) -> List[Optional[Dict[str, Any]]]:
+            ids = [params["news_id"] for params in params_list]
+            news_list = self.db.query(News).options(*self._relation_loaders()).filter(News.id.in_(ids)).all()
+            news_by_id = {news.id: self._format_news_detail(news) for news in news_list}
+            return [news_by_id.get(news_id) for news_id in ids]
+        
+        params_list = [{"news_id": news_id} for news_id in news_ids]
+        if self.cache is not None:
+            results = self.cache.get_or_set_many("detail", "get_news_by_id", params_list, DETAIL_TTL, load)
+        else:
+            results = load(params_list)
+        return [news for news in results if news is not None]
+    
+    @cached("related", DETAIL_TTL)
+    def get_related_news(self, news_id: int, limit: int = 10) -> List[Dict[str, Any]]:
+        """
+        获取预先计算的相关新闻
+        
+        Args:
+            news_id: 新闻 ID
+            limit: 数量限制
+            
+        Returns:
+            按相似度降序排列的相关新闻
+        """
+        rows = self.db.query(
+            News.id, News.title, News.summary, News.publish_time, News.has_image, News.image_url, NewsRelated.score
+        ).join(
+            NewsRelated, NewsRelated.related_id == News.id
+        ).filter(
+            NewsRelated.news_id == news_id
+        ).order_by(desc(NewsRelated.score)).limit(limit).all()
+        return [
+            {
+                "id": row.id,
+                "title": row.title,
+                "summary": row.summary,
+                "publish_time": row.publish_time.isoformat() if row.publish_time else None,
+                "has_image": row.has_image,
+                "image_url": row.image_url,
+                "score": round(row.score, 4)
+            }
+            for row in rows
+        ]
+    
+    @cached("taxonomy", TAXONOMY_TTL)
     def get_categories(self) -> List[Dict[str, Any]]:
-        categories = self.db.query(NewsCategory).all()
-        result = []
-        for category in categories:
-            news_count = self.db.query(NewsCategoryRelation).filter(
-                NewsCategoryRelation.category_id == category.id
-            ).count()
-            result.append({
-                "id": category.id,
-                "name": category.name,
-                "slug": category.slug,
-                "news_count": news_count
-            })
-        return result
-    
-    def get_tags(self) -> List[Dict[str, Any]]:
-        tags = self.db.query(NewsTag).all()
-        result = []
-        for tag in tags:
-            news_count = self.db.query(NewsTagRelation).filter(
-                NewsTagRelation.tag_id == tag.id
-            ).count()
-            result.append({
-                "id": tag.id,
-                "name": tag.name,
-                "slug": tag.slug,
-                "news_count": news_count
-            })
-        return result
+        news_count = func.count(NewsCategoryRelation.news_id).label("news_count")
+        rows = self.db.query(
+            NewsCategory.id, NewsCategory.name, NewsCategory.slug, news_count
+        ).outerjoin(
+            NewsCategoryRelation, NewsCategoryRelation.category_id == NewsCategory.id
+        ).group_by(NewsCategory.id).order_by(NewsCategory.id).all()
+        return [self._format_taxonomy(row) for row in rows]
     
-    def search_news(
+    @cached("taxonomy", TAXONOMY_TTL)
+    def get_tags(
         self,
-        keyword: str,
-        page: int = 1,
-        page_size: int = 20
+        page: Optional[int] = None,
+        page_size: int = 100,
+        top: Optional[int] = None
     ) -> Dict[str, Any]:
-        query = self.db.query(News).filter(
-            or_(
-                News.title.like(f"%{keyword}%"),
-                News.content.like(f"%{keyword}%")
-            )
-        ).order_by(desc(News.publish_time))
+        """
+        获取标签及其新闻数量
+        
+        Args:
+            page: 页码，为 None 时返回全部标签
+            page_size: 每页数量
+            top: 只返回新闻数量最多的前 N 个标签，优先于分页
+            
+        Returns:
+            标签列表，分页时附带分页信息
+        """
+        news_count = func.count(NewsTagRelation.news_id).label("news_count")
+        query = self.db.query(
+            NewsTag.id, NewsTag.name, NewsTag.slug, news_count
+        ).outerjoin(
+            NewsTagRelation, NewsTagRelation.tag_id == NewsTag.id
+        ).group_by(NewsTag.id)
         
-        total = query.count()
-        total_pages = (total + page_size - 1) // page_size
+        if top:
+            rows = query.order_by(desc(news_count), NewsTag.id).limit(top).all()
+            return {"tags": [self._format_taxonomy(row) for row in rows]}
         
-        news_list = query.offset((page - 1) * page_size).limit(page_size).all()
+        query = query.order_by(NewsTag.id)
+        if page is None:
+            return {"tags": [self._format_taxonomy(row) for row in query.all()]}
         
+        total = self.db.query(func.count(NewsTag.id)).scalar()
+        rows = query.offset((page - 1) * page_size).limit(page_size).all()
         return {
-            "news": [self._format_news(news) for news in news_list],
+            "tags": [self._format_taxonomy(row) for row in rows],
             "pagination": {
                 "page": page,
                 "page_size": page_size,
                 "total": total,
-                "total_pages": total_pages
+                "total_pages": (total + page_size - 1) // page_size
             }
         }
     
+    @cached("news", LIST_TTL)
+    def search_news(
+        self,
+        keyword: str,
+        page: int = 1,
+        page_size: int = 20,
+        cursor: Optional[str] = None,
+        count: Optional[str] = None,
+        sort: str = "publish_time",
+        fields: Optional[tuple] = None
+    ) -> Dict[str, Any]:
+        query = self.search_engine.filter(self.db.query(News), keyword)
+        
+        # 按相关度排序仅在引擎支持时生效，否则退回按发布时间排序；按阅读量排序与新闻列表相同，支持游标分页
+        order_by = None
+        if sort == "relevance":
+            score = self.search_engine.relevance(keyword)
+            if score is not None:
+                order_by = [desc(score), desc(News.publish_time), desc(News.id)]
+        
+        count_key = f"search:{self.search_engine.name}:{keyword}"
+        return self._paginate(query, "views" if sort == "views" else "publish_time", page, page_size, cursor, count, count_key, order_by=order_by, fields=fields)
+    
     def get_news_by_category(
         self,
         category_id: int,
         page: int = 1,
-        page_size: int = 20
+        page_size: int = 20,
+        cursor: Optional[str] = None,
+        count: Optional[str] = None,
+        fields: Optional[tuple] = None
     ) -> Dict[str, Any]:
-        return self.get_news_list(page=page, page_size=page_size, category_id=category_id)
+        return self.get_news_list(page=page, page_size=page_size, category_id=category_id, cursor=cursor, count=count, fields=fields)
     
     def get_news_by_tag(
         self,
         tag_id: int,
         page: int = 1,
-        page_size: int = 20
+        page_size: int = 20,
+        cursor: Optional[str] = None,
+        count: Optional[str] = None,
+        fields: Optional[tuple] = None
     ) -> Dict[str, Any]:
-        return self.get_news_list(page=page, page_size=page_size, tag_id=tag_id)
+        return self.get_news_list(page=page, page_size=page_size, tag_id=tag_id, cursor=cursor, count=count, fields=fields)
     
+    @cached("news", HOT_TTL)
     def get_hot_news(self, limit: int = 10) -> List[Dict[str, Any]]:
+        if self.view_counter is not None and self.view_counter.is_seeded():
+            # 排行来自 Redis，只按主键补充标题和图片
+            ranking = self.view_counter.top(limit)
+            rows = self.db.query(
+                News.id, News.title, News.has_image, News.image_url
+            ).filter(News.id.in_([news_id for news_id, _ in ranking])).all()
+            rows_by_id = {row.id: row for row in rows}
+            return [
+                {
+                    "id": news_id,
+                    "title": rows_by_id[news_id].title,
+                    "views": views,
+                    "has_image": rows_by_id[news_id].has_image,
+                    "image_url": rows_by_id[news_id].image_url
+                }
+                for news_id, views in ranking
+                if news_id in rows_by_id
+            ]
+        
         news_list = self.db.query(News).order_by(desc(News.views)).limit(limit).all()
         return [
             {
@@ -141,46 +327,256 @@ class NewsService:
             for news in news_list
         ]
     
+    @cached("news", HOT_TTL)
+    def get_trending_news(self, limit: int = 10) -> List[Dict[str, Any]]:
+        """
+        获取按时间衰减热度排序的新闻
+        
+        Args:
+            limit: 数量限制
+            
+        Returns:
+            新闻列表，trending_score 为当前衰减后的热度得分
+        """
+        if self.trending is None:
+            raise ValueError("Trending ranking is not available")
+        self._ensure_trending()
+        
+        ranking = self.trending.top(0, limit)
+        rows = self.db.query(
+            News.id, News.title, News.views, News.has_image, News.image_url
+        ).filter(News.id.in_([news_id for news_id, _ in ranking])).all()
+        rows_by_id = {row.id: row for row in rows}
+        return [
+            {
+                "id": news_id,
+                "title": rows_by_id[news_id].title,
+                "views": rows_by_id[news_id].views,
+                "has_image": rows_by_id[news_id].has_image,
+                "image_url": rows_by_id[news_id].image_url,
+                "trending_score": score
+            }
+            for news_id, score in ranking
+            if news_id in rows_by_id
+        ]
+    
     def increment_views(self, news_id: int) -> Optional[Dict[str, Any]]:
-        news = self.db.query(News).filter(News.id == news_id).first()
-        if not news:
-            return None
-        news.views += 1
-        self.db.commit()
+        if self.view_counter is not None:
+            views = self.view_counter.increment(news_id)
+            if views is None:
+                # 排行中没有该新闻（新入库或排行尚未加载），确认存在后加入排行
+                news = self.db.query(News.id, News.views).filter(News.id == news_id).first()
+                if not news:
+                    return None
+                views = self.view_counter.add(news_id, news.views or 0)
+        else:
+            # 在数据库中原子累加，避免并发时丢失更新
+            updated = self.db.query(News).filter(News.id == news_id).update(
+                {News.views: News.views + 1}, synchronize_session=False
+            )
+            if not updated:
+                return None
+            self.db.commit()
+            views = self.db.query(News.views).filter(News.id == news_id).scalar()
+        
+        if self.trending is not None:
+            self.trending.record(news_id)
+        
         return {
-            "news_id": news.id,
-            "views": news.views
+            "news_id": news_id,
+            "views": views
         }
     
-    def _format_news(self, news: News) -> Dict[str, Any]:
+    def _ensure_trending(self) -> None:
+        """热度排行不存在（首次启动或 Redis 重启）时从浏览历史重建"""
+        if not self.trending.is_built():
+            self.trending.rebuild(self.db)
+    
+    def _get_trending_page(self, page: int, page_size: int, fields: Optional[tuple] = None) -> Dict[str, Any]:
+        """按热度排行分页，新闻行按主键批量读取并保持排行顺序"""
+        if self.trending is None:
+            raise ValueError("Trending sort is not available")
+        self._ensure_trending()
+        
+        ranking = self.trending.top((page - 1) * page_size, page_size)
+        news_list = self.db.query(News).options(*self._list_options(fields)).filter(
+            News.id.in_([news_id for news_id, _ in ranking])
+        ).all()
+        news_by_id = {news.id: news for news in news_list}
+        
+        result = []
+        for news_id, score in ranking:
+            if news_id in news_by_id:
+                item = self._format_news(news_by_id[news_id], fields)
+                item["trending_score"] = score
+                result.append(item)
+        
+        total = self.trending.count()
         return {
-            "id": news.id,
-            "title": news.title,
-            "content": news.content,
-            "source": news.source,
-            "publish_time": news.publish_time.isoformat() if news.publish_time else None,
-            "views": news.views,
-            "has_image": news.has_image,
-            "image_url": news.image_url,
-            "summary": news.summary,
-            "categories": [
-                {
-                    "id": cat.id,
-                    "name": cat.name,
-                    "slug": cat.slug
-                }
-                for cat in news.categories
-            ],
-            "tags": [
-                {
-                    "id": tag.id,
-                    "name": tag.name,
-                    "slug": tag.slug
+            "news": result,
+            "pagination": {
+                "page": page,
+                "page_size": page_size,
+                "total": total,
+                "total_pages": (total + page_size - 1) // page_size
+            }
+        }
+    
+    def _paginate(
+        self,
+        query,
+        sort: str,
+        page: int,
+        page_size: int,
+        cursor: Optional[str],
+        count: Optional[str],
+        count_key: str,
+        order_by: Optional[list] = None,
+        fields: Optional[tuple] = None
+    ) -> Dict[str, Any]:
+        """
+        对新闻查询排序并分页
+        
+        cursor 为 None 时使用 OFFSET 分页；否则按 (排序键, id) 做游标分页，
+        空字符串表示第一页。游标分页默认不统计总数。
+        
+        Args:
+            query: 已加过滤条件的新闻查询
+            sort: 排序方式，publish_time 或 views
+            page: 页码（仅 OFFSET 分页使用）
+            page_size: 每页数量
+            cursor: 上一页返回的 next_cursor
+            count: 总数统计方式，exact / approx / none
+            count_key: approx 模式下总数缓存的键
+            order_by: 自定义排序（如相关度），此时不支持游标分页
+            fields: 返回的字段，None 表示全部字段
+            
+        Returns:
+            新闻列表和分页信息
+        """
+        if count is None:
+            count = "exact" if cursor is None else "none"
+        if count not in COUNT_MODES:
+            raise ValueError("Count must be 'exact', 'approx' or 'none'")
+        
+        sort_column = News.views if sort == "views" else News.publish_time
+        if order_by is not None:
+            if cursor is not None:
+                raise ValueError("Cursor is not supported for this sort")
+            query = query.order_by(*order_by)
+        else:
+            query = query.order_by(desc(sort_column), desc(News.id))
+        
+        total = self._count(query, count, count_key)
+        loaders = self._list_options(fields)
+        
+        if cursor is None:
+            news_list = query.options(*loaders).offset((page - 1) * page_size).limit(page_size).all()
+            return {
+                "news": [self._format_news(news, fields) for news in news_list],
+                "pagination": {
+                    "page": page,
+                    "page_size": page_size,
+                    "total": total,
+                    "total_pages": (total + page_size - 1) // page_size if total is not None else None
                 }
-                for tag in news.tags
-            ]
+            }
+        
+        if cursor:
+            value, last_id = decode_cursor(cursor, sort)
+            query = query.filter(or_(
+                sort_column < value,
+                and_(sort_column == value, News.id < last_id)
+            ))
+        
+        # 多取一条用于判断是否还有下一页
+        news_list = query.options(*loaders).limit(page_size + 1).all()
+        has_more = len(news_list) > page_size
+        news_list = news_list[:page_size]
+        
+        next_cursor = None
+        if has_more:
+            last = news_list[-1]
+            next_cursor = encode_cursor(sort, getattr(last, sort), last.id)
+        
+        return {
+            "news": [self._format_news(news, fields) for news in news_list],
+            "pagination": {
+                "page_size": page_size,
+                "total": total,
+                "has_more": has_more,
+                "next_cursor": next_cursor
+            }
         }
     
+    def _count(self, query, count: str, count_key: str) -> Optional[int]:
+        """按统计方式计算总数，approx 模式在 COUNT_CACHE_TTL 内复用上次 approx 查询的结果"""
+        if count == "none":
+            return None
+        if count == "exact":
+            return query.order_by(None).count()
+        
+        with _count_cache_lock:
+            cached = _count_cache.get(count_key)
+            if cached and cached[1] > time.time():
+                _count_cache.move_to_end(count_key)
+                return cached[0]
+        
+        total = query.order_by(None).count()
+        with _count_cache_lock:
+            _count_cache[count_key] = (total, time.time() + COUNT_CACHE_TTL)
+            _count_cache.move_to_end(count_key)
+            while len(_count_cache) > COUNT_CACHE_MAX_ENTRIES:
+                _count_cache.popitem(last=False)
+        return total
+    
+    def _format_taxonomy(self, row) -> Dict[str, Any]:
+        return {
+            "id": row.id,
+            "name": row.name,
+            "slug": row.slug,
+            "news_count": row.news_count
+        }
+    
+    def _relation_loaders(self) -> list:
+        """_format_news 需要的关系加载选项，查询次数与 page_size 无关"""
+        return [selectinload(News.categories), selectinload(News.tags)]
+    
+    def _list_options(self, fields: Optional[tuple] = None) -> list:
+        """
+        列表查询的加载选项：只从 SQL 读取请求的列（正文等未请求的列不会被加载），
+        分类和标签按页批量加载（每个关系一条 IN 查询），避免逐条懒加载
+        """
+        fields = fields or NEWS_FIELDS
+        # 排序键始终加载，游标分页需要用它生成 next_cursor
+        columns = {"publish_time", "views"} | {
+            field for field in fields if field not in ("id", "categories", "tags")
+        }
+        options = [load_only(*[getattr(News, column) for column in sorted(columns)])]
+        if "categories" in fields:
+            options.append(selectinload(News.categories))
+        if "tags" in fields:
+            options.append(selectinload(News.tags))
+        return options
+    
+    def _format_news(self, news: News, fields: Optional[tuple] = None) -> Dict[str, Any]:
+        item = {}
+        for field in fields or NEWS_FIELDS:
+            if field == "publish_time":
+                item[field] = news.publish_time.isoformat() if news.publish_time else None
+            elif field in ("categories", "tags"):
+                item[field] = [
+                    {
+                        "id": relation.id,
+                        "name": relation.name,
+                        "slug": relation.slug
+                    }
+                    for relation in getattr(news, field)
+                ]
+            else:
+                item[field] = getattr(news, field)
+        return item
+    
     def _format_news_detail(self, news: News) -> Dict[str, Any]:
         return {
             "id": news.id,
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+相关新闻计算
+功能：以字符二元组 TF-IDF 向量化新闻标题和正文，按余弦相似度为每篇新闻
+计算 top-k 相关新闻并写入 news_related 表；新入库的新闻可增量并入，无需全量重建
+
+用法:
+    python -m services.related_news build    # 全量重建
+    python -m services.related_news update   # 只处理模型建立后新入库的新闻
+"""
+
+import os
+import re
+import sys
+import math
+import pickle
+import logging
+import argparse
+from collections import Counter
+from typing import Dict, List, Tuple
+
+import numpy as np
+from scipy import sparse
+
+# 添加上级目录到系统路径，以便直接运行本脚本
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from spiders.database_news import SessionLocal, News, NewsRelated
+
+logger = logging.getLogger(__name__)
+
+# 每篇新闻保存的相关新闻数量
+TOP_K = int(os.getenv("RELATED_TOP_K", 10))
+# 模型文件（词表、IDF、全部新闻的向量），增量更新时读取
+MODEL_PATH = os.getenv("RELATED_MODEL_PATH", os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data", "related_model.pkl"))
+# 出现在超过该比例新闻中的二元组视为无区分度，不进入词表
+MAX_DF_RATIO = 0.5
+# 相似度计算的分块行数，控制内存占用
+CHUNK_SIZE = 512
+# 标题在向量中的重复次数（提高标题权重）
+TITLE_WEIGHT = 3
+
+TAG_RE = re.compile(r"<[^>]+>")
+CJK_RE = re.compile(r"[一-鿿]+")
+WORD_RE = re.compile(r"[a-zA-Z0-9]{2,}")
+
+def tokenize(title: str, content: str) -> Counter:
+    """
+    把标题和正文切分为词项：中文取相邻字符二元组，英文和数字取整词
+
+    Args:
+        title: 标题
+        content: 正文（HTML）
+
+    Returns:
+        词项计数
+    """
+    text = " ".join([title or ""] * TITLE_WEIGHT + [TAG_RE.sub(" ", content or "")])
+    terms = Counter()
+    for run in CJK_RE.findall(text):
+        terms.update(run[i:i + 2] for i in range(len(run) - 1))
+    terms.update(word.lower() for word in WORD_RE.findall(text))
+    return terms
+
+class RelatedNewsModel:
+    """TF-IDF 模型：词表、IDF 以及全部已处理新闻的 L2 归一化向量"""
+
+    def __init__(self, vocab: Dict[str, int], idf: np.ndarray, ids: np.ndarray, matrix: sparse.csr_matrix):
+        self.vocab = vocab
+        self.idf = idf
+        self.ids = ids
+        self.matrix = matrix
+
+    @classmethod
+    def fit(cls, docs: List[Tuple[int, Counter]]) -> "RelatedNewsModel":
+        """用全部新闻建立词表和 IDF 并向量化"""
+        df = Counter()
+        for _, terms in docs:
+            df.update(terms.keys())
+        max_df = max(2, int(len(docs) * MAX_DF_RATIO))
+        # 只出现在一篇新闻中的词项无法产生相似度，一并去掉
+        kept = sorted(term for term, freq in df.items() if 2 <= freq <= max_df)
+        vocab = {term: i for i, term in enumerate(kept)}
+        idf = np.array([math.log((1 + len(docs)) / (1 + df[term])) + 1 for term in kept], dtype=np.float32)
+        ids = np.array([news_id for news_id, _ in docs], dtype=np.int64)
+        model = cls(vocab, idf, ids, None)
+        model.matrix = model.transform([terms for _, terms in docs])
+        return model
+
+    def transform(self, term_counts: List[Counter]) -> sparse.csr_matrix:
+        """按已有词表向量化，词表外的词项忽略"""
+        rows, cols, data = [], [], []
+        for row, terms in enumerate(term_counts):
+            for term, count in terms.items():
+                col = self.vocab.get(term)
+                if col is not None:
+                    rows.append(row)
+                    cols.append(col)
+                    data.append((1 + math.log(count)) * self.idf[col])
+        matrix = sparse.csr_matrix(
+            (np.array(data, dtype=np.float32), (rows, cols)),
+            shape=(len(term_counts), len(self.vocab))
+        )
+        norms = np.sqrt(matrix.multiply(matrix).sum(axis=1)).A1
+        norms[norms == 0] = 1
+        return sparse.csr_matrix(sparse.diags(1 / norms) @ matrix)
+
+    def append(self, ids: np.ndarray, matrix: sparse.csr_matrix) -> None:
+        self.ids = np.concatenate([self.ids, ids])
+        self.matrix = sparse.vstack([self.matrix, matrix], format="csr")
+
+    def save(self, path: str = MODEL_PATH) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            pickle.dump({"vocab": self.vocab, "idf": self.idf, "ids": self.ids, "matrix": self.matrix}, f)
+
+    @classmethod
+    def load(cls, path: str = MODEL_PATH) -> "RelatedNewsModel":
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+        return cls(data["vocab"], data["idf"], data["ids"], data["matrix"])
+
+def top_k_neighbours(queries: sparse.csr_matrix, query_ids: np.ndarray, model: RelatedNewsModel, k: int) -> Dict[int, List[Tuple[int, float]]]:
+    """
+    分块计算查询向量与模型中全部新闻的相似度，返回每篇新闻的 top-k（不含自身）
+
+    Returns:
+        新闻 ID -> [(相关新闻 ID, 相似度)]，按相似度降序
+    """
+    result = {}
+    for start in range(0, queries.shape[0], CHUNK_SIZE):
+        similarities = (queries[start:start + CHUNK_SIZE] @ model.matrix.T).tocsr()
+        for offset in range(similarities.shape[0]):
+            news_id = int(query_ids[start + offset])
+            row = similarities.getrow(offset)
+            candidate_ids = model.ids[row.indices]
+            scores = row.data
+            mask = candidate_ids != news_id
+            candidate_ids, scores = candidate_ids[mask], scores[mask]
+            if len(scores) > k:
+                best = np.argpartition(-scores, k)[:k]
+                candidate_ids, scores = candidate_ids[best], scores[best]
+            order = np.argsort(-scores)
+            result[news_id] = [(int(candidate_ids[i]), float(scores[i])) for i in order]
+    return result
+
+def load_docs(db, min_id: int = 0) -> List[Tuple[int, Counter]]:
+    rows = db.query(News.id, News.title, News.content).filter(News.id > min_id).order_by(News.id).all()
+    return [(row.id, tokenize(row.title, row.content)) for row in rows]
+
+def save_neighbours(db, neighbours: Dict[int, List[Tuple[int, float]]]) -> None:
+    """覆盖写入指定新闻的相关新闻"""
+    if not neighbours:
+        return
+    db.query(NewsRelated).filter(NewsRelated.news_id.in_(list(neighbours))).delete(synchronize_session=False)
+    db.bulk_insert_mappings(NewsRelated, [
+        {"news_id": news_id, "related_id": related_id, "score": score}
+        for news_id, related in neighbours.items()
+        for related_id, score in related
+    ])
+
+def build(k: int = TOP_K) -> int:
+    """
+    全量重建模型和全部新闻的相关新闻
+
+    Returns:
+        处理的新闻数量
+    """
+    db = SessionLocal()
+    try:
+        docs = load_docs(db)
+        if not docs:
+            return 0
+        model = RelatedNewsModel.fit(docs)
+        neighbours = top_k_neighbours(model.matrix, model.ids, model, k)
+        db.query(NewsRelated).delete(synchronize_session=False)
+        save_neighbours(db, neighbours)
+        db.commit()
+        model.save()
+        _invalidate_cache()
+        logger.info(f"相关新闻全量重建完成，共 {len(docs)} 篇，词表 {len(model.vocab)} 项")
+        return len(docs)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+def update(k: int = TOP_K) -> int:
+    """
+    增量并入模型建立后新入库的新闻
+
+    新新闻按已有词表和 IDF 向量化并计算 top-k；同时把新新闻插入到
+    与其足够相似的已有新闻的相关列表中。模型不存在时执行全量重建。
+
+    Returns:
+        处理的新闻数量
+    """
+    if not os.path.exists(MODEL_PATH):
+        return build(k)
+
+    model = RelatedNewsModel.load()
+    db = SessionLocal()
+    try:
+        last_id = int(model.ids.max()) if len(model.ids) else 0
+        docs = load_docs(db, min_id=last_id)
+        if not docs:
+            return 0
+        new_ids = np.array([news_id for news_id, _ in docs], dtype=np.int64)
+        model.append(new_ids, model.transform([terms for _, terms in docs]))
+        neighbours = top_k_neighbours(model.matrix[-len(docs):], new_ids, model, k)
+
+        # 反向更新：新新闻进入已有新闻的 top-k
+        new_id_set = set(new_ids.tolist())
+        candidates: Dict[int, List[Tuple[int, float]]] = {}
+        for news_id, related in neighbours.items():
+            for related_id, score in related:
+                if related_id not in new_id_set:
+                    candidates.setdefault(related_id, []).append((news_id, score))
+        if candidates:
+            existing: Dict[int, List[Tuple[int, float]]] = {news_id: [] for news_id in candidates}
+            rows = db.query(NewsRelated).filter(
+                NewsRelated.news_id.in_(list(candidates))
+            ).order_by(NewsRelated.score.desc()).all()
+            for row in rows:
+                existing[row.news_id].append((row.related_id, row.score))
+            # 只重写相关列表确实发生变化的新闻
+            for news_id, additions in candidates.items():
+                merged = sorted(existing[news_id] + additions, key=lambda item: -item[1])[:k]
+                if merged != existing[news_id]:
+                    neighbours[news_id] = merged
+
+        save_neighbours(db, neighbours)
+        db.commit()
+        model.save()
+        _invalidate_cache()
+        logger.info(f"相关新闻增量更新完成，新增 {len(docs)} 篇")
+        return len(docs)
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+def _invalidate_cache() -> None:
+    from services.news_cache import bump_generations_from_env
+    # 相关新闻的缓存单独失效，不影响新闻详情的缓存
+    bump_generations_from_env("related")
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="计算相关新闻")
+    parser.add_argument("action", choices=["build", "update"])
+    parser.add_argument("--top-k", type=int, default=TOP_K)
+    args = parser.parse_args()
+    count = build(args.top_k) if args.action == "build" else update(args.top_k)
+    print(f"处理新闻 {count} 篇")
@@ -0,0 +1,103 @@
+import os
+import re
+from typing import Optional
+from sqlalchemy import or_
+from sqlalchemy.dialects.mysql import match
+from spiders.database_news import News
+
+# MySQL ngram 分词的最小词长（与服务端 ngram_token_size 一致，默认 2）
+NGRAM_TOKEN_SIZE = int(os.getenv("NGRAM_TOKEN_SIZE", 2))
+
+class LikeSearchEngine:
+    """基于 LIKE '%kw%' 的全表扫描搜索，作为对照基线"""
+
+    name = "like"
+    supports_relevance = False
+
+    def filter(self, query, keyword: str):
+        """
+        为新闻查询添加关键词过滤条件
+
+        Args:
+            query: 新闻查询
+            keyword: 搜索关键词
+
+        Returns:
+            添加过滤条件后的查询
+        """
+        return query.filter(
+            or_(
+                News.title.like(f"%{keyword}%"),
+                News.content.like(f"%{keyword}%")
+            )
+        )
+
+    def relevance(self, keyword: str):
+        """相关度表达式，不支持时返回 None"""
+        return None
+
+class FulltextSearchEngine:
+    """基于 MySQL FULLTEXT ngram 索引 (ft_title_content) 的搜索"""
+
+    name = "fulltext"
+    supports_relevance = True
+
+    def __init__(self):
+        self.fallback = LikeSearchEngine()
+
+    def filter(self, query, keyword: str):
+        """
+        为新闻查询添加全文检索条件
+
+        关键词按空白切分，每个词都必须出现；短于 ngram 词长的词
+        无法命中索引，整体回退为 LIKE 查询。
+
+        Args:
+            query: 新闻查询
+            keyword: 搜索关键词
+
+        Returns:
+            添加过滤条件后的查询
+        """
+        against = self._boolean_query(keyword)
+        if against is None:
+            return self.fallback.filter(query, keyword)
+        return query.filter(self._match(against))
+
+    def relevance(self, keyword: str):
+        """MATCH ... AGAINST 的相关度得分表达式"""
+        against = self._boolean_query(keyword)
+        if against is None:
+            return None
+        return self._match(against)
+
+    def _match(self, against: str):
+        return match(News.title, News.content, against=against).in_boolean_mode()
+
+    def _boolean_query(self, keyword: str) -> Optional[str]:
+        """把关键词转换为 BOOLEAN MODE 查询串，如 '+"人工智能" +"芯片"'"""
+        # 去掉 BOOLEAN MODE 的操作符，避免用户输入改变查询语义
+        terms = [t for t in re.split(r'[\s+\-<>()~*"@]+', keyword) if t]
+        if not terms or any(len(t) < NGRAM_TOKEN_SIZE for t in terms):
+            return None
+        return " ".join(f'+"{t}"' for t in terms)
+
+SEARCH_ENGINES = {
+    LikeSearchEngine.name: LikeSearchEngine,
+    FulltextSearchEngine.name: FulltextSearchEngine,
+}
+
+def get_search_engine(name: Optional[str] = None):
+    """
+    按名称获取搜索引擎实例
+
+    Args:
+        name: 引擎名称，默认读取环境变量 SEARCH_ENGINE（默认 like）
+
+    Returns:
+        搜索引擎实例
+    """
+    name = name or os.getenv("SEARCH_ENGINE", "like")
+    if name not in SEARCH_ENGINES:
+        raise ValueError(f"Unknown search engine: {name}")
+    return SEARCH_ENGINES[name]()
@@ -0,0 +1,233 @@
+import os
+import json
+import uuid
+import bisect
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 缓存有效期（秒），每次读写后重新计时，只有活跃会话留在缓存中
+CACHE_TTL = int(os.getenv("SESSION_CACHE_TTL", 600))
+# 缓存的会话最多包含的消息数，更长的会话不缓存，直接读数据库
+MAX_MESSAGES = int(os.getenv("SESSION_CACHE_MAX_MESSAGES", 500))
+# 回填令牌的有效期（秒），需大于一次读取历史的耗时
+LEASE_TTL = 30
+
+KEY_PREFIX = "session_cache"
+
+# 回复写入数据库后追加到缓存：只有缓存中最后一条消息的序号正好接在新消息之前时才追加，
+# 否则（其他进程的写入先到、消息被删除等）删除缓存，下次读取时从数据库重新加载；
+# 缓存不存在时删除回填令牌，使写入之前读取数据库的回填作废
+APPEND_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    redis.call('DEL', KEYS[3])
+    return 0
+end
+if tonumber(redis.call('HGET', KEYS[1], 'last_seq')) ~= tonumber(ARGV[1]) then
+    redis.call('DEL', KEYS[1], KEYS[2], KEYS[3])
+    return -1
+end
+local length = redis.call('RPUSH', KEYS[2], unpack(ARGV, 5))
+if length > tonumber(ARGV[3]) then
+    redis.call('DEL', KEYS[1], KEYS[2])
+    return -2
+end
+redis.call('HSET', KEYS[1], 'last_seq', ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+return length
+"""
+
+# 从数据库读取后回填缓存：令牌仍是本次读取前设置的令牌时才写入
+FILL_SCRIPT = """
+if redis.call('GET', KEYS[3]) ~= ARGV[1] then
+    return 0
+end
+redis.call('DEL', KEYS[2], KEYS[3])
+redis.call('HSET', KEYS[1], 'owner', ARGV[2], 'last_seq', ARGV[3])
+if #ARGV > 4 then
+    redis.call('RPUSH', KEYS[2], unpack(ARGV, 5))
+end
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+redis.call('EXPIRE', KEYS[2], ARGV[4])
+return 1
+"""
+
+class SessionCache:
+    """
+    活跃会话消息的 Redis 写穿缓存
+
+    缓存会话的所属用户、最大序号和全部消息（[seq, role, content]），消息写入数据库后
+    追加到缓存，删除会话或消息时清除缓存；数据库仍是唯一的持久存储。读取未命中时先设置
+    回填令牌再读数据库，期间有写入或删除则令牌作废、不回填，缓存不会停留在旧数据上。
+    Redis 不可用时直接读写数据库。
+    """
+
+    def __init__(self, redis_client):
+        self.redis = redis_client
+        self._append = redis_client.register_script(APPEND_SCRIPT)
+        self._fill = redis_client.register_script(FILL_SCRIPT)
+        self._lock = threading.Lock()
+        self._stats = {
+            "hits": 0,
+            "misses": 0,
+            "fills": 0,
+            "appends": 0,
+            "invalidations": 0,
+            "errors": 0
+        }
+
+    def get(self, session_id: str) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """
+        读取缓存的会话，同时设置回填令牌
+
+        Args:
+            session_id: 会话 ID
+
+        Returns:
+            (会话, 回填令牌)；会话为 {"owner": 用户 ID, "last_seq": 最大序号, "messages": [(seq, role, content), ...]}，
+            未命中时为 None，读取数据库后用令牌调用 fill
+        """
+        meta_key, messages_key, lease_key = self._keys(session_id)
+        token = uuid.uuid4().hex
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.hgetall(meta_key)
+            pipe.lrange(messages_key, 0, -1)
+            pipe.expire(meta_key, CACHE_TTL)
+            pipe.expire(messages_key, CACHE_TTL)
+            pipe.set(lease_key, token, ex=LEASE_TTL)
+            meta, items = pipe.execute()[:2]
+        except Exception as e:
+            logger.warning(f"读取会话缓存失败: {e}")
+            self._record("errors")
+            return None, None
+
+        if not meta:
+            self._record("misses")
+            return None, token
+        self._record("hits")
+        owner = meta[b"owner"].decode()
+        return {
+            "owner": int(owner) if owner else None,
+            "last_seq": int(meta[b"last_seq"]),
+            "messages": [tuple(json.loads(item)) for item in items]
+        }, token
+
+    def fill(self, session_id: str, token: Optional[str], owner: Optional[int], messages: List[Tuple[int, str, str]]) -> None:
+        """
+        用从数据库读取的全部消息回填缓存，消息数超过上限时不缓存
+
+        Args:
+            session_id: 会话 ID
+            token: get 返回的回填令牌，为 None（Redis 不可用）时不回填
+            owner: 会话所属用户 ID
+            messages: 按序号排列的 (seq, role, content)
+        """
+        if token is None or len(messages) > MAX_MESSAGES:
+            return
+        last_seq = messages[-1][0] if messages else -1
+        try:
+            filled = self._fill(
+                keys=list(self._keys(session_id)),
+                args=[token, "" if owner is None else owner, last_seq, CACHE_TTL] + [self._encode(msg) for msg in messages]
+            )
+        except Exception as e:
+            logger.warning(f"回填会话缓存失败: {e}")
+            self._record("errors")
+            return
+        if filled:
+            self._record("fills")
+
+    def create(self, session_id: str, owner: Optional[int]) -> None:
+        """缓存新建的空会话，第一轮对话不必读数据库"""
+        meta_key = self._keys(session_id)[0]
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.hset(meta_key, mapping={"owner": "" if owner is None else owner, "last_seq": -1})
+            pipe.expire(meta_key, CACHE_TTL)
+            pipe.execute()
+        except Exception as e:
+            logger.warning(f"写入会话缓存失败: {e}")
+            self._record("errors")
+
+    def append(self, session_id: str, messages: List[Tuple[int, str, str]]) -> None:
+        """
+        把已写入数据库的消息追加到缓存
+
+        Args:
+            session_id: 会话 ID
+            messages: 按序号连续排列的 (seq, role, content)
+        """
+        if not messages:
+            return
+        try:
+            length = self._append(
+                keys=list(self._keys(session_id)),
+                args=[messages[0][0] - 1, messages[-1][0], MAX_MESSAGES, CACHE_TTL] + [self._encode(msg) for msg in messages]
+            )
+        except Exception as e:
+            # 缓存可能缺少这些消息，尽量清除，由下次读取重新加载
+            logger.warning(f"追加会话缓存失败: {e}")
+            self._record("errors")
+            self.invalidate(session_id)
+            return
+        if length > 0:
+            self._record("appends")
+        elif length < 0:
+            self._record("invalidations")
+
+    def invalidate(self, session_id: str) -> None:
+        """会话或消息被删除后清除缓存，并使进行中的回填作废"""
+        try:
+            self.redis.delete(*self._keys(session_id))
+        except Exception as e:
+            logger.warning(f"清除会话缓存失败: {e}")
+            self._record("errors")
+
+    def page(self, entry: Dict[str, Any], limit: Optional[int] = None, before: Optional[int] = None) -> Dict[str, Any]:
+        """
+        从缓存的会话中取一页消息，格式与 AIService.get_session 相同
+
+        Args:
+            entry: get 返回的会话
+            limit: 每页条数，为 None 时返回全部
+            before: 只返回序号小于该值的消息
+        """
+        messages = entry["messages"]
+        end = len(messages) if before is None else bisect.bisect_left([msg[0] for msg in messages], before)
+        start = max(0, end - limit) if limit else 0
+        return {
+            "messages": [
+                {"role": role, "content": content, "index": index, "seq": seq}
+                for index, (seq, role, content) in enumerate(messages[start:end], start)
+            ],
+            "total": len(messages),
+            "has_more": start > 0,
+            "next_before": messages[start][0] if start > 0 else None
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        """返回本进程的命中率和写穿计数"""
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats["hits"] + stats["misses"]
+        return {
+            **stats,
+            "hit_rate": round(stats["hits"] / lookups, 4) if lookups else None,
+            "max_messages": MAX_MESSAGES,
+            "ttl": CACHE_TTL
+        }
+
+    def _encode(self, message: Tuple[int, str, str]) -> str:
+        return json.dumps(list(message), ensure_ascii=False)
+
+    def _keys(self, session_id: str) -> Tuple[str, str, str]:
+        prefix = f"{KEY_PREFIX}:{session_id}"
+        return prefix, f"{prefix}:messages", f"{prefix}:lease"
+
+    def _record(self, counter: str) -> None:
+        with self._lock:
+            self._stats[counter] += 1
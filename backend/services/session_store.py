@@ -0,0 +1,509 @@
+import os
+import sys
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 最多保留的会话数，超出时淘汰最久未访问的会话
+MAX_SESSIONS = int(os.getenv("SESSION_STORE_MAX_SESSIONS", 10000))
+# 每个会话最多保留的消息数，超出时丢弃最早的消息
+MAX_MESSAGES = int(os.getenv("SESSION_STORE_MAX_MESSAGES", 200))
+# 消息占用的内存上限（字节）：进程内存储按消息对象的实际大小估算，Redis 存储按消息 JSON 的长度计算
+MAX_BYTES = int(os.getenv("SESSION_STORE_MAX_BYTES", 64 * 1024 * 1024))
+# 会话闲置多久后过期（秒），每次访问后重新计时
+SESSION_TTL = int(os.getenv("SESSION_STORE_TTL", 24 * 3600))
+
+KEY_PREFIX = "chat_session"
+# 按最近访问时间排序的会话索引，用于过期清理和会话数上限的淘汰
+INDEX_KEY = f"{KEY_PREFIX}:index"
+# 各会话消息的字节数（哈希）和全部会话的字节总数，用于内存上限的淘汰
+SIZES_KEY = f"{KEY_PREFIX}:sizes"
+BYTES_KEY = f"{KEY_PREFIX}:bytes"
+# 已删除消息的占位值，用于按位置删除列表元素
+DELETED = "__deleted__"
+
+def _message_size(role: str, content: str) -> int:
+    # 一条消息占用的内存：(role, content) 元组、内容字符串和列表中的指针；role 已驻留，不重复计算
+    return sys.getsizeof((role, content)) + sys.getsizeof(content) + 8
+
+class _MemorySession:
+    """进程内的单个会话：消息以 (role, content) 元组保存，比字典小得多"""
+
+    __slots__ = ("user_id", "messages", "size", "expires_at")
+
+    def __init__(self, user_id: Optional[int], expires_at: float):
+        self.user_id = user_id
+        self.messages: List[Tuple[str, str]] = []
+        self.size = 0
+        self.expires_at = expires_at
+
+class MemorySessionStore:
+    """
+    进程内的会话存储（数据库不可用时使用）
+
+    按最近访问排序的 LRU，会话闲置超过 TTL 后过期；会话数、每个会话的消息数和总内存都有上限，
+    超出时淘汰最久未访问的会话或丢弃最早的消息。所有操作加锁，可在多线程下使用。
+    只在本进程内可见，多个工作进程时应使用 RedisSessionStore。
+    """
+
+    def __init__(self, max_sessions: int = MAX_SESSIONS, max_messages: int = MAX_MESSAGES, max_bytes: int = MAX_BYTES, ttl: int = SESSION_TTL):
+        self.max_sessions = max_sessions
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._sessions: "OrderedDict[str, _MemorySession]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._stats = {"evictions": 0, "expirations": 0, "trimmed_messages": 0}
+
+    def create(self, session_id: str, user_id: Optional[int] = None) -> None:
+        with self._lock:
+            now = time.time()
+            self._expire(now)
+            self._remove(session_id)
+            self._sessions[session_id] = _MemorySession(user_id, now + self.ttl)
+            self._evict()
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """
+        读取会话
+
+        Args:
+            session_id: 会话 ID
+
+        Returns:
+            {"user_id": 用户 ID, "messages": [{"role", "content"}, ...]}，会话不存在或已过期时返回 None
+        """
+        with self._lock:
+            session = self._touch(session_id)
+            if session is None:
+                return None
+            return {
+                "user_id": session.user_id,
+                "messages": [{"role": role, "content": content} for role, content in session.messages]
+            }
+
+    def append(self, session_id: str, messages: List[Dict[str, str]]) -> bool:
+        """
+        追加消息，超出每个会话的消息上限时丢弃最早的消息
+
+        Returns:
+            会话不存在或已过期时返回 False
+        """
+        with self._lock:
+            session = self._touch(session_id)
+            if session is None:
+                return False
+            for msg in messages:
+                role, content = sys.intern(msg.get("role") or ""), msg.get("content") or ""
+                session.messages.append((role, content))
+                self._resize(session, _message_size(role, content))
+            overflow = len(session.messages) - self.max_messages
+            if overflow > 0:
+                for role, content in session.messages[:overflow]:
+                    self._resize(session, -_message_size(role, content))
+                del session.messages[:overflow]
+                self._stats["trimmed_messages"] += overflow
+            self._evict()
+            return True
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            return self._remove(session_id)
+
+    def delete_message(self, session_id: str, index: int) -> bool:
+        """删除会话中指定位置的消息，会话或位置不存在时返回 False"""
+        with self._lock:
+            session = self._touch(session_id)
+            if session is None or index < 0 or index >= len(session.messages):
+                return False
+            role, content = session.messages.pop(index)
+            self._resize(session, -_message_size(role, content))
+            return True
+
+    def list(self, user_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """返回会话 ID 和消息数，最近访问的在前；user_id 为 None 时返回全部会话"""
+        with self._lock:
+            self._expire(time.time())
+            return [
+                {"session_id": session_id, "message_count": len(session.messages)}
+                for session_id, session in reversed(self._sessions.items())
+                if user_id is None or session.user_id == user_id
+            ]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "backend": "memory",
+                "sessions": len(self._sessions),
+                "bytes": self._bytes,
+                **self._stats,
+                "max_sessions": self.max_sessions,
+                "max_messages": self.max_messages,
+                "max_bytes": self.max_bytes,
+                "ttl": self.ttl
+            }
+
+    def _touch(self, session_id: str) -> Optional[_MemorySession]:
+        now = time.time()
+        self._expire(now)
+        session = self._sessions.get(session_id)
+        if session is not None:
+            session.expires_at = now + self.ttl
+            self._sessions.move_to_end(session_id)
+        return session
+
+    def _expire(self, now: float) -> None:
+        # 按访问顺序排列，过期的会话都在最前面
+        while self._sessions:
+            session_id, session = next(iter(self._sessions.items()))
+            if session.expires_at > now:
+                break
+            self._remove(session_id)
+            self._stats["expirations"] += 1
+
+    def _evict(self) -> None:
+        # 至少保留刚访问的会话，单个会话过大时由消息数上限约束
+        while len(self._sessions) > 1 and (len(self._sessions) > self.max_sessions or self._bytes > self.max_bytes):
+            self._remove(next(iter(self._sessions)))
+            self._stats["evictions"] += 1
+
+    def _remove(self, session_id: str) -> bool:
+        session = self._sessions.pop(session_id, None)
+        if session is None:
+            return False
+        self._bytes -= session.size
+        return True
+
+    def _resize(self, session: _MemorySession, delta: int) -> None:
+        session.size += delta
+        self._bytes += delta
+
+# Redis 存储的脚本共用的函数。KEYS 为 [INDEX_KEY, SIZES_KEY, BYTES_KEY]，
+# ARGV 前六项为 [当前时间, TTL, 会话数上限, 字节上限, 键前缀, 会话 ID]；
+# 会话的所属用户、消息和用户索引的键由前缀和会话 ID 拼出
+STORE_LUA = """
+local now, ttl = tonumber(ARGV[1]), tonumber(ARGV[2])
+local max_sessions, max_bytes = tonumber(ARGV[3]), tonumber(ARGV[4])
+local prefix, sid = ARGV[5], ARGV[6]
+local owner_key = prefix .. ':' .. sid .. ':owner'
+local messages_key = prefix .. ':' .. sid .. ':messages'
+
+local function resize(member, delta)
+    if delta ~= 0 then
+        redis.call('HINCRBY', KEYS[2], member, delta)
+        redis.call('INCRBY', KEYS[3], delta)
+    end
+end
+
+-- 删除会话的全部键，并从总索引、用户索引和字节统计中移除
+local function drop(member)
+    local member_owner = prefix .. ':' .. member .. ':owner'
+    local owner = redis.call('GET', member_owner)
+    if owner then
+        redis.call('ZREM', prefix .. ':user:' .. owner, member)
+    end
+    redis.call('DEL', member_owner, prefix .. ':' .. member .. ':messages')
+    redis.call('ZREM', KEYS[1], member)
+    local size = tonumber(redis.call('HGET', KEYS[2], member) or '0')
+    redis.call('HDEL', KEYS[2], member)
+    if size ~= 0 then
+        redis.call('DECRBY', KEYS[3], size)
+    end
+end
+
+-- 刷新会话的 TTL 和在总索引、用户索引中的访问时间；用户索引同时清理已过期的成员
+local function touch(owner)
+    redis.call('EXPIRE', owner_key, ttl)
+    redis.call('EXPIRE', messages_key, ttl)
+    redis.call('ZADD', KEYS[1], now, sid)
+    local user_key = prefix .. ':user:' .. owner
+    redis.call('ZADD', user_key, now, sid)
+    redis.call('ZREMRANGEBYSCORE', user_key, '-inf', now - ttl)
+    redis.call('EXPIRE', user_key, ttl)
+end
+
+-- 清理过期会话，再按最久未访问淘汰直到会话数和字节数都在上限内（保留当前会话）
+local function enforce()
+    local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now - ttl)
+    for _, member in ipairs(expired) do
+        drop(member)
+    end
+    local evicted = 0
+    while redis.call('ZCARD', KEYS[1]) > 1 and (
+        redis.call('ZCARD', KEYS[1]) > max_sessions or tonumber(redis.call('GET', KEYS[3]) or '0') > max_bytes
+    ) do
+        local oldest = redis.call('ZRANGE', KEYS[1], 0, 1)
+        drop(oldest[1] == sid and oldest[2] or oldest[1])
+        evicted = evicted + 1
+    end
+    for i = 1, 3 do
+        redis.call('EXPIRE', KEYS[i], ttl)
+    end
+    return {#expired, evicted}
+end
+"""
+
+# 新建会话（已存在时先删除）；ARGV[7] 为所属用户 ID（匿名为空字符串）
+CREATE_SCRIPT = STORE_LUA + """
+drop(sid)
+redis.call('SET', owner_key, ARGV[7], 'EX', ttl)
+touch(ARGV[7])
+return enforce()
+"""
+
+# 追加消息，超出消息数上限时丢弃最早的消息；ARGV[7] 为每个会话的消息数上限，之后为消息
+APPEND_SCRIPT = STORE_LUA + """
+local owner = redis.call('GET', owner_key)
+if not owner then
+    return {-1, 0, 0}
+end
+local delta = 0
+for i = 8, #ARGV do
+    delta = delta + #ARGV[i]
+end
+local length = redis.call('RPUSH', messages_key, unpack(ARGV, 8))
+local overflow = length - tonumber(ARGV[7])
+if overflow > 0 then
+    for _, item in ipairs(redis.call('LRANGE', messages_key, 0, overflow - 1)) do
+        delta = delta - #item
+    end
+    redis.call('LTRIM', messages_key, overflow, -1)
+else
+    overflow = 0
+end
+resize(sid, delta)
+touch(owner)
+local counts = enforce()
+return {overflow, counts[1], counts[2]}
+"""
+
+# 删除会话，会话不存在时返回 0
+DELETE_SCRIPT = STORE_LUA + """
+if redis.call('EXISTS', owner_key) == 0 then
+    return 0
+end
+drop(sid)
+return 1
+"""
+
+# 删除指定位置的消息：先替换为占位值再删除占位值；ARGV[7] 为位置，ARGV[8] 为占位值
+DELETE_MESSAGE_SCRIPT = STORE_LUA + """
+local owner = redis.call('GET', owner_key)
+if not owner then
+    return 0
+end
+local item = redis.call('LINDEX', messages_key, ARGV[7])
+if not item then
+    return 0
+end
+redis.call('LSET', messages_key, ARGV[7], ARGV[8])
+redis.call('LREM', messages_key, 1, ARGV[8])
+resize(sid, -#item)
+touch(owner)
+return 1
+"""
+
+# 刷新会话的 TTL 和访问时间，会话不存在时不加入索引
+TOUCH_SCRIPT = STORE_LUA + """
+local owner = redis.call('GET', owner_key)
+if not owner then
+    return 0
+end
+touch(owner)
+return 1
+"""
+
+class RedisSessionStore:
+    """
+    基于 Redis 的会话存储（数据库不可用时使用），多个工作进程共享
+
+    每个会话的所属用户和消息列表分别保存为带 TTL 的键，每次访问后重新计时；消息以
+    [role, content] 的 JSON 数组保存。与进程内存储的限制相同：按最近访问时间排序的索引用于
+    清理过期会话，会话数或消息总字节数超出上限时淘汰最久未访问的会话，每个会话的消息数超出
+    上限时丢弃最早的消息。写操作在 Lua 脚本中原子执行，各会话的字节数随之增减；每个用户的
+    会话索引在写入时清理过期成员，并与总索引一样带有 TTL。
+
+    Redis 不可用时改用进程内存储（fallback），会话只在本进程内可见；Redis 恢复后新会话
+    回到 Redis，期间创建的会话仍从进程内存储读取直到过期。
+    """
+
+    def __init__(self, redis_client, max_sessions: int = MAX_SESSIONS, max_messages: int = MAX_MESSAGES, max_bytes: int = MAX_BYTES, ttl: int = SESSION_TTL):
+        self.redis = redis_client
+        self.max_sessions = max_sessions
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._create = redis_client.register_script(CREATE_SCRIPT)
+        self._append = redis_client.register_script(APPEND_SCRIPT)
+        self._delete = redis_client.register_script(DELETE_SCRIPT)
+        self._delete_message = redis_client.register_script(DELETE_MESSAGE_SCRIPT)
+        self._touch_script = redis_client.register_script(TOUCH_SCRIPT)
+        self.fallback = MemorySessionStore(max_sessions, max_messages, max_bytes, ttl)
+        self._lock = threading.Lock()
+        self._stats = {"evictions": 0, "expirations": 0, "trimmed_messages": 0, "redis_errors": 0}
+
+    def create(self, session_id: str, user_id: Optional[int] = None) -> None:
+        try:
+            expired, evicted = self._create(
+                keys=self._store_keys(),
+                args=self._store_args(session_id) + ["" if user_id is None else user_id]
+            )
+        except Exception as e:
+            self._degrade(e)
+            self.fallback.create(session_id, user_id)
+            return
+        self._record(expirations=expired, evictions=evicted)
+
+    def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """
+        读取会话
+
+        Args:
+            session_id: 会话 ID
+
+        Returns:
+            {"user_id": 用户 ID, "messages": [{"role", "content"}, ...]}，会话不存在或已过期时返回 None
+        """
+        try:
+            pipe = self.redis.pipeline()
+            pipe.get(self._owner_key(session_id))
+            pipe.lrange(self._messages_key(session_id), 0, -1)
+            self._touch_script(keys=self._store_keys(), args=self._store_args(session_id), client=pipe)
+            owner, items = pipe.execute()[:2]
+        except Exception as e:
+            self._degrade(e)
+            return self.fallback.get(session_id)
+        if owner is None:
+            return self.fallback.get(session_id)
+        return {
+            "user_id": int(owner) if owner else None,
+            "messages": [self._decode(item) for item in items]
+        }
+
+    def append(self, session_id: str, messages: List[Dict[str, str]]) -> bool:
+        """
+        追加消息，超出每个会话的消息上限时丢弃最早的消息
+
+        Returns:
+            会话不存在或已过期时返回 False
+        """
+        try:
+            if not messages:
+                return bool(self.redis.exists(self._owner_key(session_id))) or self.fallback.append(session_id, messages)
+            trimmed, expired, evicted = self._append(
+                keys=self._store_keys(),
+                args=self._store_args(session_id) + [self.max_messages] + [
+                    json.dumps([msg.get("role"), msg.get("content")], ensure_ascii=False) for msg in messages
+                ]
+            )
+        except Exception as e:
+            self._degrade(e)
+            return self.fallback.append(session_id, messages)
+        if trimmed < 0:
+            return self.fallback.append(session_id, messages)
+        self._record(trimmed_messages=trimmed, expirations=expired, evictions=evicted)
+        return True
+
+    def delete(self, session_id: str) -> bool:
+        deleted = self.fallback.delete(session_id)
+        try:
+            return bool(self._delete(keys=self._store_keys(), args=self._store_args(session_id))) or deleted
+        except Exception as e:
+            self._degrade(e)
+            return deleted
+
+    def delete_message(self, session_id: str, index: int) -> bool:
+        """删除会话中指定位置的消息，会话或位置不存在时返回 False"""
+        if index < 0:
+            return False
+        try:
+            deleted = self._delete_message(keys=self._store_keys(), args=self._store_args(session_id) + [index, DELETED])
+        except Exception as e:
+            self._degrade(e)
+            return self.fallback.delete_message(session_id, index)
+        return bool(deleted) or self.fallback.delete_message(session_id, index)
+
+    def list(self, user_id: Optional[int] = None) -> List[Dict[str, Any]]:
+        """返回会话 ID 和消息数，最近访问的在前；user_id 为 None 时返回全部会话"""
+        key = INDEX_KEY if user_id is None else self._user_key(user_id)
+        try:
+            session_ids = [member.decode() for member in self.redis.zrange(key, 0, -1)]
+            pipe = self.redis.pipeline()
+            for session_id in session_ids:
+                pipe.exists(self._owner_key(session_id))
+                pipe.llen(self._messages_key(session_id))
+                pipe.zscore(INDEX_KEY, session_id)
+            results = pipe.execute()
+        except Exception as e:
+            self._degrade(e)
+            return self.fallback.list(user_id)
+        sessions, stale = [], []
+        for i, session_id in enumerate(session_ids):
+            exists, length, accessed = results[i * 3:i * 3 + 3]
+            if exists:
+                sessions.append((accessed or 0, {"session_id": session_id, "message_count": length}))
+            else:
+                stale.append(session_id)
+        if stale:
+            # 已过期或被淘汰的会话从用户的索引中移除
+            self.redis.zrem(key, *stale)
+        # Redis 不可用期间创建、保存在进程内的会话排在后面
+        return [session for _, session in sorted(sessions, key=lambda item: item[0], reverse=True)] + self.fallback.list(user_id)
+
+    def stats(self) -> Dict[str, Any]:
+        """返回本进程的淘汰和裁剪计数、Redis 中的有效会话数，以及 Redis 不可用期间保存在本进程的会话数"""
+        with self._lock:
+            stats = dict(self._stats)
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.zcount(INDEX_KEY, time.time() - self.ttl, "+inf")
+            pipe.get(BYTES_KEY)
+            sessions, size = pipe.execute()
+            size = int(size or 0)
+        except Exception:
+            sessions = size = None
+        return {
+            "backend": "redis",
+            "sessions": sessions,
+            "bytes": size,
+            "fallback_sessions": self.fallback.stats()["sessions"],
+            **stats,
+            "max_sessions": self.max_sessions,
+            "max_messages": self.max_messages,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl
+        }
+
+    def _store_keys(self) -> List[str]:
+        return [INDEX_KEY, SIZES_KEY, BYTES_KEY]
+
+    def _store_args(self, session_id: str) -> list:
+        return [time.time(), self.ttl, self.max_sessions, self.max_bytes, KEY_PREFIX, session_id]
+
+    def _degrade(self, error: Exception) -> None:
+        logger.warning(f"Redis 会话存储不可用，改用进程内存储: {error}")
+        self._record(redis_errors=1)
+
+    def _record(self, **counts: int) -> None:
+        with self._lock:
+            for name, count in counts.items():
+                self._stats[name] += count
+
+    def _decode(self, item: bytes) -> Dict[str, str]:
+        role, content = json.loads(item)
+        return {"role": role, "content": content}
+
+    def _owner_key(self, session_id: str) -> str:
+        return f"{KEY_PREFIX}:{session_id}:owner"
+
+    def _messages_key(self, session_id: str) -> str:
+        return f"{KEY_PREFIX}:{session_id}:messages"
+
+    def _user_key(self, user_id: Optional[int]) -> str:
+        return f"{KEY_PREFIX}:user:{'' if user_id is None else user_id}"
@@ -0,0 +1,149 @@
+import os
+import math
+import time
+import logging
+from datetime import datetime, timedelta
+from typing import List, Tuple
+from sqlalchemy import func
+from spiders.database_news import UserNewsHistory
+
+logger = logging.getLogger(__name__)
+
+# 热度得分（有序集合，member 为新闻 ID）
+SCORE_KEY = "news_trending:score"
+# 得分的基准时间，得分均以该时间为基准做前向衰减
+EPOCH_KEY = "news_trending:epoch"
+# 已从浏览历史重建的标记；不能用 SCORE_KEY 是否存在来判断，重建前的 record 也会创建 SCORE_KEY，
+# 而浏览历史为空时重建后 SCORE_KEY 仍不存在。标记不过期：重建后得分只靠 record 和衰减维护，
+# 定期重建会丢掉不在浏览历史中的匿名浏览
+BUILT_KEY = "news_trending:built"
+# 重建时暂存历史得分的键
+REBUILD_KEY = "news_trending:rebuild"
+# 重建得分时的互斥锁
+REBUILD_LOCK_KEY = "news_trending:rebuild_lock"
+
+# 热度半衰期（小时）
+HALF_LIFE_HOURS = float(os.getenv("TRENDING_HALF_LIFE_HOURS", 6))
+# 从浏览历史重建得分时回溯的时间窗口（小时）
+WINDOW_HOURS = int(os.getenv("TRENDING_WINDOW_HOURS", 72))
+
+DECAY_RATE = math.log(2) / (HALF_LIFE_HOURS * 3600)
+
+# 前向衰减：每次浏览加 exp(λ(t - epoch))，排序等价于按 exp(-λ(now - t)) 衰减后的得分。
+# 权重超过 RESCALE_THRESHOLD 时把全部得分按比例缩小并把 epoch 移到当前时间，
+# 同时删除缩小后低于 PRUNE_SCORE 的过期新闻。整个过程在 Lua 中原子执行。
+RECORD_SCRIPT = """
+local now = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local epoch = tonumber(redis.call('GET', KEYS[2]))
+if not epoch then
+    epoch = now
+    redis.call('SET', KEYS[2], now)
+end
+local weight = math.exp(rate * (now - epoch))
+if weight > tonumber(ARGV[4]) then
+    redis.call('ZUNIONSTORE', KEYS[1], 1, KEYS[1], 'WEIGHTS', 1 / weight)
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', '(' .. ARGV[5])
+    redis.call('SET', KEYS[2], now)
+    weight = 1
+end
+return redis.call('ZINCRBY', KEYS[1], weight * tonumber(ARGV[3]), ARGV[6])
+"""
+
+# 合并重建的得分：重建前 record 记下的得分换算到以当前时间为基准，与历史得分取较大值，
+# 既保留不在浏览历史中的匿名浏览，也不重复计算已登录用户的浏览；随后设置重建标记
+REBUILD_SCRIPT = """
+local now = tonumber(ARGV[1])
+local epoch = tonumber(redis.call('GET', KEYS[2]) or ARGV[1])
+local scale = math.exp(-tonumber(ARGV[2]) * (now - epoch))
+redis.call('ZUNIONSTORE', KEYS[1], 2, KEYS[1], KEYS[3], 'WEIGHTS', scale, 1, 'AGGREGATE', 'MAX')
+redis.call('DEL', KEYS[3])
+redis.call('SET', KEYS[2], now)
+redis.call('SET', KEYS[4], 1)
+return redis.call('ZCARD', KEYS[1])
+"""
+
+RESCALE_THRESHOLD = 1e6
+PRUNE_SCORE = 1e-3
+
+class TrendingRanking:
+    """
+    按时间衰减的新闻热度排行
+
+    每次浏览以 O(log n) 增量更新 Redis 有序集合，读取时无需重新扫描历史；
+    排行丢失时从最近 WINDOW_HOURS 小时的 user_news_history 按小时聚合重建。
+    """
+
+    def __init__(self, redis_client):
+        self.redis = redis_client
+        self._record = redis_client.register_script(RECORD_SCRIPT)
+        self._rebuild = redis_client.register_script(REBUILD_SCRIPT)
+
+    def record(self, news_id: int, weight: float = 1.0) -> None:
+        """记录一次浏览"""
+        self._record(
+            keys=[SCORE_KEY, EPOCH_KEY],
+            args=[time.time(), DECAY_RATE, weight, RESCALE_THRESHOLD, PRUNE_SCORE, news_id]
+        )
+
+    def top(self, offset: int, limit: int) -> List[Tuple[int, float]]:
+        """
+        按热度返回 (新闻 ID, 当前衰减得分) 列表
+
+        Args:
+            offset: 起始位置
+            limit: 数量
+
+        Returns:
+            热度从高到低的新闻 ID 和得分
+        """
+        rows = self.redis.zrevrange(SCORE_KEY, offset, offset + limit - 1, withscores=True)
+        epoch = float(self.redis.get(EPOCH_KEY) or time.time())
+        # 换算为以当前时间为基准的得分，便于展示和比较
+        scale = math.exp(-DECAY_RATE * (time.time() - epoch))
+        return [(int(member), round(score * scale, 4)) for member, score in rows]
+
+    def count(self) -> int:
+        return self.redis.zcard(SCORE_KEY)
+
+    def is_built(self) -> bool:
+        """排行已从浏览历史重建（首次启动或 Redis 丢失数据后需要重建）"""
+        return bool(self.redis.exists(BUILT_KEY))
+
+    def rebuild(self, db) -> int:
+        """
+        从浏览历史重建热度排行
+
+        Args:
+            db: 数据库会话
+
+        Returns:
+            进入排行的新闻数量；其他进程正在重建时返回 0
+        """
+        if not self.redis.set(REBUILD_LOCK_KEY, 1, nx=True, ex=60):
+            return 0
+        try:
+            now = datetime.utcnow()
+            hour = func.date_format(UserNewsHistory.viewed_at, "%Y-%m-%d %H:00:00")
+            rows = db.query(
+                UserNewsHistory.news_id, hour.label("hour"), func.count(UserNewsHistory.id).label("views")
+            ).filter(
+                UserNewsHistory.viewed_at >= now - timedelta(hours=WINDOW_HOURS)
+            ).group_by(UserNewsHistory.news_id, hour).all()
+
+            # 以当前时间为 epoch，各小时桶按距今时长衰减后累加
+            scores = {}
+            for row in rows:
+                age = (now - datetime.strptime(row.hour, "%Y-%m-%d %H:%M:%S")).total_seconds()
+                scores[row.news_id] = scores.get(row.news_id, 0.0) + row.views * math.exp(-DECAY_RATE * age)
+
+            pipe = self.redis.pipeline()
+            pipe.delete(REBUILD_KEY)
+            if scores:
+                pipe.zadd(REBUILD_KEY, scores)
+            self._rebuild(keys=[SCORE_KEY, EPOCH_KEY, REBUILD_KEY, BUILT_KEY], args=[time.time(), DECAY_RATE], client=pipe)
+            count = pipe.execute()[-1]
+            logger.info(f"热度排行已从浏览历史重建，共 {count} 条新闻")
+            return count
+        finally:
+            self.redis.delete(REBUILD_LOCK_KEY)
@@ -1,15 +1,22 @@
-from sqlalchemy.orm import Session
+from sqlalchemy.orm import Session, joinedload
 from sqlalchemy import desc, or_
-from spiders.database_news import User, UserNewsFavorites, UserNewsHistory, News, Session
+from spiders.database_news import User, UserNewsFavorites, UserNewsHistory, News, Session, on_primary
 from typing import List, Optional, Dict, Any
 from datetime import datetime
 import hashlib
 from extensions import bcrypt
 
+# 收藏和浏览历史列表可返回的新闻字段
+USER_NEWS_FIELDS = (
+    "id", "title", "content", "source", "publish_time", "views",
+    "has_image", "image_url", "summary"
+)
+
 class UserService:
     def __init__(self, db: Session):
         self.db = db
     
+    @on_primary
     def register_user(self, username: str, email: str, password: str, avatar: Optional[str] = None) -> Optional[Dict[str, Any]]:
         """
         用户注册
@@ -86,6 +93,7 @@ class UserService:
         }
     
 
+    @on_primary
     def add_favorite(self, user_id: int, news_id: int) -> bool:
         """
         添加收藏
@@ -113,6 +121,7 @@ class UserService:
         
         return True
     
+    @on_primary
     def remove_favorite(self, user_id: int, news_id: int) -> bool:
         """
         取消收藏
@@ -137,7 +146,7 @@ class UserService:
         
         return True
     
-    def get_favorites(self, user_id: int, page: int = 1, page_size: int = 20) -> Dict[str, Any]:
+    def get_favorites(self, user_id: int, page: int = 1, page_size: int = 20, fields: Optional[tuple] = None) -> Dict[str, Any]:
         """
         获取用户收藏列表
         
@@ -145,6 +154,7 @@ class UserService:
             user_id: 用户ID
             page: 页码
             page_size: 每页数量
+            fields: 返回的新闻字段，None 表示全部字段
             
         Returns:
             收藏列表和分页信息
@@ -156,24 +166,18 @@ class UserService:
         total = query.count()
         total_pages = (total + page_size - 1) // page_size
         
-        favorites = query.offset((page - 1) * page_size).limit(page_size).all()
+        # 新闻随收藏记录一起 JOIN 读取，且只读取请求的列
+        favorites = query.options(
+            joinedload(UserNewsFavorites.news).load_only(*self._news_columns(fields))
+        ).offset((page - 1) * page_size).limit(page_size).all()
         
         # 获取新闻详情
         news_list = []
         for fav in favorites:
             if fav.news:
-                news_list.append({
-                    "id": fav.news.id,
-                    "title": fav.news.title,
-                    "content": fav.news.content,
-                    "source": fav.news.source,
-                    "publish_time": fav.news.publish_time.isoformat() if fav.news.publish_time else None,
-                    "views": fav.news.views,
-                    "has_image": fav.news.has_image,
-                    "image_url": fav.news.image_url,
-                    "summary": fav.news.summary,
-                    "favorited_at": fav.created_at.isoformat() if fav.created_at else None
-                })
+                item = self._format_news(fav.news, fields)
+                item["favorited_at"] = fav.created_at.isoformat() if fav.created_at else None
+                news_list.append(item)
         
         return {
             "news": news_list,
@@ -203,6 +207,7 @@ class UserService:
         
         return favorite is not None
     
+    @on_primary
     def add_history(self, user_id: int, news_id: int) -> bool:
         """
         添加浏览历史
@@ -221,7 +226,7 @@ class UserService:
         
         return True
     
-    def get_history(self, user_id: int, page: int = 1, page_size: int = 20) -> Dict[str, Any]:
+    def get_history(self, user_id: int, page: int = 1, page_size: int = 20, fields: Optional[tuple] = None) -> Dict[str, Any]:
         """
         获取用户浏览历史
         
@@ -229,6 +234,7 @@ class UserService:
             user_id: 用户ID
             page: 页码
             page_size: 每页数量
+            fields: 返回的新闻字段，None 表示全部字段
             
         Returns:
             浏览历史列表和分页信息
@@ -240,24 +246,18 @@ class UserService:
         total = query.count()
         total_pages = (total + page_size - 1) // page_size
         
-        history_list = query.offset((page - 1) * page_size).limit(page_size).all()
+        # 新闻随浏览记录一起 JOIN 读取，且只读取请求的列
+        history_list = query.options(
+            joinedload(UserNewsHistory.news).load_only(*self._news_columns(fields))
+        ).offset((page - 1) * page_size).limit(page_size).all()
         
         # 获取新闻详情
         news_list = []
         for hist in history_list:
             if hist.news:
-                news_list.append({
-                    "id": hist.news.id,
-                    "title": hist.news.title,
-                    "content": hist.news.content,
-                    "source": hist.news.source,
-                    "publish_time": hist.news.publish_time.isoformat() if hist.news.publish_time else None,
-                    "views": hist.news.views,
-                    "has_image": hist.news.has_image,
-                    "image_url": hist.news.image_url,
-                    "summary": hist.news.summary,
-                    "viewed_at": hist.viewed_at.isoformat() if hist.viewed_at else None
-                })
+                item = self._format_news(hist.news, fields)
+                item["viewed_at"] = hist.viewed_at.isoformat() if hist.viewed_at else None
+                news_list.append(item)
         
         return {
             "news": news_list,
@@ -292,3 +292,17 @@ class UserService:
             }
             for session in sessions
         ]
+    
+    def _news_columns(self, fields: Optional[tuple] = None) -> list:
+        """收藏和浏览历史需要读取的新闻列"""
+        columns = [getattr(News, field) for field in fields or USER_NEWS_FIELDS if field != "id"]
+        return columns or [News.id]
+    
+    def _format_news(self, news: News, fields: Optional[tuple] = None) -> Dict[str, Any]:
+        item = {}
+        for field in fields or USER_NEWS_FIELDS:
+            if field == "publish_time":
+                item[field] = news.publish_time.isoformat() if news.publish_time else None
+            else:
+                item[field] = getattr(news, field)
+        return item
@@ -0,0 +1,162 @@
+import os
+import logging
+import threading
+from typing import Dict, List, Optional
+from sqlalchemy import text
+from spiders.database_news import News
+
+logger = logging.getLogger(__name__)
+
+# 全部新闻的阅读量排行（有序集合，member 为新闻 ID，score 为阅读量）
+RANK_KEY = "news_views:rank"
+# 排行已从数据库加载的标记；不能用 RANK_KEY 是否存在来判断，
+# 未加载时的 add 也会创建 RANK_KEY
+SEEDED_KEY = "news_views:seeded"
+# 尚未写回 MySQL 的阅读量增量（哈希，field 为新闻 ID）
+PENDING_KEY = "news_views:pending"
+# 正在写回的增量批次
+FLUSHING_KEY = "news_views:flushing"
+# 多个工作进程之间的写回锁
+FLUSH_LOCK_KEY = "news_views:flush_lock"
+
+# 写回间隔（秒）
+FLUSH_INTERVAL = float(os.getenv("VIEW_FLUSH_INTERVAL", 5))
+# 写回锁的超时时间（秒），防止进程崩溃后锁无法释放
+FLUSH_LOCK_TTL = 60
+
+class ViewCounter:
+    """
+    基于 Redis 的新闻阅读量计数器
+
+    阅读量累加只写 Redis（ZINCRBY 排行 + HINCRBY 增量），热门新闻直接读
+    排行有序集合；后台线程定期把累计的增量批量写回 news.views。
+    """
+
+    def __init__(self, redis_client):
+        self.redis = redis_client
+        self._stop = threading.Event()
+        self._thread = None
+
+    def increment(self, news_id: int) -> Optional[int]:
+        """
+        阅读量加 1
+
+        Args:
+            news_id: 新闻 ID
+
+        Returns:
+            最新阅读量；新闻不在排行中时返回 None，由调用方确认新闻是否存在
+        """
+        if self.redis.zscore(RANK_KEY, news_id) is None:
+            return None
+        return self._incr(news_id)
+
+    def add(self, news_id: int, views: int) -> int:
+        """把数据库中已确认存在的新闻加入排行后再加 1"""
+        self.redis.zadd(RANK_KEY, {news_id: views}, nx=True)
+        return self._incr(news_id)
+
+    def top(self, limit: int) -> List[tuple]:
+        """返回阅读量最高的 (新闻 ID, 阅读量) 列表"""
+        rows = self.redis.zrevrange(RANK_KEY, 0, limit - 1, withscores=True)
+        return [(int(member), int(score)) for member, score in rows]
+
+    def is_seeded(self) -> bool:
+        """排行已从数据库加载且仍在 Redis 中（Redis 重启或淘汰后需要重新加载）"""
+        return self.redis.exists(SEEDED_KEY, RANK_KEY) == 2
+
+    def seed(self, db) -> int:
+        """
+        从数据库加载全部新闻的阅读量到排行中
+
+        Args:
+            db: 数据库会话
+
+        Returns:
+            加载的新闻数量
+        """
+        rows = db.query(News.id, News.views).all()
+        pipe = self.redis.pipeline()
+        for start in range(0, len(rows), 1000):
+            chunk = {row.id: row.views or 0 for row in rows[start:start + 1000]}
+            # 只补充不存在的成员，不覆盖 Redis 中更新的计数
+            pipe.zadd(RANK_KEY, chunk, nx=True)
+        pipe.set(SEEDED_KEY, 1)
+        pipe.execute()
+        return len(rows)
+
+    def flush(self, db) -> int:
+        """
+        把累计的阅读量增量批量写回数据库
+
+        Args:
+            db: 数据库会话
+
+        Returns:
+            写回的新闻数量
+        """
+        if not self.redis.set(FLUSH_LOCK_KEY, 1, nx=True, ex=FLUSH_LOCK_TTL):
+            return 0
+        try:
+            # 上一批写回失败时先重试上一批，否则把当前增量整体转移到写回批次
+            if not self.redis.exists(FLUSHING_KEY):
+                try:
+                    self.redis.rename(PENDING_KEY, FLUSHING_KEY)
+                except Exception:
+                    # PENDING_KEY 不存在，没有需要写回的增量
+                    return 0
+            deltas: Dict[bytes, bytes] = self.redis.hgetall(FLUSHING_KEY)
+            if deltas:
+                db.execute(
+                    text("UPDATE news SET views = views + :delta WHERE id = :id"),
+                    [{"id": int(news_id), "delta": int(delta)} for news_id, delta in deltas.items()]
+                )
+                db.commit()
+            self.redis.delete(FLUSHING_KEY)
+            return len(deltas)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            self.redis.delete(FLUSH_LOCK_KEY)
+
+    def start_flusher(self, session_factory) -> None:
+        """启动后台写回线程"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(
+            target=self._run_flusher, args=(session_factory,), name="view-flusher", daemon=True
+        )
+        self._thread.start()
+
+    def stop_flusher(self, session_factory=None) -> None:
+        """停止后台写回线程，传入 session_factory 时最后再写回一次"""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=FLUSH_INTERVAL + 1)
+            self._thread = None
+        if session_factory is not None:
+            self._flush_once(session_factory)
+
+    def _incr(self, news_id: int) -> int:
+        pipe = self.redis.pipeline()
+        pipe.zincrby(RANK_KEY, 1, news_id)
+        pipe.hincrby(PENDING_KEY, news_id, 1)
+        score, _ = pipe.execute()
+        return int(score)
+
+    def _run_flusher(self, session_factory) -> None:
+        while not self._stop.wait(FLUSH_INTERVAL):
+            self._flush_once(session_factory)
+
+    def _flush_once(self, session_factory) -> None:
+        db = session_factory()
+        try:
+            # Redis 重启后排行会丢失，需要重新从数据库加载
+            if not self.is_seeded():
+                logger.info(f"阅读量排行已加载 {self.seed(db)} 条新闻")
+            self.flush(db)
+        except Exception as e:
+            logger.error(f"阅读量写回失败: {e}")
+        finally:
+            db.close()
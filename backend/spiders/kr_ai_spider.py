@@ -181,7 +181,9 @@ def crawl_36kr_ai():
     
     # 初始化数据库连接
     try:
-        from spiders.database_news import SessionLocal, News, NewsCategory, NewsCategoryRelation
+        from spiders.database_news import SessionLocal, News, NewsCategory, NewsCategoryRelation, NewsDuplicate
+        from services.news_cache import bump_generations_from_env
+        from services.duplicate_detector import simhash, to_db, load_index
         db = SessionLocal()
     except Exception as e:
         logger.error(f'数据库连接失败: {e}')
@@ -198,6 +200,9 @@ def crawl_36kr_ai():
         ai_category_id = ai_category.id
         logger.info(f'AI分类ID: {ai_category_id}')
         
+        # 加载已有新闻的指纹，用于识别不同URL下的同一稿件
+        duplicate_index = load_index(db)
+        
         # 抓取列表页
         response = requests.get(AI_CHANNEL_URL, headers=HEADERS, timeout=10)
         response.raise_for_status()
@@ -240,6 +245,9 @@ def crawl_36kr_ai():
                 if existing_news:
                     logger.info(f'新闻已存在: {title}')
                     continue
+                if db.query(NewsDuplicate).filter_by(url=url).first():
+                    logger.info(f'新闻已判定为重复: {title}')
+                    continue
                 
                 # 抓取详情页正文
                 content = parse_detail(url)
@@ -249,6 +257,15 @@ def crawl_36kr_ai():
                     logger.warning(f'正文过短，跳过: {title}')
                     continue
                 
+                # 近似重复检测：同一稿件换URL转载时只记录链接，不重复入库
+                fingerprint = simhash(title, content)
+                duplicate = duplicate_index.find(fingerprint)
+                if duplicate:
+                    db.add(NewsDuplicate(url=url, news_id=duplicate[0], distance=duplicate[1]))
+                    db.commit()
+                    logger.info(f'近似重复新闻（与ID {duplicate[0]} 距离 {duplicate[1]}），跳过: {title}')
+                    continue
+                
                 # 创建新闻对象
                 news = News(
                     title=title,
@@ -258,7 +275,8 @@ def crawl_36kr_ai():
                     publish_time=publish_time,
                     url=url,
                     has_image=1 if '<img' in content else 0,
-                    image_url=None  # 36氪图片使用懒加载，这里不提取具体图片URL
+                    image_url=None,  # 36氪图片使用懒加载，这里不提取具体图片URL
+                    simhash=to_db(fingerprint)
                 )
                 
                 # 添加分类关联
@@ -267,6 +285,9 @@ def crawl_36kr_ai():
                 # 保存到数据库
                 db.add(news)
                 db.commit()
+                duplicate_index.add(news.id, fingerprint)
+                # 新闻入库后使列表、详情、相关新闻和分类/标签缓存失效；相关新闻增量更新后再失效一次
+                bump_generations_from_env('news', 'detail', 'related', 'taxonomy')
                 logger.info(f'成功抓取新闻: {title}')
                 
                 # 礼貌延时
@@ -283,6 +304,13 @@ def crawl_36kr_ai():
         logger.error(f'抓取过程失败: {e}')
     finally:
         db.close()
+    
+    # 把本次新入库的新闻增量并入相关新闻
+    try:
+        from services.related_news import update as update_related_news
+        update_related_news()
+    except Exception as e:
+        logger.error(f'相关新闻更新失败: {e}')
 
 if __name__ == '__main__':
     try:
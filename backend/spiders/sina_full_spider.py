@@ -198,7 +198,7 @@ def init_database():
     """初始化数据库表结构和分类数据"""
     try:
         # 尝试导入数据库模块
-        from database_news import SessionLocal, Base, engine, NewsCategory
+        from spiders.database_news import SessionLocal, Base, engine, NewsCategory
         
         # 创建表结构
         Base.metadata.create_all(bind=engine)
@@ -260,7 +260,16 @@ def run_spider():
     # 初始化数据库
     init_database()
     
-    from database_news import SessionLocal, News, NewsCategory, NewsTag
+    from spiders.database_news import SessionLocal, News, NewsCategory, NewsTag, NewsDuplicate
+    from services.news_cache import bump_generations_from_env
+    from services.duplicate_detector import simhash, to_db, load_index
+    
+    # 加载已有新闻的指纹，用于识别不同URL下的同一稿件
+    db = SessionLocal()
+    try:
+        duplicate_index = load_index(db)
+    finally:
+        db.close()
     
     for category_name, lid in CATEGORY_MAP.items():
         logger.info(f'开始抓取分类: {category_name} (lid: {lid})')
@@ -302,6 +311,9 @@ def run_spider():
                         if existing_news:
                             logger.info(f'新闻已存在: {title}')
                             continue
+                        if db.query(NewsDuplicate).filter_by(url=url).first():
+                            logger.info(f'新闻已判定为重复: {title}')
+                            continue
                     finally:
                         db.close()
                     
@@ -325,6 +337,22 @@ def run_spider():
                         logger.info(f'新闻发布时间早于2026年1月1日，跳过: {title}')
                         continue
                     
+                    # 近似重复检测：同一稿件换URL转载时只记录链接，不重复入库
+                    fingerprint = simhash(title, content)
+                    duplicate = duplicate_index.find(fingerprint)
+                    if duplicate:
+                        db = SessionLocal()
+                        try:
+                            db.add(NewsDuplicate(url=url, news_id=duplicate[0], distance=duplicate[1]))
+                            db.commit()
+                            logger.info(f'近似重复新闻（与ID {duplicate[0]} 距离 {duplicate[1]}），跳过: {title}')
+                        except Exception as e:
+                            db.rollback()
+                            logger.error(f'记录重复新闻失败: {e}')
+                        finally:
+                            db.close()
+                        continue
+                    
                     # 处理图片
                     has_image = 1 if img else 0
                     image_url = None
@@ -346,7 +374,8 @@ def run_spider():
                             publish_time=publish_time,
                             url=url,
                             has_image=has_image,
-                            image_url=image_url
+                            image_url=image_url,
+                            simhash=to_db(fingerprint)
                         )
                         
                         # 添加分类
@@ -367,6 +396,9 @@ def run_spider():
                         
                         db.add(news)
                         db.commit()
+                        duplicate_index.add(news.id, fingerprint)
+                        # 新闻入库后使列表、详情、相关新闻和分类/标签缓存失效；相关新闻增量更新后再失效一次
+                        bump_generations_from_env('news', 'detail', 'related', 'taxonomy')
                         logger.info(f'成功抓取新闻: {title}')
                     except Exception as e:
                         db.rollback()
@@ -386,6 +418,13 @@ def run_spider():
             continue
     
     logger.info('新浪财经新闻抓取完成')
+    
+    # 把本次新入库的新闻增量并入相关新闻
+    try:
+        from services.related_news import update as update_related_news
+        update_related_news()
+    except Exception as e:
+        logger.error(f'相关新闻更新失败: {e}')
 
 if __name__ == '__main__':
     try:
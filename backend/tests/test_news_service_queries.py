@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+from spiders.database_news import Base, News, NewsCategory, NewsTag
+from services.news_service import NewsService
+from services.search_engine import LikeSearchEngine
+
+# 一页新闻的查询数：COUNT、新闻列表、分类和标签各一条批量查询，与 page_size 无关
+EXPECTED_QUERIES = 4
+
+@pytest.fixture(scope="module")
+def db():
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    category = NewsCategory(name="财经", slug="finance")
+    tag = NewsTag(name="市场", slug="market")
+    now = datetime(2024, 1, 1)
+    for i in range(150):
+        session.add(News(
+            title=f"市场新闻 {i}",
+            content=f"正文 {i}",
+            source="test",
+            publish_time=now - timedelta(minutes=i),
+            views=i % 7,
+            url=f"https://example.com/{i}",
+            categories=[category],
+            tags=[tag]
+        ))
+    session.commit()
+    yield session
+    session.close()
+
+def count_queries(db, call):
+    statements = []
+    listener = lambda conn, cursor, statement, *args: statements.append(statement)
+    engine = db.get_bind()
+    event.listen(engine, "before_cursor_execute", listener)
+    try:
+        result = call()
+    finally:
+        event.remove(engine, "before_cursor_execute", listener)
+    return result, len(statements)
+
+@pytest.mark.parametrize("path", ["list", "search", "category", "tag"])
+def test_query_count_does_not_grow_with_page_size(db, path):
+    service = NewsService(db, search_engine=LikeSearchEngine())
+    category_id = db.query(NewsCategory.id).scalar()
+    tag_id = db.query(NewsTag.id).scalar()
+    calls = {
+        "list": lambda size: service.get_news_list(page_size=size),
+        "search": lambda size: service.search_news("市场", page_size=size),
+        "category": lambda size: service.get_news_by_category(category_id, page_size=size),
+        "tag": lambda size: service.get_news_by_tag(tag_id, page_size=size)
+    }
+
+    for page_size in (10, 100):
+        db.expire_all()
+        result, queries = count_queries(db, lambda: calls[path](page_size))
+        assert len(result["news"]) == page_size
+        assert all(item["categories"] and item["tags"] for item in result["news"])
+        assert queries == EXPECTED_QUERIES
+
+def test_search_cursor_follows_views_sort(db):
+    service = NewsService(db, search_engine=LikeSearchEngine())
+    seen, cursor = [], ""
+    while cursor is not None:
+        result = service.search_news("市场", page_size=40, cursor=cursor, sort="views")
+        seen += [(item["views"], item["id"]) for item in result["news"]]
+        cursor = result["pagination"]["next_cursor"]
+    assert len(seen) == 150
+    assert seen == sorted(seen, reverse=True)
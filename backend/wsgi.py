@@ -0,0 +1,7 @@
+"""
+WSGI 入口
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+"""
+
+from main import app